@@ -0,0 +1,753 @@
+#!/usr/bin/env python3
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import gzip
+import io
+import json
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TextIO
+
+import numpy as np
+
+from bgzf import open_bgzf_writer
+from classes import IndexedVariantTable, PathObj, VariantTable, VariantTableBuilder
+from giab_evaluator import (
+    RUN_ID_PLACEHOLDER,
+    compare_variant_score,
+    compare_variant_tables,
+    logger,
+    parse_arguments as parse_evaluator_arguments,
+    run_with_arguments,
+)
+from util import ScoredRecord, count_variants, parse_sub_score_names, parse_vcf
+
+description = """
+Benchmark the evaluator on synthetic results folders.
+
+A pair of results folders is generated per size and compression, with scored
+SNV and SV VCFs where a given fraction of variants is present in only one run
+or is differently scored. Each benchmark then runs in a fresh process,
+measuring wall time, CPU time, peak RSS and throughput, and all results are
+written as JSON so that they can be compared across commits.
+"""
+
+# Bump on any change to the layout of the results JSON
+SCHEMA_VERSION = 1
+# INFO patterns of the regular expression parser
+RANK_SCORE_PATTERN = re.compile("RankScore=.+:(-?\\w+);")
+RANK_SUB_SCORES_PATTERN = re.compile("RankResult=(-?\\d+(\\|-?\\d+)+)")
+
+COMPRESSIONS = ["bgzf", "gzip"]
+CONTIGS = [f"chr{nbr}" for nbr in range(1, 23)] + ["chrX", "chrY"]
+SAMPLES = ["proband", "mother", "father"]
+GENOTYPES = ["0/1", "0/1", "1/1", "0/0"]
+SUB_SCORE_NAMES = [
+    "Gene_intolerance_prediction",
+    "Inheritance_Models",
+    "Consequence",
+    "Conservation",
+    "Allele_Frequency",
+    "Variant_call_quality_filter",
+]
+SV_TYPES = ["DEL", "DUP", "INV"]
+# Mean distance between generated variants on a contig
+MEAN_SPACING = 300
+DATASET_FILE = "dataset.json"
+RUN_ID1 = "bench_r1"
+RUN_ID2 = "bench_r2"
+
+
+def get_header_lines(is_sv: bool) -> List[str]:
+    header = ["##fileformat=VCFv4.2"]
+    header.extend(f"##contig=<ID={contig},length=250000000>" for contig in CONTIGS)
+    if is_sv:
+        header.append(
+            '##INFO=<ID=SVTYPE,Number=1,Type=String,Description="Type of structural variant">'
+        )
+        header.append(
+            '##INFO=<ID=END,Number=1,Type=Integer,Description="End position of the variant">'
+        )
+    else:
+        header.append(
+            '##INFO=<ID=CSQ,Number=.,Type=String,Description="Consequence annotations from Ensembl VEP. Format: Allele|Consequence|IMPACT|SYMBOL|Gene|Feature_type|Feature|HGVSc|HGVSp|DISTANCE">'
+        )
+    header.append(
+        '##INFO=<ID=RankScore,Number=.,Type=String,Description="The rank score for this variant in this family. family_id:rank_score.">'
+    )
+    header.append(
+        '##INFO=<ID=RankResult,Number=.,Type=String,Description="{}">'.format(
+            "|".join(SUB_SCORE_NAMES)
+        )
+    )
+    header.append('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">')
+    header.append(
+        "\t".join(
+            ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT"]
+            + SAMPLES
+        )
+    )
+    return header
+
+
+def format_record(
+    contig: str,
+    pos: int,
+    ref: str,
+    alt: str,
+    info: str,
+    sub_scores: List[int],
+    genotypes: str,
+) -> str:
+    return "\t".join(
+        [
+            contig,
+            str(pos),
+            ".",
+            ref,
+            alt,
+            "50",
+            "PASS",
+            "{};RankScore=bench:{};RankResult={}".format(
+                info, sum(sub_scores), "|".join(str(score) for score in sub_scores)
+            ),
+            "GT",
+            genotypes,
+        ]
+    )
+
+
+def get_csq(pos: int, ref: str, alt: str, csq_length: int) -> str:
+    """VEP-like consequence annotation of at least 'csq_length' characters"""
+    transcripts: List[str] = []
+    length = len("CSQ=")
+    while length < csq_length:
+        transcript_nbr = pos + len(transcripts)
+        transcript = "|".join(
+            [
+                alt,
+                "missense_variant",
+                "MODERATE",
+                f"GENE{pos % 997}",
+                f"ENSG{pos:011d}",
+                "Transcript",
+                f"ENST{transcript_nbr:011d}",
+                f"ENST{transcript_nbr:011d}.1:c.{pos % 5000}{ref}>{alt}",
+                f"ENSP{transcript_nbr:011d}.1:p.Arg{pos % 800}Gly",
+                str(len(transcripts)),
+            ]
+        )
+        transcripts.append(transcript)
+        length += len(transcript) + 1
+    return "CSQ=" + ",".join(transcripts)
+
+
+def iter_record_pairs(
+    nbr_records: int,
+    is_sv: bool,
+    presence_diff: float,
+    score_diff: float,
+    csq_length: int,
+    rng: random.Random,
+) -> Iterator[Tuple[Optional[str], Optional[str]]]:
+    """
+    Coordinate-sorted records of both runs. A record is only in r1 or only in
+    r2 with probability 'presence_diff', split evenly, and has a changed sub
+    score in r2 with probability 'score_diff'. SNVs get a CSQ annotation
+    of about 'csq_length' characters, if above zero.
+    """
+
+    per_contig = -(-nbr_records // len(CONTIGS))
+    nbr_left = nbr_records
+    for contig in CONTIGS:
+        pos = 0
+        for _ in range(min(per_contig, nbr_left)):
+            pos += rng.randint(1, 2 * MEAN_SPACING)
+            if is_sv:
+                sv_type = rng.choice(SV_TYPES)
+                ref = "N"
+                alt = f"<{sv_type}>"
+                info = f"SVTYPE={sv_type};END={pos + rng.randint(50, 50000)}"
+            else:
+                ref = rng.choice("ACGT")
+                alt = rng.choice([base for base in "ACGT" if base != ref])
+                if rng.random() < 0.1:
+                    alt = ref + "".join(rng.choice("ACGT") for _ in range(4))
+                info = f"DP={rng.randint(10, 60)}"
+                if csq_length > 0:
+                    info += ";" + get_csq(pos, ref, alt, csq_length)
+            sub_scores = [rng.randint(-4, 8) for _ in SUB_SCORE_NAMES]
+            genotypes = "\t".join(rng.choice(GENOTYPES) for _ in SAMPLES)
+            r1_line = format_record(contig, pos, ref, alt, info, sub_scores, genotypes)
+
+            draw = rng.random()
+            if draw < presence_diff / 2:
+                yield r1_line, None
+            elif draw < presence_diff:
+                yield None, r1_line
+            elif draw < presence_diff + score_diff:
+                changed_index = rng.randrange(len(sub_scores))
+                sub_scores[changed_index] += rng.choice([-3, -2, -1, 1, 2, 3])
+                yield r1_line, format_record(
+                    contig, pos, ref, alt, info, sub_scores, genotypes
+                )
+            else:
+                yield r1_line, r1_line
+        nbr_left -= min(per_contig, nbr_left)
+
+
+def open_vcf_writer(path: Path, compression: str) -> TextIO:
+    if compression == "bgzf":
+        return io.TextIOWrapper(open_bgzf_writer(path))
+    return gzip.open(path, "wt")
+
+
+def write_vcf_pair(
+    r1_path: Path,
+    r2_path: Path,
+    compression: str,
+    nbr_records: int,
+    is_sv: bool,
+    presence_diff: float,
+    score_diff: float,
+    csq_length: int,
+    rng: random.Random,
+) -> Tuple[int, int]:
+    """Write the scored VCFs of both runs, returning their numbers of records"""
+    nbr_r1 = 0
+    nbr_r2 = 0
+    with open_vcf_writer(r1_path, compression) as r1_fh, open_vcf_writer(
+        r2_path, compression
+    ) as r2_fh:
+        for line in get_header_lines(is_sv):
+            print(line, file=r1_fh)
+            print(line, file=r2_fh)
+        for r1_line, r2_line in iter_record_pairs(
+            nbr_records, is_sv, presence_diff, score_diff, csq_length, rng
+        ):
+            if r1_line is not None:
+                print(r1_line, file=r1_fh)
+                nbr_r1 += 1
+            if r2_line is not None:
+                print(r2_line, file=r2_fh)
+                nbr_r2 += 1
+    return nbr_r1, nbr_r2
+
+
+def write_scout_yaml(out_path: Path, run_id: str):
+    lines = [f"family: {run_id}", "owner: bench", "samples:"]
+    for sample in SAMPLES:
+        lines.extend(
+            [
+                f"  - sample_id: {sample}",
+                f"    bam_path: /results/{run_id}/bam/{sample}.bam",
+                f"    vcf_snv: /results/{run_id}/wgs/vcf/{run_id}.scored.vcf.gz",
+            ]
+        )
+    out_path.write_text("\n".join(lines) + "\n")
+
+
+def generate_dataset(
+    dataset_dir: Path,
+    nbr_records: int,
+    nbr_sv_records: int,
+    compression: str,
+    presence_diff: float,
+    score_diff: float,
+    csq_length: int,
+    seed: int,
+) -> Dict[str, Any]:
+    """
+    Generate a pair of results folders laid out as expected by default.config.
+    Reused if already generated with the same settings.
+    """
+
+    settings = {
+        "nbr_records": nbr_records,
+        "nbr_sv_records": nbr_sv_records,
+        "compression": compression,
+        "presence_diff": presence_diff,
+        "score_diff": score_diff,
+        "csq_length": csq_length,
+        "seed": seed,
+    }
+    dataset_path = dataset_dir / DATASET_FILE
+    if dataset_path.exists():
+        with open(dataset_path) as in_fh:
+            dataset = json.load(in_fh)
+        if dataset["settings"] == settings:
+            logger.info(f"Reusing synthetic results in {dataset_dir}")
+            return dataset
+
+    logger.info(f"Generating synthetic results in {dataset_dir}")
+    rng = random.Random(seed)
+    run_dirs = {}
+    for run_id in [RUN_ID1, RUN_ID2]:
+        run_dir = dataset_dir / run_id
+        (run_dir / "wgs" / "vcf").mkdir(parents=True, exist_ok=True)
+        (run_dir / "wgs" / "yaml").mkdir(parents=True, exist_ok=True)
+        (run_dir / "qc").mkdir(parents=True, exist_ok=True)
+        write_scout_yaml(run_dir / "wgs" / "yaml" / f"{run_id}.yaml", run_id)
+        (run_dir / "qc" / f"{run_id}.qc.json").write_text('{"reads": 1000}\n')
+        run_dirs[run_id] = run_dir
+    (run_dirs[RUN_ID2] / "qc" / f"{RUN_ID2}.extra.txt").write_text("extra\n")
+
+    nbr_snv = write_vcf_pair(
+        run_dirs[RUN_ID1] / "wgs" / "vcf" / f"{RUN_ID1}.scored.vcf.gz",
+        run_dirs[RUN_ID2] / "wgs" / "vcf" / f"{RUN_ID2}.scored.vcf.gz",
+        compression,
+        nbr_records,
+        False,
+        presence_diff,
+        score_diff,
+        csq_length,
+        rng,
+    )
+    nbr_sv = write_vcf_pair(
+        run_dirs[RUN_ID1] / "wgs" / "vcf" / f"{RUN_ID1}.sv.scored.sorted.vcf.gz",
+        run_dirs[RUN_ID2] / "wgs" / "vcf" / f"{RUN_ID2}.sv.scored.sorted.vcf.gz",
+        compression,
+        nbr_sv_records,
+        True,
+        presence_diff,
+        score_diff,
+        csq_length,
+        rng,
+    )
+
+    dataset = {
+        "settings": settings,
+        "r1_dir": str(run_dirs[RUN_ID1]),
+        "r2_dir": str(run_dirs[RUN_ID2]),
+        "nbr_snv": list(nbr_snv),
+        "nbr_sv": list(nbr_sv),
+    }
+    with open(dataset_path, "w") as out_fh:
+        json.dump(dataset, out_fh, indent=2)
+    return dataset
+
+
+def get_peak_rss_mb() -> float:
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak_rss / 1024**2
+    return peak_rss / 1024
+
+
+def get_scored_vcf(dataset: Dict[str, Any], run: str, is_sv: bool) -> PathObj:
+    run_id = RUN_ID1 if run == "r1" else RUN_ID2
+    run_dir = Path(dataset[f"{run}_dir"])
+    suffix = "sv.scored.sorted" if is_sv else "scored"
+    return PathObj(
+        run_dir / "wgs" / "vcf" / f"{run_id}.{suffix}.vcf.gz",
+        run_id,
+        RUN_ID_PLACEHOLDER,
+        run_dir,
+    )
+
+
+def run_evaluator(
+    dataset: Dict[str, Any],
+    outdir: Path,
+    comparisons: str,
+    streaming: bool = False,
+):
+    args = [
+        "--run_id1",
+        RUN_ID1,
+        "--run_id2",
+        RUN_ID2,
+        "--results1",
+        str(dataset["r1_dir"]),
+        "--results2",
+        str(dataset["r2_dir"]),
+        "--config",
+        str(Path(__file__).parent / "default.config"),
+        "--comparisons",
+        comparisons,
+        "--show_sub_scores",
+        "--outdir",
+        str(outdir),
+        # Repeats reuse the output folder, and must redo the comparisons
+        "--no_memo",
+    ]
+    if streaming:
+        args.append("--streaming")
+    run_with_arguments(parse_evaluator_arguments(args))
+
+
+def prepare_parse_vcf(dataset: Dict[str, Any], _outdir: Path) -> Callable[[], Any]:
+    vcf = get_scored_vcf(dataset, "r1", False)
+    return lambda: parse_vcf(vcf)
+
+
+def parse_scored_text_record(
+    line: str, rank_sub_score_names: Optional[List[str]]
+) -> ScoredRecord:
+    """
+    Parse a decoded VCF line using regular expressions over the full INFO
+    column, as before 'parse_scored_record'
+    """
+    fields = line.split("\t")
+    chr = fields[0]
+    pos = int(fields[1])
+    ref = fields[3]
+    alt = fields[4]
+    info = fields[7]
+    rank_score_match = RANK_SCORE_PATTERN.search(info)
+
+    rank_score = None
+    if rank_score_match is not None:
+        rank_score = int(rank_score_match.group(1))
+
+    rank_sub_scores_match = RANK_SUB_SCORES_PATTERN.search(info)
+    rank_sub_scores = None
+    if rank_sub_scores_match is not None:
+        rank_sub_scores = [
+            int(val) for val in rank_sub_scores_match.group(1).split("|")
+        ]
+        if rank_sub_score_names is None:
+            raise ValueError("Found rank sub scores, but not header")
+        assert len(rank_sub_score_names) == len(
+            rank_sub_scores
+        ), f"Length of sub score names and values should match, found {rank_sub_score_names} and {rank_sub_scores_match} in line: {line}"
+    return (chr, pos, ref, alt, rank_score, rank_sub_scores)
+
+
+def parse_vcf_with_regex(vcf: PathObj) -> VariantTable:
+    """'parse_vcf' as before the byte-level parser, decoding full lines"""
+    builder = VariantTableBuilder()
+    rank_sub_score_names = None
+    with vcf.get_filehandle() as in_fh:
+        for line in in_fh:
+            line = line.rstrip()
+            if line.startswith("#"):
+                if rank_sub_score_names is None and line.startswith(
+                    "##INFO=<ID=RankResult,"
+                ):
+                    rank_sub_score_names = parse_sub_score_names(line)
+                continue
+            builder.append(*parse_scored_text_record(line, rank_sub_score_names))
+    return builder.build(rank_sub_score_names or [])
+
+
+def prepare_parse_vcf_regex(
+    dataset: Dict[str, Any], _outdir: Path
+) -> Callable[[], Any]:
+    vcf = get_scored_vcf(dataset, "r1", False)
+    return lambda: parse_vcf_with_regex(vcf)
+
+
+def prepare_count_variants(dataset: Dict[str, Any], _outdir: Path) -> Callable[[], Any]:
+    vcf = get_scored_vcf(dataset, "r1", False)
+    return lambda: count_variants(vcf)
+
+
+def prepare_compare_tables(dataset: Dict[str, Any], _outdir: Path) -> Callable[[], Any]:
+    indexed_r1 = IndexedVariantTable(parse_vcf(get_scored_vcf(dataset, "r1", False)))
+    table_r2 = parse_vcf(get_scored_vcf(dataset, "r2", False))
+    return lambda: compare_variant_tables(indexed_r1, table_r2, 17)
+
+
+def prepare_compare_score(dataset: Dict[str, Any], outdir: Path) -> Callable[[], Any]:
+    comparison = compare_variant_tables(
+        IndexedVariantTable(parse_vcf(get_scored_vcf(dataset, "r1", False))),
+        parse_vcf(get_scored_vcf(dataset, "r2", False)),
+        17,
+    )
+    diff_scored_variants = list(comparison.diff_scored_variants)
+    return lambda: compare_variant_score(
+        diff_scored_variants,
+        comparison.sub_score_names_r1,
+        comparison.sub_score_names_r2,
+        True,
+        17,
+        15,
+        outdir / "score_above_thres.txt",
+        outdir / "score_all.txt",
+        None,
+        None,
+    )
+
+
+def prepare_stage(comparisons: str, streaming: bool = False):
+    def prepare(dataset: Dict[str, Any], outdir: Path) -> Callable[[], Any]:
+        return lambda: run_evaluator(dataset, outdir, comparisons, streaming)
+
+    return prepare
+
+
+def get_records_r1(dataset: Dict[str, Any]) -> int:
+    return dataset["nbr_snv"][0]
+
+
+def get_records_snv(dataset: Dict[str, Any]) -> int:
+    return sum(dataset["nbr_snv"])
+
+
+def get_records_sv(dataset: Dict[str, Any]) -> int:
+    return sum(dataset["nbr_sv"])
+
+
+def get_records_all(dataset: Dict[str, Any]) -> int:
+    return sum(dataset["nbr_snv"]) + sum(dataset["nbr_sv"])
+
+
+# Benchmark name, setup returning the measured call, and records it processes.
+# 'compare_variant_tables' and 'compare_variant_score' exclude VCF parsing, and
+# 'parse_vcf_regex' is the parser used before the byte-level one.
+BENCHMARKS: Dict[str, Tuple[Callable, Optional[Callable[[Dict[str, Any]], int]]]] = {
+    "parse_vcf": (prepare_parse_vcf, get_records_r1),
+    "parse_vcf_regex": (prepare_parse_vcf_regex, get_records_r1),
+    "count_variants": (prepare_count_variants, get_records_r1),
+    "compare_variant_tables": (prepare_compare_tables, get_records_snv),
+    "compare_variant_score": (prepare_compare_score, None),
+    "file": (prepare_stage("file"), None),
+    "vcf": (prepare_stage("vcf"), get_records_all),
+    "score": (prepare_stage("score"), get_records_snv),
+    "score_streaming": (prepare_stage("score", streaming=True), get_records_snv),
+    "score_sv": (prepare_stage("score_sv"), get_records_sv),
+    "yaml": (prepare_stage("yaml"), None),
+}
+
+
+def measure_benchmark(
+    name: str, dataset: Dict[str, Any], outdir: Path
+) -> Dict[str, float]:
+    """Run in a fresh process, so that the peak RSS belongs to this benchmark alone"""
+    logger.setLevel(logging.WARNING)
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    prepare, _get_records = BENCHMARKS[name]
+    measured_call = prepare(dataset, outdir)
+    setup_rss_mb = get_peak_rss_mb()
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    measured_call()
+    return {
+        "wall_s": time.perf_counter() - wall_start,
+        "cpu_s": time.process_time() - cpu_start,
+        "setup_rss_mb": setup_rss_mb,
+        "peak_rss_mb": get_peak_rss_mb(),
+    }
+
+
+def run_benchmark(name: str, dataset: Dict[str, Any], outdir: Path) -> Dict[str, Any]:
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        measurement = executor.submit(measure_benchmark, name, dataset, outdir).result()
+
+    _prepare, get_records = BENCHMARKS[name]
+    result: Dict[str, Any] = {"benchmark": name}
+    result.update(measurement)
+    if get_records is not None:
+        nbr_records = get_records(dataset)
+        result["records"] = nbr_records
+        result["records_per_s"] = (
+            nbr_records / measurement["wall_s"] if measurement["wall_s"] > 0 else None
+        )
+    return result
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=str(Path(__file__).parent),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_environment() -> Dict[str, Any]:
+    return {
+        "git_commit": get_git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def main(
+    workdir: Path,
+    out_path: Path,
+    sizes: List[int],
+    sv_ratio: float,
+    compressions: List[str],
+    presence_diff: float,
+    score_diff: float,
+    csq_length: int,
+    benchmarks: List[str],
+    repeats: int,
+    seed: int,
+):
+
+    unknown = [name for name in benchmarks if name not in BENCHMARKS]
+    if len(unknown) > 0:
+        raise ValueError(f"Valid benchmarks are: {list(BENCHMARKS)}, found: {unknown}")
+    unknown = [
+        compression for compression in compressions if compression not in COMPRESSIONS
+    ]
+    if len(unknown) > 0:
+        raise ValueError(f"Valid compressions are: {COMPRESSIONS}, found: {unknown}")
+    if presence_diff + score_diff > 1:
+        raise ValueError("--presence_diff and --score_diff can at most sum to 1")
+
+    results: List[Dict[str, Any]] = []
+    for compression in compressions:
+        for nbr_records in sizes:
+            dataset_name = f"{compression}_{nbr_records}"
+            if csq_length > 0:
+                dataset_name += f"_csq{csq_length}"
+            dataset = generate_dataset(
+                workdir / "data" / dataset_name,
+                nbr_records,
+                max(1, int(nbr_records * sv_ratio)),
+                compression,
+                presence_diff,
+                score_diff,
+                csq_length,
+                seed,
+            )
+            for name in benchmarks:
+                for repeat in range(repeats):
+                    result = run_benchmark(
+                        name, dataset, workdir / "out" / dataset_name / name
+                    )
+                    result.update(
+                        {
+                            "compression": compression,
+                            "nbr_records": nbr_records,
+                            "repeat": repeat,
+                        }
+                    )
+                    results.append(result)
+                    logger.info(
+                        "{} {} {}: {:.2f}s wall, {:.2f}s CPU, {:.0f} MB peak RSS".format(
+                            dataset_name,
+                            name,
+                            repeat,
+                            result["wall_s"],
+                            result["cpu_s"],
+                            result["peak_rss_mb"],
+                        )
+                    )
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, "w") as out_fh:
+        json.dump(
+            {
+                "schema_version": SCHEMA_VERSION,
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "environment": get_environment(),
+                "settings": {
+                    "sizes": sizes,
+                    "sv_ratio": sv_ratio,
+                    "compressions": compressions,
+                    "presence_diff": presence_diff,
+                    "score_diff": score_diff,
+                    "csq_length": csq_length,
+                    "repeats": repeats,
+                    "seed": seed,
+                },
+                "results": results,
+            },
+            out_fh,
+            indent=2,
+        )
+    logger.info(f"Results written to {out_path}")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--workdir",
+        required=True,
+        help="Folder for the synthetic results and benchmark outputs. Generated results are reused across invocations.",
+    )
+    parser.add_argument("--out", required=True, help="Path of the results JSON")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10000, 100000, 1000000],
+        help="Numbers of scored SNV records per run, up to 10M",
+    )
+    parser.add_argument(
+        "--sv_ratio",
+        type=float,
+        default=0.05,
+        help="Number of scored SV records relative to the SNVs",
+    )
+    parser.add_argument(
+        "--compressions",
+        nargs="+",
+        choices=COMPRESSIONS,
+        default=["bgzf"],
+        help="Write the VCFs BGZF compressed, as by bgzip, and/or as plain gzip",
+    )
+    parser.add_argument(
+        "--presence_diff",
+        type=float,
+        default=0.01,
+        help="Fraction of variants present in only one of the runs",
+    )
+    parser.add_argument(
+        "--score_diff",
+        type=float,
+        default=0.02,
+        help="Fraction of variants present in both runs with a different rank score",
+    )
+    parser.add_argument(
+        "--csq_length",
+        type=int,
+        default=0,
+        help="Add a VEP-like CSQ annotation of about this many characters to each SNV, as in annotated production VCFs",
+    )
+    parser.add_argument(
+        "--benchmarks",
+        nargs="+",
+        default=list(BENCHMARKS),
+        help=f"Defaults to all: {' '.join(BENCHMARKS)}",
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=1, help="Number of runs of each benchmark"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    main(
+        Path(args.workdir),
+        Path(args.out),
+        args.sizes,
+        args.sv_ratio,
+        args.compressions,
+        args.presence_diff,
+        args.score_diff,
+        args.csq_length,
+        args.benchmarks,
+        args.repeats,
+        args.seed,
+    )
@@ -0,0 +1,263 @@
+"""
+Reading and writing of BGZF compressed files, as written by bgzip and most
+pipeline tools.
+
+A BGZF file is a series of independent gzip blocks of at most 64 kB, each
+recording its own compressed size. This makes it possible to read the blocks
+sequentially and inflate them on a thread pool, which is a lot faster than
+single-threaded inflation with 'gzip.open'. zlib releases the GIL while
+inflating, so threads are enough to use multiple cores.
+"""
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import io
+import os
+from pathlib import Path
+import struct
+from typing import BinaryIO, Deque, Iterator, Optional, Tuple
+import zlib
+
+GZIP_MAGIC = b"\x1f\x8b"
+# Fixed part of the gzip member header, up to and including XLEN
+HEADER_SIZE = 12
+FLAG_EXTRA = 4
+
+# Largest uncompressed payload of a written block, the same as bgzip uses
+MAX_BLOCK_DATA = 0xFF00
+# Empty block marking the end of a BGZF file
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+DEFAULT_THREADS = min(4, os.cpu_count() or 1)
+# Number of blocks inflated ahead of the reader
+DEFAULT_READ_AHEAD = 64
+
+
+class BgzfError(OSError):
+    pass
+
+
+def is_bgzf(path: Path) -> bool:
+    """Check whether the first gzip member carries the BGZF 'BC' extra subfield"""
+    try:
+        with open(str(path), "rb") as in_fh:
+            header = in_fh.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE or header[:2] != GZIP_MAGIC:
+                return False
+            if not header[3] & FLAG_EXTRA:
+                return False
+            (xlen,) = struct.unpack("<H", header[10:12])
+            return get_block_size(in_fh.read(xlen)) is not None
+    except OSError:
+        return False
+
+
+def get_block_size(extra: bytes) -> Optional[int]:
+    """Total block size from the 'BC' subfield of a gzip extra field"""
+    offset = 0
+    while offset + 4 <= len(extra):
+        si1, si2, slen = struct.unpack("<BBH", extra[offset : offset + 4])
+        if si1 == 66 and si2 == 67 and slen == 2:
+            (bsize,) = struct.unpack("<H", extra[offset + 4 : offset + 6])
+            return bsize + 1
+        offset += 4 + slen
+    return None
+
+
+def read_block(in_fh: BinaryIO) -> Optional[Tuple[int, bytes]]:
+    """
+    Read the next raw BGZF block. Returns its file offset together with the
+    full block, or None at end of file.
+    """
+    block_offset = in_fh.tell()
+    header = in_fh.read(HEADER_SIZE)
+    if len(header) == 0:
+        return None
+    if len(header) < HEADER_SIZE or header[:2] != GZIP_MAGIC:
+        raise BgzfError(f"Invalid BGZF block header at offset {block_offset}")
+    (xlen,) = struct.unpack("<H", header[10:12])
+    extra = in_fh.read(xlen)
+    block_size = get_block_size(extra)
+    if block_size is None:
+        raise BgzfError(f"BGZF block at offset {block_offset} lacks a block size")
+    rest = in_fh.read(block_size - HEADER_SIZE - xlen)
+    if len(rest) != block_size - HEADER_SIZE - xlen:
+        raise BgzfError(f"Truncated BGZF block at offset {block_offset}")
+    return block_offset, header + extra + rest
+
+
+def inflate_block(block: bytes) -> bytes:
+    (xlen,) = struct.unpack("<H", block[10:12])
+    crc, isize = struct.unpack("<II", block[-8:])
+    try:
+        data = zlib.decompress(block[HEADER_SIZE + xlen : -8], -15)
+    except zlib.error as error:
+        raise BgzfError(f"Could not inflate BGZF block: {error}")
+    if len(data) != isize or zlib.crc32(data) != crc:
+        raise BgzfError("BGZF block failed size or CRC check")
+    return data
+
+
+class BgzfReader(io.RawIOBase):
+    """
+    Raw binary stream over the decompressed content of a BGZF file.
+
+    Blocks are inflated on a thread pool, with a bounded number of blocks
+    read ahead, and returned in file order. Wrap in io.BufferedReader and
+    io.TextIOWrapper to read lines.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        threads: int = DEFAULT_THREADS,
+        read_ahead: int = DEFAULT_READ_AHEAD,
+        virtual_offset: int = 0,
+    ):
+        super().__init__()
+        self._fh = open(str(path), "rb")
+        self._executor: Optional[ThreadPoolExecutor] = (
+            ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+        )
+        # The read-ahead window starts at one block and doubles up to
+        # 'read_ahead', so that short reads (headers, regions) stay cheap
+        self._read_ahead = max(1, read_ahead)
+        self._window = 1
+        self._pending: Deque[Future] = deque()
+        self._at_eof = False
+        self._buffer = b""
+        self._buffer_pos = 0
+
+        # Virtual offsets, as used in tabix indices, are the compressed offset
+        # of a block in the upper 48 bits and an offset within it in the lower 16
+        self._fh.seek(virtual_offset >> 16)
+        self._skip_bytes = virtual_offset & 0xFFFF
+
+    def readable(self) -> bool:
+        return True
+
+    def _fill_pending(self):
+        while not self._at_eof and len(self._pending) < self._window:
+            block = read_block(self._fh)
+            if block is None:
+                self._at_eof = True
+                break
+            if self._executor is not None:
+                self._pending.append(self._executor.submit(inflate_block, block[1]))
+            else:
+                future: Future = Future()
+                future.set_result(inflate_block(block[1]))
+                self._pending.append(future)
+
+    def _next_data(self) -> bool:
+        """Move on to the next non-empty decompressed block"""
+        while True:
+            self._fill_pending()
+            if len(self._pending) == 0:
+                return False
+            self._buffer = self._pending.popleft().result()
+            self._buffer_pos = self._skip_bytes
+            self._skip_bytes = 0
+            self._window = min(self._window * 2, self._read_ahead)
+            if len(self._buffer) > self._buffer_pos:
+                return True
+
+    def readinto(self, buffer) -> int:
+        if self._buffer_pos >= len(self._buffer) and not self._next_data():
+            return 0
+        nbr_bytes = min(len(buffer), len(self._buffer) - self._buffer_pos)
+        buffer[:nbr_bytes] = self._buffer[
+            self._buffer_pos : self._buffer_pos + nbr_bytes
+        ]
+        self._buffer_pos += nbr_bytes
+        return nbr_bytes
+
+    def close(self):
+        if not self.closed:
+            for future in self._pending:
+                future.cancel()
+            self._pending.clear()
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+            self._fh.close()
+        super().close()
+
+
+def open_bgzf(
+    path: Path, threads: int = DEFAULT_THREADS, virtual_offset: int = 0
+) -> BinaryIO:
+    return io.BufferedReader(
+        BgzfReader(path, threads, virtual_offset=virtual_offset), buffer_size=1 << 16
+    )
+
+
+def iter_blocks(
+    path: Path, threads: int = DEFAULT_THREADS, read_ahead: int = DEFAULT_READ_AHEAD
+) -> Iterator[Tuple[int, bytes]]:
+    """
+    Yield the file offset and decompressed content of each block, in file
+    order. The offsets are the upper part of the virtual offsets of the
+    positions in the block.
+    """
+    with open(str(path), "rb") as in_fh, ThreadPoolExecutor(
+        max_workers=max(1, threads)
+    ) as executor:
+        pending: Deque[Tuple[int, Future]] = deque()
+        while True:
+            block = read_block(in_fh)
+            if block is not None:
+                pending.append((block[0], executor.submit(inflate_block, block[1])))
+            if len(pending) > 0 and (block is None or len(pending) >= read_ahead):
+                block_offset, future = pending.popleft()
+                yield block_offset, future.result()
+            elif block is None:
+                break
+
+
+def deflate_block(data: bytes, level: int) -> bytes:
+    """Compress data into a single BGZF block, with the 'BC' block size subfield"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    payload = compressor.compress(data) + compressor.flush()
+    block_size = HEADER_SIZE + 6 + len(payload) + 8
+    header = struct.pack(
+        "<BBBBIBBHBBHH", 31, 139, 8, FLAG_EXTRA, 0, 0, 255, 6, 66, 67, 2, block_size - 1
+    )
+    return header + payload + struct.pack("<II", zlib.crc32(data), len(data))
+
+
+class BgzfWriter(io.RawIOBase):
+    """
+    Raw binary stream writing BGZF blocks, readable by BgzfReader, bgzip and
+    tabix. Wrap in io.TextIOWrapper to write lines.
+    """
+
+    def __init__(self, path: Path, level: int = 6):
+        super().__init__()
+        self._fh = open(str(path), "wb")
+        self._level = level
+        self._buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        while len(self._buffer) >= MAX_BLOCK_DATA:
+            self._fh.write(
+                deflate_block(bytes(self._buffer[:MAX_BLOCK_DATA]), self._level)
+            )
+            del self._buffer[:MAX_BLOCK_DATA]
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            if len(self._buffer) > 0:
+                self._fh.write(deflate_block(bytes(self._buffer), self._level))
+                self._buffer = bytearray()
+            self._fh.write(EOF_BLOCK)
+            self._fh.close()
+        super().close()
+
+
+def open_bgzf_writer(path: Path, level: int = 6) -> BinaryIO:
+    return io.BufferedWriter(BgzfWriter(path, level), buffer_size=1 << 16)
@@ -1,6 +1,32 @@
+from array import array
+import copy
+from functools import cached_property
 import gzip
+import heapq
+import io
+import json
+import os
 from pathlib import Path
-from typing import Dict, Optional, TextIO
+import tempfile
+from typing import (
+    TYPE_CHECKING,
+    BinaryIO,
+    Collection,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+)
+
+import numpy as np
+
+from bgzf import is_bgzf, open_bgzf
+
+if TYPE_CHECKING:
+    from score_analysis import ScoreDeltaSummary
 
 
 class ScoredVariant:
@@ -25,6 +51,9 @@ class ScoredVariant:
     def __str__(self) -> str:
         return f"{self.chr}:{self.pos} {self.ref}/{self.alt} (Score: {self.rank_score})"
 
+    def get_key(self) -> str:
+        return f"{self.chr}_{self.pos}_{self.ref}_{self.alt}"
+
     def get_rank_score(self) -> int:
         if self.rank_score is None:
             raise ValueError(
@@ -64,13 +93,281 @@ class ScoredVariant:
         return "\t".join(fields)
 
 
+class VariantTable:
+    """
+    Columnar store of the variants in a scored VCF.
+
+    Positions and scores are kept in NumPy arrays, contigs and alleles are
+    interned and stored as integer codes, and all rows share a single list of
+    rank sub score names. ScoredVariant objects are only created on demand
+    for the rows that are reported.
+    """
+
+    def __init__(
+        self,
+        contigs: List[str],
+        alleles: List[str],
+        contig_codes: np.ndarray,
+        positions: np.ndarray,
+        ref_codes: np.ndarray,
+        alt_codes: np.ndarray,
+        rank_scores: np.ndarray,
+        has_rank_score: np.ndarray,
+        sub_score_names: List[str],
+        sub_scores: np.ndarray,
+        has_sub_scores: np.ndarray,
+    ):
+        self.contigs = contigs
+        self.alleles = alleles
+        self.contig_codes = contig_codes
+        self.positions = positions
+        self.ref_codes = ref_codes
+        self.alt_codes = alt_codes
+        self.rank_scores = rank_scores
+        self.has_rank_score = has_rank_score
+        self.sub_score_names = sub_score_names
+        self.sub_scores = sub_scores
+        self.has_sub_scores = has_sub_scores
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def get_sorted_keys(
+        self, encoder: "VariantKeyEncoder"
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Integer keys of the variants in sorted order, together with their rows.
+        Duplicated keys are only kept once, pointing to the last row.
+        """
+        contig_lookup = np.array(
+            [encoder.get_contig_code(contig) for contig in self.contigs],
+            dtype=np.uint64,
+        )
+        allele_pairs = (
+            self.ref_codes.astype(np.uint64) << np.uint64(32)
+        ) | self.alt_codes
+        unique_pairs, pair_inverse = np.unique(allele_pairs, return_inverse=True)
+        allele_lookup = np.array(
+            [
+                encoder.get_allele_code(
+                    self.alleles[pair >> 32], self.alleles[pair & 0xFFFFFFFF]
+                )
+                for pair in unique_pairs.tolist()
+            ],
+            dtype=np.uint64,
+        )
+        keys = encoder.encode(
+            contig_lookup[self.contig_codes],
+            self.positions,
+            allele_lookup[pair_inverse.reshape(-1)],
+        )
+        rows = np.argsort(keys, kind="stable")
+        sorted_keys = keys[rows]
+        is_last = np.ones(len(sorted_keys), dtype=np.bool_)
+        is_last[:-1] = sorted_keys[:-1] != sorted_keys[1:]
+        return sorted_keys[is_last], rows[is_last]
+
+    def get_variant(self, row: int) -> ScoredVariant:
+        rank_score = int(self.rank_scores[row]) if self.has_rank_score[row] else None
+        sub_scores: Dict[str, int] = {}
+        if self.has_sub_scores[row]:
+            sub_scores = dict(zip(self.sub_score_names, self.sub_scores[row].tolist()))
+        return ScoredVariant(
+            self.contigs[self.contig_codes[row]],
+            int(self.positions[row]),
+            self.alleles[self.ref_codes[row]],
+            self.alleles[self.alt_codes[row]],
+            rank_score,
+            sub_scores,
+        )
+
+
+class TableVariants:
+    """
+    Variants of some rows of a VariantTable, such as those only present in
+    one run, built from the table as they are iterated
+    """
+
+    def __init__(self, table: VariantTable, rows: np.ndarray):
+        self.table = table
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[ScoredVariant]:
+        for row in self.rows.tolist():
+            yield self.table.get_variant(row)
+
+
+class VariantKeyEncoder:
+    """
+    Encodes chr/pos/ref/alt into 64-bit integer keys, so that variant sets
+    can be compared as sorted arrays rather than as sets of strings.
+
+    Bit layout: contig code (12) | position (30) | allele code (22)
+
+    Short ACGT alleles are packed into the allele code itself. Longer indels
+    and symbolic SV alleles are assigned codes from a side table. The same
+    encoder must be used for all tables that are compared.
+    """
+
+    CONTIG_BITS = 12
+    POS_BITS = 30
+    ALLELE_BITS = 22
+
+    # Flag bit in the allele code marking side table entries
+    SIDE_TABLE_FLAG = 1 << (ALLELE_BITS - 1)
+    # Inline packing: ref length (3 bits), alt length (3 bits), bases (2 bits each)
+    MAX_INLINE_BASES = 7
+    BASE_CODES = {"A": 0, "C": 1, "G": 2, "T": 3}
+
+    def __init__(self):
+        self._contig_codes: Dict[str, int] = {}
+        self._side_table: Dict[Tuple[str, str], int] = {}
+
+    def get_contig_code(self, contig: str) -> int:
+        code = self._contig_codes.get(contig)
+        if code is None:
+            code = len(self._contig_codes)
+            if code >= 1 << self.CONTIG_BITS:
+                raise ValueError(
+                    f"At most {1 << self.CONTIG_BITS} contigs can be encoded, failed at: {contig}"
+                )
+            self._contig_codes[contig] = code
+        return code
+
+    def get_allele_code(self, ref: str, alt: str) -> int:
+        if len(ref) + len(alt) <= self.MAX_INLINE_BASES and all(
+            base in self.BASE_CODES for base in ref + alt
+        ):
+            code = (len(ref) << 3) | len(alt)
+            for base in ref + alt:
+                code = (code << 2) | self.BASE_CODES[base]
+            return code
+
+        code = self._side_table.get((ref, alt))
+        if code is None:
+            code = len(self._side_table)
+            if code >= self.SIDE_TABLE_FLAG:
+                raise ValueError(
+                    f"Allele side table full ({self.SIDE_TABLE_FLAG} entries), failed at: {ref}/{alt}"
+                )
+            self._side_table[(ref, alt)] = code
+        return self.SIDE_TABLE_FLAG | code
+
+    def encode(
+        self, contig_codes: np.ndarray, positions: np.ndarray, allele_codes: np.ndarray
+    ) -> np.ndarray:
+        if len(positions) > 0 and int(positions.max()) >= 1 << self.POS_BITS:
+            raise ValueError(
+                f"Positions above {1 << self.POS_BITS} can not be encoded, found: {positions.max()}"
+            )
+        return (
+            (
+                contig_codes.astype(np.uint64)
+                << np.uint64(self.POS_BITS + self.ALLELE_BITS)
+            )
+            | (positions.astype(np.uint64) << np.uint64(self.ALLELE_BITS))
+            | allele_codes.astype(np.uint64)
+        )
+
+
+class IndexedVariantTable:
+    """
+    VariantTable together with its sorted keys, for a table compared to
+    several others, such as the baseline when comparing many runs.
+    """
+
+    def __init__(self, table: VariantTable):
+        self.table = table
+        self.encoder = VariantKeyEncoder()
+        self.keys, self.rows = table.get_sorted_keys(self.encoder)
+
+    def get_encoder(self) -> VariantKeyEncoder:
+        """
+        Copy of the encoder used for the keys. Other tables must be encoded
+        with it to get comparable keys, and copying keeps the index unchanged.
+        """
+        return copy.deepcopy(self.encoder)
+
+
+class VariantTableBuilder:
+    """Accumulates parsed records in compact arrays before creating a VariantTable"""
+
+    def __init__(self):
+        self._contig_index: Dict[str, int] = {}
+        self._allele_index: Dict[str, int] = {}
+        self._contig_codes = array("H")
+        self._positions = array("i")
+        self._ref_codes = array("I")
+        self._alt_codes = array("I")
+        self._rank_scores = array("i")
+        self._has_rank_score = array("b")
+        self._sub_scores = array("i")
+        self._has_sub_scores = array("b")
+        self._nbr_sub_scores: Optional[int] = None
+
+    def _intern(self, index: Dict[str, int], value: str) -> int:
+        code = index.get(value)
+        if code is None:
+            code = len(index)
+            index[value] = code
+        return code
+
+    def append(
+        self,
+        chr: str,
+        pos: int,
+        ref: str,
+        alt: str,
+        rank_score: Optional[int],
+        sub_scores: Optional[List[int]],
+    ):
+        self._contig_codes.append(self._intern(self._contig_index, chr))
+        self._positions.append(pos)
+        self._ref_codes.append(self._intern(self._allele_index, ref))
+        self._alt_codes.append(self._intern(self._allele_index, alt))
+        self._rank_scores.append(rank_score if rank_score is not None else 0)
+        self._has_rank_score.append(rank_score is not None)
+        if sub_scores is not None:
+            if self._nbr_sub_scores is None:
+                # Rows parsed before the first sub scores were seen are padded
+                self._nbr_sub_scores = len(sub_scores)
+                self._sub_scores.extend(
+                    [0] * (len(self._positions) - 1) * len(sub_scores)
+                )
+            self._sub_scores.extend(sub_scores)
+        elif self._nbr_sub_scores is not None:
+            self._sub_scores.extend([0] * self._nbr_sub_scores)
+        self._has_sub_scores.append(sub_scores is not None)
+
+    def build(self, sub_score_names: List[str]) -> VariantTable:
+        nbr_sub_scores = self._nbr_sub_scores or 0
+        return VariantTable(
+            list(self._contig_index),
+            list(self._allele_index),
+            np.frombuffer(self._contig_codes, dtype=np.uint16),
+            np.frombuffer(self._positions, dtype=np.int32),
+            np.frombuffer(self._ref_codes, dtype=np.uint32),
+            np.frombuffer(self._alt_codes, dtype=np.uint32),
+            np.frombuffer(self._rank_scores, dtype=np.int32),
+            np.frombuffer(self._has_rank_score, dtype=np.bool_),
+            sub_score_names,
+            np.frombuffer(self._sub_scores, dtype=np.int32).reshape(
+                len(self._positions), nbr_sub_scores
+            ),
+            np.frombuffer(self._has_sub_scores, dtype=np.bool_),
+        )
+
+
 class PathObj:
     """
     Extended Path object to make comparison between results dir more convenient.
 
     1. Relative paths to the base dir
     2. Can replace the run ID with the string 'RUNID'
-    3. Can detect whether a file is text or gzip
+    3. Can detect whether a file is text, gzip or BGZF
     """
 
     def __init__(
@@ -82,15 +379,35 @@ class PathObj:
     ):
         self.real_name = path.name
         self.real_path = path
-
-        self.shared_name = path.name.replace(run_id, id_placeholder)
-        self.shared_path = path.with_name(self.shared_name)
-        self.relative_path = self.shared_path.relative_to(base_dir)
+        self.base_dir = base_dir
 
         self.run_id = run_id
         self.id_placeholder = id_placeholder
 
         self.is_gzipped = path.suffix.endswith(".gz")
+        # Detected on first read
+        self.is_bgzf: Optional[bool] = None
+        self._stat: Optional[os.stat_result] = None
+
+    # The derived paths are only computed when used, as results dirs can
+    # hold a very large number of files
+
+    @cached_property
+    def shared_name(self) -> str:
+        return self.real_name.replace(self.run_id, self.id_placeholder)
+
+    @cached_property
+    def shared_path(self) -> Path:
+        return self.real_path.with_name(self.shared_name)
+
+    @cached_property
+    def relative_path(self) -> Path:
+        return self.shared_path.relative_to(self.base_dir)
+
+    def get_stat(self) -> os.stat_result:
+        if self._stat is None:
+            self._stat = self.real_path.stat()
+        return self._stat
 
     def check_valid_file(self) -> bool:
         try:
@@ -104,9 +421,25 @@ class PathObj:
             return False
         return True
 
+    def get_binary_filehandle(self) -> BinaryIO:
+        """
+        BGZF files, such as bgzipped VCFs, are inflated in parallel. Other
+        gzip files fall back to single-threaded reading.
+        """
+        if self.is_gzipped:
+            if self.is_bgzf is None:
+                self.is_bgzf = is_bgzf(self.real_path)
+            if self.is_bgzf:
+                in_fh = open_bgzf(self.real_path)
+            else:
+                in_fh = gzip.open(str(self.real_path), "rb")
+        else:
+            in_fh = open(str(self.real_path), "rb")
+        return in_fh
+
     def get_filehandle(self) -> TextIO:
         if self.is_gzipped:
-            in_fh = gzip.open(str(self.real_path), "rt")
+            in_fh = io.TextIOWrapper(self.get_binary_filehandle())
         else:
             in_fh = open(str(self.real_path), "r")
         return in_fh
@@ -132,3 +465,254 @@ class DiffScoredVariant:
         )
         any_above_thres = r1_above_thres or r2_above_thres
         return any_above_thres
+
+
+class ScoredComparison:
+    """
+    Outcome of comparing the scored variants of two runs, ready to be reported.
+    Variants only found in one run can be built as they are iterated, such as
+    with TableVariants or SpooledVariants. Differently scored variants read
+    back from the memo are iterated once.
+    """
+
+    def __init__(
+        self,
+        r1_only: Collection[ScoredVariant],
+        r2_only: Collection[ScoredVariant],
+        nbr_common: int,
+        diff_scored_variants: Iterable[DiffScoredVariant],
+        sub_score_names_r1: List[str],
+        sub_score_names_r2: List[str],
+        score_summary: "ScoreDeltaSummary",
+    ):
+        self.r1_only = r1_only
+        self.r2_only = r2_only
+        self.nbr_common = nbr_common
+        self.diff_scored_variants = diff_scored_variants
+        self.sub_score_names_r1 = sub_score_names_r1
+        self.sub_score_names_r2 = sub_score_names_r2
+        self.score_summary = score_summary
+
+
+class SpooledLines:
+    """
+    Append-only collection of text lines backed by a temporary file.
+
+    Used to hold potentially very long result lists (such as variants only
+    present in one run) while keeping memory usage flat. Lines are appended
+    first and then read back, possibly multiple times.
+    """
+
+    def __init__(self):
+        self._fh = tempfile.TemporaryFile("w+")
+        self._count = 0
+
+    def append(self, line: str):
+        self._fh.write(line)
+        self._fh.write("\n")
+        self._count += 1
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[str]:
+        self._fh.flush()
+        self._fh.seek(0)
+        for line in self._fh:
+            yield line.rstrip("\n")
+
+    def close(self):
+        self._fh.close()
+
+    def __enter__(self) -> "SpooledLines":
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+
+class SpooledVariants:
+    """
+    Variants spooled to disk as SpooledLines, such as those only present in
+    one run. Their position, call and rank score are kept, not sub scores.
+    """
+
+    def __init__(self):
+        self._lines = SpooledLines()
+
+    def append(self, variant: ScoredVariant):
+        self._lines.append(format_spooled_variant(variant))
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+    def __iter__(self) -> Iterator[ScoredVariant]:
+        for line in self._lines:
+            yield parse_spooled_variant(line)
+
+    def close(self):
+        self._lines.close()
+
+    def __enter__(self) -> "SpooledVariants":
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+
+def format_spooled_variant(variant: ScoredVariant) -> str:
+    return "\t".join(
+        [
+            variant.chr,
+            str(variant.pos),
+            variant.ref,
+            variant.alt,
+            variant.get_rank_score_str(),
+        ]
+    )
+
+
+def parse_spooled_variant(line: str) -> ScoredVariant:
+    chr, pos, ref, alt, rank_score = line.split("\t")
+    return ScoredVariant(
+        chr, int(pos), ref, alt, int(rank_score) if rank_score else None, {}
+    )
+
+
+class ExternalSorter:
+    """
+    Text lines sorted on an integer key with bounded memory usage.
+
+    Lines are buffered and, once 'max_buffered' is reached, written to a
+    temporary file as a sorted run. Iterating merges the runs, and can be
+    repeated. The sort is stable, so lines with equal keys keep the order
+    they were added in.
+    """
+
+    def __init__(self, reverse: bool = False, max_buffered: int = 100000):
+        self._reverse = reverse
+        self._max_buffered = max_buffered
+        self._buffer: List[Tuple[int, str]] = []
+        self._runs: List[TextIO] = []
+
+    def add(self, key: int, line: str):
+        self._buffer.append((key, line))
+        if len(self._buffer) >= self._max_buffered:
+            self._spill()
+
+    def _sort_buffer(self):
+        self._buffer.sort(key=lambda entry: entry[0], reverse=self._reverse)
+
+    def _spill(self):
+        self._sort_buffer()
+        run_fh = tempfile.TemporaryFile("w+")
+        for key, line in self._buffer:
+            run_fh.write(f"{key}\t{line}\n")
+        self._runs.append(run_fh)
+        self._buffer = []
+
+    @staticmethod
+    def _iter_run(run_fh: TextIO) -> Iterator[Tuple[int, str]]:
+        for line in run_fh:
+            key, text = line.rstrip("\n").split("\t", 1)
+            yield int(key), text
+
+    def __iter__(self) -> Iterator[str]:
+        self._sort_buffer()
+        for run_fh in self._runs:
+            run_fh.seek(0)
+        # Runs hold earlier lines than the buffer, and heapq.merge prefers
+        # earlier iterables on ties, which keeps the sort stable
+        sources: List[Iterator[Tuple[int, str]]] = [
+            self._iter_run(run_fh) for run_fh in self._runs
+        ]
+        sources.append(iter(self._buffer))
+        for _key, line in heapq.merge(
+            *sources, key=lambda entry: entry[0], reverse=self._reverse
+        ):
+            yield line
+
+    def close(self):
+        for run_fh in self._runs:
+            run_fh.close()
+        self._runs = []
+        self._buffer = []
+
+    def __enter__(self) -> "ExternalSorter":
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+
+class ScoreDiffCollector:
+    """
+    Differently scored variants, ordered on descending r1 rank score.
+
+    Only the 'max_count' top variants above the score threshold are kept in
+    memory, in a heap, for display. All variants go through an external sort
+    as JSON records, flagged with whether they are above the threshold.
+    """
+
+    def __init__(self, score_threshold: int, max_count: int, show_sub_scores: bool):
+        self.score_threshold = score_threshold
+        self.max_count = max_count
+        self.show_sub_scores = show_sub_scores
+        self.nbr_total = 0
+        self.nbr_above_thres = 0
+        # Entries of (rank score, negated insertion order, display line)
+        self._top: List[Tuple[int, int, str]] = []
+        self._sorter = ExternalSorter(reverse=True)
+
+    def add(self, variant: DiffScoredVariant):
+        rank_score = variant.r1.get_rank_score()
+        above_thres = variant.any_above_thres(self.score_threshold)
+        self._sorter.add(rank_score, json.dumps(self.get_record(variant, above_thres)))
+        if above_thres:
+            top_key = (rank_score, -self.nbr_above_thres)
+            if len(self._top) < self.max_count:
+                heapq.heappush(self._top, (*top_key, self.get_display_str(variant)))
+            elif self.max_count > 0 and top_key > self._top[0][:2]:
+                heapq.heapreplace(self._top, (*top_key, self.get_display_str(variant)))
+            self.nbr_above_thres += 1
+        self.nbr_total += 1
+
+    def get_display_str(self, variant: DiffScoredVariant) -> str:
+        return variant.r1.get_comparison_str(variant.r2, self.show_sub_scores)
+
+    def get_top_lines(self) -> List[str]:
+        return [line for _, _, line in sorted(self._top, reverse=True)]
+
+    @staticmethod
+    def get_record(variant: DiffScoredVariant, above_thres: bool) -> list:
+        return [
+            above_thres,
+            variant.r1.chr,
+            variant.r1.pos,
+            variant.r1.ref,
+            variant.r1.alt,
+            variant.r1.rank_score,
+            variant.r2.rank_score,
+            variant.r1.sub_scores,
+            variant.r2.sub_scores,
+        ]
+
+    def iter_sorted_variants(self) -> Iterator[Tuple[bool, DiffScoredVariant]]:
+        """All variants, with whether they are above the threshold"""
+        for line in self._sorter:
+            above_thres, chr, pos, ref, alt, r1_score, r2_score, r1_subs, r2_subs = (
+                json.loads(line)
+            )
+            yield above_thres, DiffScoredVariant(
+                ScoredVariant(chr, pos, ref, alt, r1_score, r1_subs),
+                ScoredVariant(chr, pos, ref, alt, r2_score, r2_subs),
+            )
+
+    def close(self):
+        self._sorter.close()
+
+    def __enter__(self) -> "ScoreDiffCollector":
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+from functools import partial
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import io
+import json
+import os
+from pathlib import Path
+import signal
+import socketserver
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from giab_evaluator import (
+    Baseline,
+    BaselineKey,
+    logger,
+    parse_arguments as parse_evaluator_arguments,
+    run_with_arguments,
+)
+
+description = """
+Run the evaluator as a resident service, keeping the baseline results it has
+read in memory between comparisons.
+
+Comparisons are submitted as HTTP requests, either on a Unix socket or on a
+loopback port. A comparison takes the same arguments as giab_evaluator.py and
+writes the same files to --outdir. Repeated comparisons against a baseline
+skip listing its files, counting its VCFs and parsing its scored VCFs. A
+baseline is read again if any of its files changed, but files added to a
+baseline folder are not detected.
+
+  POST /compare    {"args": ["-r1", ..., "-r2", ..., "--outdir", ...], "cwd": ...}
+  GET  /baselines  Baselines held in memory
+
+For instance:
+
+  curl --unix-socket evaluator.sock http://localhost/compare \\
+    -d '{"args": ["-r1", "/data/hg002", "-r2", "/data/nightly", "--config", "default.config", "--outdir", "/data/out"]}'
+
+Relative paths are resolved against "cwd", if given, otherwise against the
+folder the service was started in. Comparisons run one at a time.
+
+On a port, requests need a localhost Host header, and comparisons a JSON
+Content-Type (curl -H "Content-Type: application/json"). Web pages open in a
+browser on the same host can then neither submit comparisons, which would
+need a preflight request the service does not answer, nor reach the service
+through a rebound DNS name.
+"""
+
+# Host header values accepted on a port, without the port number
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "[::1]"}
+
+
+class EvaluatorService:
+    """Runs comparisons, holding up to 'max_baselines' baselines in memory"""
+
+    def __init__(self, max_baselines: int):
+        self.max_baselines = max_baselines
+        # Least recently used first
+        self.baselines: Dict[BaselineKey, Baseline] = {}
+
+    def compare(
+        self, argv: List[str], cwd: Optional[str]
+    ) -> Tuple[int, Dict[str, Any]]:
+        """Run one comparison, returning the HTTP status and response"""
+        start_time = time.perf_counter()
+        original_cwd = os.getcwd()
+        original_handlers = list(logger.handlers)
+        try:
+            if cwd is not None:
+                os.chdir(cwd)
+            # Argument errors are reported to the client rather than printed
+            usage_fh = io.StringIO()
+            try:
+                with contextlib.redirect_stdout(usage_fh), contextlib.redirect_stderr(
+                    usage_fh
+                ):
+                    args = parse_evaluator_arguments(argv)
+            except SystemExit:
+                return 400, {"status": "error", "error": usage_fh.getvalue().strip()}
+            run_with_arguments(args, self.baselines)
+        except (OSError, ValueError) as error:
+            logger.error(f"Comparison failed: {error}")
+            return 400, {"status": "error", "error": str(error)}
+        except Exception as error:
+            logger.exception("Comparison failed")
+            return 500, {"status": "error", "error": repr(error)}
+        finally:
+            # Each comparison logs to out.log in its own output folder
+            for handler in list(logger.handlers):
+                if handler not in original_handlers:
+                    logger.removeHandler(handler)
+                    handler.close()
+            os.chdir(original_cwd)
+            while len(self.baselines) > self.max_baselines:
+                del self.baselines[next(iter(self.baselines))]
+        return 200, {
+            "status": "ok",
+            "wall_s": round(time.perf_counter() - start_time, 4),
+            "outdir": args.outdir,
+        }
+
+    def list_baselines(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "results1": key[0],
+                "run_id1": key[1],
+                "files": len(baseline.r1_paths),
+                "scored_vcfs": sorted(baseline.tables),
+            }
+            for key, baseline in self.baselines.items()
+        ]
+
+
+class EvaluatorRequestHandler(BaseHTTPRequestHandler):
+    def __init__(self, service: EvaluatorService, *args, **kwargs):
+        self.service = service
+        super().__init__(*args, **kwargs)
+
+    def send_json(self, status: int, response: Dict[str, Any]):
+        body = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def is_tcp(self) -> bool:
+        # Clients on a Unix socket have no address
+        return isinstance(self.client_address, tuple)
+
+    def is_local_host(self) -> bool:
+        host = self.headers.get("Host", "")
+        # Without the port, also for IPv6 addresses in brackets
+        if not host.endswith("]"):
+            host = host.rsplit(":", 1)[0]
+        return host.lower() in LOCAL_HOSTS
+
+    def do_GET(self):
+        if self.is_tcp() and not self.is_local_host():
+            self.send_json(403, {"status": "error", "error": "Host must be localhost"})
+            return
+        if self.path != "/baselines":
+            self.send_json(404, {"status": "error", "error": f"Unknown: {self.path}"})
+            return
+        self.send_json(200, {"baselines": self.service.list_baselines()})
+
+    def do_POST(self):
+        if self.is_tcp() and not self.is_local_host():
+            self.send_json(403, {"status": "error", "error": "Host must be localhost"})
+            return
+        if self.path != "/compare":
+            self.send_json(404, {"status": "error", "error": f"Unknown: {self.path}"})
+            return
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip()
+        if self.is_tcp() and content_type.lower() != "application/json":
+            self.send_json(
+                415,
+                {"status": "error", "error": "Content-Type must be application/json"},
+            )
+            return
+        try:
+            content_length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(content_length))
+            argv = request["args"]
+            cwd = request.get("cwd")
+            if not isinstance(argv, list) or not all(
+                isinstance(arg, str) for arg in argv
+            ):
+                raise TypeError("'args' must be a list of strings")
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            self.send_json(400, {"status": "error", "error": f"Bad request: {error}"})
+            return
+        status, response = self.service.compare(argv, cwd)
+        self.send_json(status, response)
+
+    def address_string(self) -> str:
+        if self.is_tcp():
+            return super().address_string()
+        return "unix"
+
+    def log_message(self, format: str, *args):
+        logger.info(f"{self.address_string()} {format % args}")
+
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    def server_bind(self):
+        super().server_bind()
+        # Expected by the request handler of http.server
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def main(socket_path: Optional[Path], port: Optional[int], max_baselines: int):
+
+    if (socket_path is None) == (port is None):
+        raise ValueError("Exactly one of --socket and --port is needed")
+
+    service = EvaluatorService(max_baselines)
+    handler = partial(EvaluatorRequestHandler, service)
+
+    server: socketserver.BaseServer
+    if socket_path is not None:
+        if socket_path.is_socket():
+            socket_path.unlink()
+        server = UnixHTTPServer(str(socket_path), handler)
+        # Only the user running the service can submit comparisons
+        os.chmod(str(socket_path), 0o600)
+        logger.info(f"Listening on {socket_path}")
+    else:
+        # Only reachable from this host
+        server = HTTPServer(("127.0.0.1", port), handler)
+        logger.info(f"Listening on http://127.0.0.1:{server.server_address[1]}")
+
+    # Stopped by a service manager, clean up as when interrupted
+    signal.signal(signal.SIGTERM, lambda _signum, _frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping")
+    finally:
+        server.server_close()
+        if socket_path is not None and socket_path.is_socket():
+            socket_path.unlink()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description=description, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--socket", help="Path of a Unix socket to listen on")
+    parser.add_argument(
+        "--port",
+        type=int,
+        help="Port to listen on, on the loopback interface only. 0 picks a free port.",
+    )
+    parser.add_argument(
+        "--max_baselines",
+        type=int,
+        default=4,
+        help="Max number of baselines held in memory, least recently used ones are dropped beyond this",
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    main(
+        Path(args.socket) if args.socket is not None else None,
+        args.port,
+        args.max_baselines,
+    )
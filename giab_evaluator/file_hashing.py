@@ -0,0 +1,169 @@
+"""
+Content hashing of result files, used to check whether files present in both
+runs are identical.
+
+Hashes are cached on disk keyed on real path, size and mtime, so that
+unchanged multi-GB files (BAM, CRAM) are only read once. Runs sharing the
+cache merge their new hashes into it under a lock, and entries of files that
+were since changed or deleted are dropped.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+from pathlib import Path
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+from classes import PathObj
+
+CHUNK_SIZE = 1 << 20
+# Bump when the hashing changes, to invalidate cached hashes
+HASH_CACHE_VERSION = 1
+
+
+class FileHashCache:
+    """JSON file mapping file fingerprints to content hashes"""
+
+    def __init__(self, cache_path: Optional[Path]):
+        self.cache_path = cache_path
+        self.hashes: Dict[str, str] = (
+            self.read_hashes(cache_path) if cache_path is not None else {}
+        )
+        # Hashes computed by this run, merged into the file when saving
+        self.new_hashes: Dict[str, str] = {}
+        self.nbr_hits = 0
+
+    @staticmethod
+    def read_hashes(cache_path: Path) -> Dict[str, str]:
+        if not cache_path.exists():
+            return {}
+        with open(cache_path) as in_fh:
+            cached = json.load(in_fh)
+        if cached.get("version") != HASH_CACHE_VERSION:
+            return {}
+        return cached["hashes"]
+
+    @staticmethod
+    def get_key(path: PathObj, gzip_payload: bool) -> str:
+        real_path = os.path.realpath(str(path.real_path))
+        stat = path.get_stat()
+        mode = "payload" if gzip_payload else "raw"
+        return f"{real_path}\t{stat.st_size}\t{stat.st_mtime_ns}\t{mode}"
+
+    @staticmethod
+    def is_current(key: str) -> bool:
+        """Whether the file of a key exists, with the same size and mtime"""
+        real_path, size, mtime_ns, _mode = key.rsplit("\t", 3)
+        try:
+            stat = os.stat(real_path)
+        except OSError:
+            return False
+        return stat.st_size == int(size) and stat.st_mtime_ns == int(mtime_ns)
+
+    def get(self, key: str) -> Optional[str]:
+        digest = self.hashes.get(key)
+        if digest is not None:
+            self.nbr_hits += 1
+        return digest
+
+    def add(self, key: str, digest: str):
+        self.hashes[key] = digest
+        self.new_hashes[key] = digest
+
+    def save(self):
+        if self.cache_path is None:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        lock_path = self.cache_path.with_name(self.cache_path.name + ".lock")
+        with open(lock_path, "w") as lock_fh:
+            # Held while merging, so that runs sharing the cache keep each
+            # other's hashes
+            fcntl.flock(lock_fh, fcntl.LOCK_EX)
+            hashes = self.read_hashes(self.cache_path)
+            hashes.update(self.new_hashes)
+            hashes = {
+                key: digest for key, digest in hashes.items() if self.is_current(key)
+            }
+            # Write and rename, so that runs never read a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=str(self.cache_path.parent))
+            with os.fdopen(fd, "w") as out_fh:
+                json.dump({"version": HASH_CACHE_VERSION, "hashes": hashes}, out_fh)
+            os.replace(tmp_path, str(self.cache_path))
+
+
+def hash_file(path: Path, gzip_payload: bool) -> str:
+    """
+    BLAKE2 hash of the file content. With 'gzip_payload', gzipped files are
+    hashed on their decompressed content, ignoring header fields such as the
+    timestamp and original file name.
+    """
+    digest = hashlib.blake2b()
+    if gzip_payload and path.name.endswith(".gz"):
+        in_fh = gzip.open(str(path), "rb")
+    else:
+        in_fh = open(str(path), "rb")
+    with in_fh:
+        for chunk in iter(lambda: in_fh.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentComparison:
+    """Shared files sorted by whether their content matches"""
+
+    def __init__(self):
+        self.identical: List[Path] = []
+        self.differing: List[Path] = []
+        # Size differs, so the content was never hashed
+        self.size_differing: List[Tuple[Path, int, int]] = []
+
+
+def compare_file_contents(
+    file_pairs: List[Tuple[PathObj, PathObj]],
+    gzip_payload: bool,
+    jobs: int,
+    hash_cache: FileHashCache,
+) -> ContentComparison:
+    """
+    Compare pairs of files from the two runs. Files of different size are
+    reported as differing without hashing, except gzipped files when
+    comparing payloads. The remaining files are hashed on a thread pool, as
+    hashlib and zlib release the GIL on large buffers.
+    """
+
+    comparison = ContentComparison()
+    to_hash: Dict[str, Path] = {}
+    pairs_to_hash: List[Tuple[Path, str, str]] = []
+
+    for r1_path, r2_path in file_pairs:
+        r1_size = r1_path.get_stat().st_size
+        r2_size = r2_path.get_stat().st_size
+        payload_hashed = gzip_payload and r1_path.is_gzipped
+        if r1_size != r2_size and not payload_hashed:
+            comparison.size_differing.append((r1_path.relative_path, r1_size, r2_size))
+            continue
+        r1_key = FileHashCache.get_key(r1_path, gzip_payload)
+        r2_key = FileHashCache.get_key(r2_path, gzip_payload)
+        to_hash[r1_key] = r1_path.real_path
+        to_hash[r2_key] = r2_path.real_path
+        pairs_to_hash.append((r1_path.relative_path, r1_key, r2_key))
+
+    missing = [key for key in to_hash if hash_cache.get(key) is None]
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        digests = executor.map(
+            lambda key: hash_file(to_hash[key], gzip_payload), missing
+        )
+        for key, digest in zip(missing, digests):
+            hash_cache.add(key, digest)
+
+    for relative_path, r1_key, r2_key in pairs_to_hash:
+        if hash_cache.hashes[r1_key] == hash_cache.hashes[r2_key]:
+            comparison.identical.append(relative_path)
+        else:
+            comparison.differing.append(relative_path)
+
+    return comparison
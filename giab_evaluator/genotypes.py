@@ -0,0 +1,213 @@
+"""
+Per-sample genotype comparison of two scored VCFs, such as trio VCFs.
+
+The GT of each sample call is reduced to a code (ref, het, hom or missing)
+stored in a compact NumPy array with one row per record and one column per
+sample. Records are matched across the runs as in the score comparison, on
+chr/pos/ref/alt keys or, for SVs matched on overlap, on the rows matched by
+match_svs. The codes of the shared records are compared column-wise, giving
+a concordance matrix per sample and the discordant sites.
+"""
+
+from array import array
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from classes import PathObj, VariantKeyEncoder, VariantTable, VariantTableBuilder
+from tabix import Region
+from util import (
+    RowComparison,
+    do_key_comparison,
+    iter_scored_lines,
+    parse_scored_record,
+)
+
+GENOTYPE_LABELS = ["ref", "het", "hom", "missing"]
+REF, HET, HOM, MISSING = range(len(GENOTYPE_LABELS))
+ALLELE_SEPARATOR_PATTERN = re.compile(b"[/|]")
+
+
+def get_genotype_code(gt: bytes) -> int:
+    """Code of a GT value, with any missing allele making the call missing"""
+    alleles = ALLELE_SEPARATOR_PATTERN.split(gt)
+    if len(gt) == 0 or b"." in alleles:
+        return MISSING
+    if all(allele == b"0" for allele in alleles):
+        return REF
+    if all(allele == alleles[0] for allele in alleles):
+        return HOM
+    return HET
+
+
+class GenotypeTable:
+    """Variants of a scored VCF, and the genotype codes of each of its samples"""
+
+    def __init__(
+        self, variants: VariantTable, sample_names: List[str], genotypes: np.ndarray
+    ):
+        self.variants = variants
+        self.sample_names = sample_names
+        self.genotypes = genotypes
+
+
+def read_sample_names(vcf: PathObj) -> List[str]:
+    with vcf.get_filehandle() as in_fh:
+        for line in in_fh:
+            if line.startswith("#CHROM"):
+                return line.rstrip("\n").split("\t")[9:]
+            if not line.startswith("#"):
+                break
+    return []
+
+
+def parse_genotypes(
+    vcf: PathObj, regions: Optional[List[Region]] = None
+) -> GenotypeTable:
+    """
+    Parse the records of a scored VCF and the GT of each sample call. Calls
+    are not kept as objects, only their codes, and the codes of the GT
+    values seen are looked up in a dictionary rather than parsed again.
+    """
+
+    sample_names = read_sample_names(vcf)
+    nbr_samples = len(sample_names)
+    all_missing = [MISSING] * nbr_samples
+    code_by_gt: Dict[bytes, int] = {}
+
+    builder = VariantTableBuilder()
+    codes = array("b")
+    rank_sub_score_names = None
+    for line, rank_sub_score_names in iter_scored_lines(vcf, regions):
+        builder.append(*parse_scored_record(line, rank_sub_score_names))
+        fields = line.split(b"\t", 9)
+        # GT is always the first FORMAT key when present
+        if len(fields) < 10 or not fields[8].startswith(b"GT"):
+            codes.extend(all_missing)
+            continue
+        calls = fields[9].split(b"\t")
+        for call in calls[:nbr_samples]:
+            gt = call.split(b":", 1)[0]
+            code = code_by_gt.get(gt)
+            if code is None:
+                code = get_genotype_code(gt)
+                code_by_gt[gt] = code
+            codes.append(code)
+        if len(calls) < nbr_samples:
+            codes.extend(all_missing[len(calls) :])
+
+    variants = builder.build(rank_sub_score_names or [])
+    return GenotypeTable(
+        variants,
+        sample_names,
+        np.frombuffer(codes, dtype=np.int8).reshape(len(variants), nbr_samples),
+    )
+
+
+class SampleConcordance:
+    """
+    Genotype concordance of a sample over the shared records. The matrix has
+    r1 genotypes as rows and r2 genotypes as columns, ordered as GENOTYPE_LABELS.
+    """
+
+    def __init__(
+        self,
+        sample_r1: str,
+        sample_r2: str,
+        col_r1: int,
+        col_r2: int,
+        matrix: np.ndarray,
+        discordant_rows_r1: np.ndarray,
+        discordant_rows_r2: np.ndarray,
+    ):
+        self.sample_r1 = sample_r1
+        self.sample_r2 = sample_r2
+        self.col_r1 = col_r1
+        self.col_r2 = col_r2
+        self.matrix = matrix
+        self.discordant_rows_r1 = discordant_rows_r1
+        self.discordant_rows_r2 = discordant_rows_r2
+
+    @property
+    def nbr_concordant(self) -> int:
+        return int(np.trace(self.matrix))
+
+    @property
+    def nbr_discordant(self) -> int:
+        return int(self.matrix.sum()) - self.nbr_concordant
+
+    def get_name(self) -> str:
+        if self.sample_r1 == self.sample_r2:
+            return self.sample_r1
+        return f"{self.sample_r1}/{self.sample_r2}"
+
+
+class GenotypeComparison:
+    def __init__(
+        self,
+        nbr_shared: int,
+        samples: List[SampleConcordance],
+        samples_r1_only: List[str],
+        samples_r2_only: List[str],
+    ):
+        self.nbr_shared = nbr_shared
+        self.samples = samples
+        self.samples_r1_only = samples_r1_only
+        self.samples_r2_only = samples_r2_only
+
+
+def get_sample_pairs(
+    samples_r1: List[str], samples_r2: List[str]
+) -> Tuple[List[Tuple[int, int]], List[str], List[str]]:
+    """
+    Column pairs of the samples, matched on name. If no name is shared, such
+    as when the sample names contain the run ID, the columns are matched on
+    their order instead.
+    """
+    shared = [name for name in samples_r1 if name in samples_r2]
+    if len(shared) == 0 and len(samples_r1) == len(samples_r2):
+        return [(col, col) for col in range(len(samples_r1))], [], []
+    pairs = [(samples_r1.index(name), samples_r2.index(name)) for name in shared]
+    r1_only = [name for name in samples_r1 if name not in samples_r2]
+    r2_only = [name for name in samples_r2 if name not in samples_r1]
+    return pairs, r1_only, r2_only
+
+
+def compare_genotype_tables(
+    table_r1: GenotypeTable,
+    table_r2: GenotypeTable,
+    rows: Optional[RowComparison] = None,
+) -> GenotypeComparison:
+    """Compare the shared records, matched on keys unless their rows are given"""
+    if rows is None:
+        rows = do_key_comparison(
+            table_r1.variants, table_r2.variants, VariantKeyEncoder()
+        )
+    pairs, samples_r1_only, samples_r2_only = get_sample_pairs(
+        table_r1.sample_names, table_r2.sample_names
+    )
+
+    nbr_labels = len(GENOTYPE_LABELS)
+    samples: List[SampleConcordance] = []
+    for col_r1, col_r2 in pairs:
+        codes_r1 = table_r1.genotypes[rows.shared_r1, col_r1].astype(np.intp)
+        codes_r2 = table_r2.genotypes[rows.shared_r2, col_r2].astype(np.intp)
+        matrix = np.bincount(
+            codes_r1 * nbr_labels + codes_r2, minlength=nbr_labels**2
+        ).reshape(nbr_labels, nbr_labels)
+        discordant = codes_r1 != codes_r2
+        samples.append(
+            SampleConcordance(
+                table_r1.sample_names[col_r1],
+                table_r2.sample_names[col_r2],
+                col_r1,
+                col_r2,
+                matrix,
+                rows.shared_r1[discordant],
+                rows.shared_r2[discordant],
+            )
+        )
+    return GenotypeComparison(
+        len(rows.shared_r1), samples, samples_r1_only, samples_r2_only
+    )
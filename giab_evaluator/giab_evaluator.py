@@ -1,29 +1,91 @@
 #!/usr/bin/env python3
 
 import argparse
+import contextlib
 from io import TextIOWrapper
 from pathlib import Path
 from configparser import ConfigParser
 from typing import (
+    Callable,
+    Collection,
+    Iterable,
     List,
     Optional,
     Dict,
     Set,
+    Tuple,
+    TypeVar,
+    Union,
 )
-from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import difflib
-
-from classes import DiffScoredVariant
+from functools import partial
+from itertools import islice
+import json
+import time
+
+import numpy as np
+
+from classes import (
+    DiffScoredVariant,
+    IndexedVariantTable,
+    ScoreDiffCollector,
+    ScoredComparison,
+    ScoredVariant,
+    SpooledVariants,
+    TableVariants,
+    VariantTable,
+)
+from file_hashing import FileHashCache, compare_file_contents
+from genotypes import (
+    GENOTYPE_LABELS,
+    GenotypeComparison,
+    GenotypeTable,
+    compare_genotype_tables,
+    parse_genotypes,
+)
+from merge_join import iter_variant_pairs
+from record_index import RECORD_INDEX_DIR, RecordSources, get_record_index
+from result_tables import (
+    OUTPUT_FORMATS,
+    ResultTables,
+    ResultTableWriter,
+    open_result_table,
+)
+from score_analysis import (
+    ScoreDeltaSummary,
+    summarize_diff_scored_variants,
+    summarize_table_deltas,
+)
+from stage_memo import (
+    MEMO_DIR,
+    FILE_HASHES_FILE,
+    ScoreMemo,
+    count_variants_memoized,
+    get_fingerprint,
+)
+from sv_matching import (
+    SvMatches,
+    SvMatchSettings,
+    SvTable,
+    match_svs,
+    parse_sv_table,
+)
+from stage_metrics import StageMetrics, add_records, get_cpu_time, run_measured
+from tabix import MAX_POSITION, Region, load_index, parse_regions
+from vcf_cache import ParsedVcfCache
+from yaml_diff import compare_yaml_structure, yaml
 from util import (
     Comparison,
-    ScoredVariant,
     PathObj,
+    RowComparison,
     add_file_logger,
-    any_is_parent,
-    count_variants,
     do_comparison,
+    do_indexed_key_comparison,
     get_files_in_dir,
     parse_vcf,
+    read_pair,
+    run_with_captured_logs,
     get_files_ending_with,
     get_single_file_ending_with,
     setup_stdout_logger,
@@ -33,15 +95,40 @@ logger = setup_stdout_logger()
 
 RUN_ID_PLACEHOLDER = "RUNID"
 VCF_SUFFIX = [".vcf", ".vcf.gz"]
+VCF_PATTERN = ".vcf$|.vcf.gz$"
+# Label, comparison, config setting and name of the report of all score differences
+SCORE_COMPARISONS = [
+    ("SNV", "score", "scored_snv", "scored_snv_score_all.txt"),
+    ("SV", "score_sv", "scored_sv", "scored_sv_score.txt"),
+]
+
+# Counts summarizing the outcome of a stage, shown in the candidate matrix
+StageResult = Dict[str, int]
+# Name used in the metrics, stage function and its arguments
+Stage = Tuple[str, Callable[..., StageResult], tuple]
+# Settings a baseline held in memory was read with
+BaselineKey = tuple
+# Variants only in r1, only in r2, differently scored and so above the threshold
+ScoredCounts = Tuple[int, int, int, int]
+# Differently scored variants held in memory at once when streaming
+SUMMARY_CHUNK_SIZE = 100000
+T = TypeVar("T")
+# Parsed baseline scored VCF, indexed on keys or, for SVs matched on overlap,
+# with the type and end of each call
+BaselineTable = Union[IndexedVariantTable, SvTable]
+# Parsed baseline scored VCFs, per variant type, in a process running stages
+stage_baseline_tables: Dict[str, BaselineTable] = {}
 
 description = """
 Compare results for runs in the CMD constitutional pipeline.
 
 Performs all or a subset of the comparisons:
 
-- What files are present
+- What files are present, and optionally whether their content is identical
 - Do the VCF files have the same number of variants
 - For the scored SNV and SV VCFs, what are call differences and differences in rank scores
+  SV calls can be matched on overlap, allowing their breakpoints to move
+- Optionally, whether the genotypes of each sample in the scored VCFs agree
 - Are there differences in the Scout yaml
 """
 
@@ -53,32 +140,24 @@ def log_and_write(text: str, fh: Optional[TextIOWrapper]):
 
 
 def main(
+    settings: "ComparisonSettings",
     run_id1: Optional[str],
-    run_id2: Optional[str],
+    run_ids2: Optional[List[str]],
     results1_dir: Path,
-    results2_dir: Path,
-    config_path: str,
-    comparisons: Optional[Set[str]],
-    show_sub_scores: bool,
-    score_threshold: int,
-    max_display: int,
+    results2_dirs: List[Path],
     outdir: Optional[Path],
+    profile: bool,
+    baselines: Optional[Dict[BaselineKey, "Baseline"]] = None,
 ):
 
-    config = ConfigParser()
-    config.read(config_path)
-
-<<<<<<< Updated upstream:giab_evaluator/giab_evaluator.py
-=======
-    if comparisons is not None:
-        valid_comparisons = set(["default", "file", "vcf", "score", "score_sv", "yaml"])
-        if len(comparisons & valid_comparisons) == 0:
-            raise ValueError(f"Valid comparisons are: {valid_comparisons}, found: {comparisons}")
+    start_wall = time.perf_counter()
+    start_cpu = get_cpu_time()
 
->>>>>>> Stashed changes:pipeline_evaluator/evaluator/evaluator.py
-    if not results1_dir.exists() or not results2_dir.exists():
+    if not results1_dir.exists() or not all(
+        results2_dir.exists() for results2_dir in results2_dirs
+    ):
         r1_exists = results1_dir.exists()
-        r2_exists = results2_dir.exists()
+        r2_exists = [results2_dir.exists() for results2_dir in results2_dirs]
         raise ValueError(
             f"Both results dir must exist. Currently r1: {r1_exists} r2: {r2_exists}"
         )
@@ -92,119 +171,925 @@ def main(
         run_id1 = str(results1_dir.name)
         logger.info(f"--run_id1 not set, assigned: {run_id1}")
 
-    if run_id2 is None:
-        run_id2 = str(results2_dir.name)
-        logger.info(f"--run_id2 not set, assigned: {run_id2}")
+    if run_ids2 is None:
+        run_ids2 = [str(results2_dir.name) for results2_dir in results2_dirs]
+        logger.info(f"--run_id2 not set, assigned: {' '.join(run_ids2)}")
+
+    if len(run_ids2) != len(results2_dirs):
+        raise ValueError(
+            f"One --run_id2 is needed per --results2, found {len(run_ids2)} and {len(results2_dirs)}"
+        )
+
+    # With several candidates, each gets its own output folder next to a
+    # combined matrix
+    multi_run = len(results2_dirs) > 1
+    if multi_run and len(set(run_ids2)) < len(run_ids2):
+        raise ValueError(
+            f"Candidate run IDs must be unique, set them using --run_id2. Found: {run_ids2}"
+        )
 
-    r1_paths = get_files_in_dir(results1_dir, run_id1, RUN_ID_PLACEHOLDER, results1_dir)
-    r2_paths = get_files_in_dir(results2_dir, run_id2, RUN_ID_PLACEHOLDER, results2_dir)
+    # Profiles are numbered in the order the stages are listed in the metrics
+    profile_dir = outdir / "profiles" if profile and outdir is not None else None
+    if profile_dir is not None:
+        profile_dir.mkdir(exist_ok=True)
+    # Stage results are memoised in the output folder of each candidate
+    memo_dir = outdir / MEMO_DIR if settings.memo and outdir is not None else None
+    # Run ID of the compared results, and the resources used by each stage
+    measured: List[Tuple[str, StageMetrics]] = []
+
+    if (
+        settings.sv_match_settings is not None
+        and (settings.streaming or settings.shard_contigs)
+        and any(
+            label == "SV" for label, _comp, _name, _all in settings.score_comparisons
+        )
+    ):
+        logger.warning(
+            "SVs matched on overlap are read whole, --streaming and --shard_contigs only apply to the SNVs"
+        )
 
-    if comparisons is None or "file" in comparisons:
-        logger.info("--- Comparing existing files ---")
-        out_path = outdir / "check_sample_files.txt" if outdir else None
+    if settings.cache is not None and (
+        settings.streaming or settings.shard_contigs or settings.regions is not None
+    ):
+        logger.warning(
+            "Scored VCFs read piece by piece, with --streaming, --shard_contigs or --regions, are not cached in --cache_dir"
+        )
 
-        check_same_files(
-            results1_dir,
-            results2_dir,
-            r1_paths,
-            r2_paths,
-            config.get("settings", "ignore").split(","),
-            out_path,
+    if multi_run:
+        logger.info(
+            f"Comparing {len(results2_dirs)} candidates to the baseline {run_id1}"
         )
 
-    if comparisons is None or "vcf" in comparisons:
-        logger.info("--- Comparing VCF numbers ---")
-        is_vcf_pattern = ".vcf$|.vcf.gz$"
-        r1_vcfs = get_files_ending_with(is_vcf_pattern, r1_paths)
-        r2_vcfs = get_files_ending_with(is_vcf_pattern, r2_paths)
-        if len(r1_vcfs) > 0 or len(r2_vcfs) > 0:
-            out_path = outdir / "all_vcf_compare.txt" if outdir else None
-            compare_vcfs(
-                r1_vcfs,
-                r2_vcfs,
+    # When running as a service, baselines are held in memory between calls
+    baseline_key = get_baseline_key(settings, results1_dir, run_id1)
+    baseline = baselines.pop(baseline_key, None) if baselines is not None else None
+    if baseline is not None and not baseline.is_current():
+        logger.info(f"Baseline {run_id1} changed on disk, reading it again")
+        baseline = None
+
+    if baseline is not None:
+        logger.info(f"Reusing the baseline {run_id1} held in memory")
+    else:
+        r1_metrics, (r1_paths, r1_ignored) = run_measured(
+            "discovery",
+            get_files_in_dir,
+            (
+                results1_dir,
+                run_id1,
+                RUN_ID_PLACEHOLDER,
+                results1_dir,
+                settings.ignore_dirs,
+                settings.follow_symlinks,
+            ),
+            get_profile_path(profile_dir, len(measured), run_id1, "discovery"),
+        )
+        measured.append((run_id1, r1_metrics))
+
+        # Baseline results used by all candidates are only read once
+        baseline_vcf_counts: Optional[List[Optional[int]]] = None
+        baseline_tables: Dict[str, BaselineTable] = {}
+        if multi_run or baselines is not None:
+            baseline_metrics, (baseline_vcf_counts, baseline_tables) = run_measured(
+                "baseline",
+                read_baseline,
+                (settings, r1_paths, memo_dir),
+                get_profile_path(profile_dir, len(measured), run_id1, "baseline"),
+            )
+            measured.append((run_id1, baseline_metrics))
+        baseline = Baseline(r1_paths, r1_ignored, baseline_vcf_counts, baseline_tables)
+    if baselines is not None:
+        # Kept in order of use, the least recently used first
+        baselines[baseline_key] = baseline
+
+    stages: List[Stage] = []
+    stage_run_ids: List[str] = []
+    for results2_dir, run_id2 in zip(results2_dirs, run_ids2):
+        pair_outdir = outdir / run_id2 if outdir is not None and multi_run else outdir
+        if pair_outdir is not None:
+            pair_outdir.mkdir(parents=True, exist_ok=True)
+        pair_metrics, pair_stages = run_measured(
+            "discovery",
+            get_pair_stages,
+            (
+                settings,
+                baseline,
+                results1_dir,
+                results2_dir,
                 run_id1,
                 run_id2,
-                str(results1_dir),
-                str(results2_dir),
-                out_path,
+                pair_outdir,
+            ),
+            get_profile_path(profile_dir, len(measured), run_id2, "discovery"),
+        )
+        measured.append((run_id2, pair_metrics))
+        stages.extend(pair_stages)
+        stage_run_ids.extend([run_id2] * len(pair_stages))
+
+    profile_paths = [
+        get_profile_path(profile_dir, len(measured) + index, run_id2, name)
+        for index, (run_id2, (name, _stage_func, _stage_args)) in enumerate(
+            zip(stage_run_ids, stages)
+        )
+    ]
+    stage_outcomes = run_stages(
+        stages,
+        stage_run_ids,
+        run_id1 if multi_run else None,
+        baseline.tables,
+        settings.jobs,
+        profile_paths,
+    )
+    measured.extend(
+        (run_id2, stage_metrics)
+        for run_id2, (stage_metrics, _stage_result) in zip(
+            stage_run_ids, stage_outcomes
+        )
+    )
+
+    if multi_run:
+        matrix: Dict[str, Dict[str, int]] = {run_id2: {} for run_id2 in run_ids2}
+        for run_id2, (_stage_metrics, stage_result) in zip(
+            stage_run_ids, stage_outcomes
+        ):
+            matrix[run_id2].update(stage_result)
+        write_candidate_matrix(
+            run_id1,
+            matrix,
+            outdir / "candidate_matrix.txt" if outdir is not None else None,
+        )
+
+    if outdir is not None:
+        write_metrics(
+            measured,
+            time.perf_counter() - start_wall,
+            get_cpu_time() - start_cpu,
+            settings.jobs,
+            outdir / "metrics.json",
+        )
+
+
+class Baseline:
+    """
+    Files of the baseline results, with their VCF counts and parsed scored
+    VCFs when these are read up front
+    """
+
+    def __init__(
+        self,
+        r1_paths: List[PathObj],
+        r1_ignored: List[Path],
+        vcf_counts: Optional[List[Optional[int]]],
+        tables: Dict[str, BaselineTable],
+    ):
+        self.r1_paths = r1_paths
+        self.r1_ignored = r1_ignored
+        self.vcf_counts = vcf_counts
+        self.tables = tables
+        self.fingerprints = self.get_fingerprints()
+
+    def get_fingerprints(self) -> Optional[List[str]]:
+        try:
+            return [get_fingerprint(path) for path in self.r1_paths]
+        except OSError:
+            return None
+
+    def is_current(self) -> bool:
+        """Whether the files are unchanged. Files added since are not detected."""
+        fingerprints = self.get_fingerprints()
+        return fingerprints is not None and fingerprints == self.fingerprints
+
+
+class ComparisonSettings:
+    """Settings shared by the comparisons of all candidates to the baseline"""
+
+    def __init__(
+        self,
+        config: ConfigParser,
+        comparisons: Optional[Set[str]],
+        ignore_dirs: List[str],
+        follow_symlinks: bool,
+        show_sub_scores: bool,
+        score_threshold: int,
+        max_display: int,
+        streaming: bool,
+        shard_contigs: bool,
+        jobs: int,
+        cache: Optional[ParsedVcfCache],
+        cache_dir: Optional[Path],
+        regions: Optional[List[Region]],
+        gzip_payload: bool,
+        output_format: str,
+        structural_yaml: bool,
+        memo: bool,
+        score_comparisons: List[Tuple[str, str, str, str]],
+        sv_match_settings: Optional[SvMatchSettings],
+        attach_records: int,
+        record_index_dir: Optional[Path],
+    ):
+        self.config = config
+        self.comparisons = comparisons
+        self.ignore_dirs = ignore_dirs
+        self.follow_symlinks = follow_symlinks
+        self.show_sub_scores = show_sub_scores
+        self.score_threshold = score_threshold
+        self.max_display = max_display
+        self.streaming = streaming
+        self.shard_contigs = shard_contigs
+        self.jobs = jobs
+        self.cache = cache
+        self.cache_dir = cache_dir
+        self.regions = regions
+        self.gzip_payload = gzip_payload
+        self.output_format = output_format
+        self.structural_yaml = structural_yaml
+        self.memo = memo
+        self.score_comparisons = score_comparisons
+        self.sv_match_settings = sv_match_settings
+        self.attach_records = attach_records
+        self.record_index_dir = record_index_dir
+
+
+class ComparedPair:
+    """Baseline and candidate results compared by the stages of one candidate"""
+
+    def __init__(
+        self,
+        results1_dir: Path,
+        results2_dir: Path,
+        run_id1: str,
+        run_id2: str,
+        r1_paths: List[PathObj],
+        r2_paths: List[PathObj],
+        outdir: Optional[Path],
+        result_tables: Optional[ResultTables],
+        memo_dir: Optional[Path],
+    ):
+        self.results1_dir = results1_dir
+        self.results2_dir = results2_dir
+        self.run_id1 = run_id1
+        self.run_id2 = run_id2
+        self.r1_paths = r1_paths
+        self.r2_paths = r2_paths
+        self.outdir = outdir
+        self.result_tables = result_tables
+        self.memo_dir = memo_dir
+
+    def get_out_path(self, name: str) -> Optional[Path]:
+        return self.outdir / name if self.outdir else None
+
+
+def get_baseline_key(
+    settings: ComparisonSettings, results1_dir: Path, run_id1: str
+) -> BaselineKey:
+    """Settings affecting what is read from the baseline"""
+    return (
+        str(results1_dir.resolve()),
+        run_id1,
+        tuple(settings.ignore_dirs),
+        settings.follow_symlinks,
+        (
+            tuple(sorted(settings.comparisons))
+            if settings.comparisons is not None
+            else None
+        ),
+        settings.streaming,
+        settings.shard_contigs,
+        # The parsed regions, as the same BED path can hold other regions
+        (
+            tuple(str(region) for region in settings.regions)
+            if settings.regions is not None
+            else None
+        ),
+        tuple(
+            settings.config["settings"][name]
+            for _label, _comp, name, _all in settings.score_comparisons
+        ),
+        settings.sv_match_settings is not None,
+    )
+
+
+def read_baseline(
+    settings: ComparisonSettings, r1_paths: List[PathObj], memo_dir: Optional[Path]
+) -> Tuple[Optional[List[Optional[int]]], Dict[str, BaselineTable]]:
+    """Baseline VCF counts and scored VCFs, read once for all candidates"""
+    baseline_vcf_counts: Optional[List[Optional[int]]] = None
+    baseline_tables: Dict[str, BaselineTable] = {}
+    if settings.comparisons is None or "vcf" in settings.comparisons:
+        baseline_vcf_counts = count_variants_memoized(
+            get_files_ending_with(VCF_PATTERN, r1_paths), settings.jobs, memo_dir
+        )
+    for label, _comparison, name, _all_name in settings.score_comparisons:
+        sv_overlap = label == "SV" and settings.sv_match_settings is not None
+        # Streaming and sharded comparisons read the VCFs piece by piece, SVs
+        # matched on overlap are always read whole
+        if (settings.streaming or settings.shard_contigs) and not sv_overlap:
+            continue
+        r1_scored_vcf = get_single_file_ending_with(
+            settings.config["settings"][name], r1_paths
+        )
+        if r1_scored_vcf and sv_overlap:
+            baseline_tables[label] = parse_sv_table_cached(
+                r1_scored_vcf, settings.cache, settings.regions
             )
-        else:
-            logger.warning("No VCFs detected, skipping VCF comparison")
-
-    if comparisons is None or "score" in comparisons:
-        logger.info("--- Comparing scored SNV VCFs ---")
-        r1_scored_snv_vcf = get_single_file_ending_with(
-            config["settings"]["scored_snv"], r1_paths
-        )
-        r2_scored_snv_vcf = get_single_file_ending_with(
-            config["settings"]["scored_snv"], r2_paths
-        )
-        if r1_scored_snv_vcf and r2_scored_snv_vcf:
-            out_path_presence = outdir / "scored_snv_presence.txt" if outdir else None
-            out_path_score_thres = (
-                outdir / f"scored_snv_score_thres_{score_threshold}.txt"
-                if outdir
-                else None
+        elif r1_scored_vcf:
+            baseline_tables[label] = IndexedVariantTable(
+                parse_vcf_cached(r1_scored_vcf, settings.cache, settings.regions)
             )
-            out_path_score_all = outdir / "scored_snv_score_all.txt" if outdir else None
-            variant_comparison(
-                r1_scored_snv_vcf,
-                r2_scored_snv_vcf,
-                show_sub_scores,
-                score_threshold,
-                max_display,
-                out_path_presence,
-                out_path_score_thres,
-                out_path_score_all,
+    return baseline_vcf_counts, baseline_tables
+
+
+def get_profile_path(
+    profile_dir: Optional[Path], index: int, run_id: str, name: str
+) -> Optional[Path]:
+    if profile_dir is None:
+        return None
+    return profile_dir / f"{index:02d}_{run_id}_{name}.prof"
+
+
+def write_metrics(
+    measured: List[Tuple[str, StageMetrics]],
+    wall_s: float,
+    cpu_s: float,
+    jobs: int,
+    out_path: Path,
+):
+    """
+    Resources used per stage. CPU time includes processes started by a stage,
+    while bytes read and records only cover the process running it.
+    """
+    stage_dicts = []
+    for run_id, stage_metrics in measured:
+        stage_dict = {"run_id": run_id}
+        stage_dict.update(stage_metrics.to_dict())
+        stage_dicts.append(stage_dict)
+    with open(out_path, "w") as out_fh:
+        json.dump(
+            {
+                "jobs": jobs,
+                "total": {
+                    "wall_s": round(wall_s, 4),
+                    "cpu_s": round(cpu_s, 4),
+                    "peak_rss_mb": round(
+                        max(stage_metrics.peak_rss_mb for _, stage_metrics in measured),
+                        1,
+                    ),
+                },
+                "stages": stage_dicts,
+            },
+            out_fh,
+            indent=2,
+        )
+
+
+def get_pair_stages(
+    settings: ComparisonSettings,
+    baseline: "Baseline",
+    results1_dir: Path,
+    results2_dir: Path,
+    run_id1: str,
+    run_id2: str,
+    outdir: Optional[Path],
+) -> List[Stage]:
+    """Stages comparing one candidate results folder to the baseline"""
+
+    r2_paths, r2_ignored = get_files_in_dir(
+        results2_dir,
+        run_id2,
+        RUN_ID_PLACEHOLDER,
+        results2_dir,
+        settings.ignore_dirs,
+        settings.follow_symlinks,
+    )
+
+    pair = ComparedPair(
+        results1_dir,
+        results2_dir,
+        run_id1,
+        run_id2,
+        baseline.r1_paths,
+        r2_paths,
+        outdir,
+        # Text reports are always written, other formats are written next to them
+        (
+            ResultTables(outdir, settings.output_format, run_id1, run_id2)
+            if outdir is not None and settings.output_format != "text"
+            else None
+        ),
+        outdir / MEMO_DIR if settings.memo and outdir is not None else None,
+    )
+
+    stages: List[Stage] = []
+
+    if settings.comparisons is None or "file" in settings.comparisons:
+        ignored_dirs = sorted(set(baseline.r1_ignored) | set(r2_ignored))
+        stages.append(("file", file_stage, (settings, pair, ignored_dirs)))
+
+    if settings.comparisons is not None and "content" in settings.comparisons:
+        stages.append(("content", content_stage, (settings, pair)))
+
+    if settings.comparisons is None or "vcf" in settings.comparisons:
+        stages.append(("vcf", vcf_stage, (settings, pair, baseline.vcf_counts)))
+
+    for label, comparison, name, all_name in settings.score_comparisons:
+        stages.append(
+            (comparison, score_stage, (settings, pair, label, name, all_name))
+        )
+
+    # Genotypes are compared in the scored VCFs, of both variant types
+    if settings.comparisons is not None and "gt" in settings.comparisons:
+        for label, _comparison, name, _all_name in SCORE_COMPARISONS:
+            stages.append(("gt", genotype_stage, (settings, pair, label, name)))
+
+    if settings.comparisons is None or "yaml" in settings.comparisons:
+        stages.append(("yaml", yaml_stage, (settings, pair)))
+
+    return stages
+
+
+def set_stage_baseline_tables(tables: Dict[str, BaselineTable]):
+    global stage_baseline_tables
+    stage_baseline_tables = tables
+
+
+def run_stages(
+    stages: List[Stage],
+    stage_run_ids: List[str],
+    baseline_run_id: Optional[str],
+    baseline_tables: Dict[str, BaselineTable],
+    jobs: int,
+    profile_paths: List[Optional[Path]],
+) -> List[Tuple[StageMetrics, StageResult]]:
+    """
+    Run the comparison stages, either one after another or on a process pool.
+    The resources used by each stage are measured in the process running it.
+
+    When running in parallel, the log output of each stage is buffered in the
+    worker and replayed in stage order, so that the output of a stage is kept
+    together and out.log is the same regardless of the number of jobs.
+
+    The parsed baseline scored VCFs are set once in each process running
+    stages, by the pool initializer, rather than sent to the workers with the
+    arguments of the score stage of each candidate. If 'baseline_run_id' is
+    given, a header is logged before the stages of each candidate.
+    """
+
+    def log_candidate_header(index: int):
+        if baseline_run_id is not None and (
+            index == 0 or stage_run_ids[index] != stage_run_ids[index - 1]
+        ):
+            logger.info(
+                f"=== Comparing {stage_run_ids[index]} to the baseline {baseline_run_id} ==="
             )
-        else:
-            logger.warning(
-                f"At least one scored SNV VCF missing. Looking for the pattern: {config['settings']['scored_snv']}"
+
+    if jobs <= 1 or len(stages) <= 1:
+        set_stage_baseline_tables(baseline_tables)
+        try:
+            stage_outcomes: List[Tuple[StageMetrics, StageResult]] = []
+            for index, ((name, stage_func, stage_args), profile_path) in enumerate(
+                zip(stages, profile_paths)
+            ):
+                log_candidate_header(index)
+                stage_outcomes.append(
+                    run_measured(name, stage_func, stage_args, profile_path)
+                )
+            return stage_outcomes
+        finally:
+            set_stage_baseline_tables({})
+
+    stage_outcomes = []
+    with ProcessPoolExecutor(
+        max_workers=min(jobs, len(stages)),
+        initializer=set_stage_baseline_tables,
+        initargs=(baseline_tables,),
+    ) as executor:
+        futures = [
+            executor.submit(
+                run_with_captured_logs,
+                logger,
+                run_measured,
+                (name, stage_func, stage_args, profile_path),
             )
+            for (name, stage_func, stage_args), profile_path in zip(
+                stages, profile_paths
+            )
+        ]
+        for index, future in enumerate(futures):
+            records, stage_outcome, error = future.result()
+            log_candidate_header(index)
+            for record in records:
+                logger.handle(record)
+            if error is not None:
+                raise error
+            stage_outcomes.append(stage_outcome)
+    return stage_outcomes
+
+
+def write_candidate_matrix(
+    run_id1: str, matrix: Dict[str, StageResult], out_path: Optional[Path]
+):
+    """One row per compared quantity, and one column per candidate"""
+    run_ids2 = list(matrix)
+    rows: List[str] = []
+    for stage_result in matrix.values():
+        rows.extend(row for row in stage_result if row not in rows)
+
+    out_fh = open(out_path, "w") if out_path else None
+    log_and_write(f"--- Candidates compared to the baseline {run_id1} ---", out_fh)
+    log_and_write("\t".join(["comparison"] + run_ids2), out_fh)
+    for row in rows:
+        values = [str(matrix[run_id2].get(row, "-")) for run_id2 in run_ids2]
+        log_and_write("\t".join([row] + values), out_fh)
+    if out_fh:
+        out_fh.close()
+
+
+def file_stage(
+    settings: ComparisonSettings, pair: ComparedPair, ignored_dirs: List[Path]
+) -> StageResult:
+    logger.info("--- Comparing existing files ---")
+    out_path = pair.get_out_path("check_sample_files.txt")
+
+    table = open_result_table(pair.result_tables, "file_presence", "file_presence")
+    comparison = check_same_files(
+        pair.results1_dir,
+        pair.results2_dir,
+        pair.r1_paths,
+        pair.r2_paths,
+        ignored_dirs,
+        out_path,
+        table,
+    )
+    if table:
+        table.close()
+    return {
+        "files only in baseline": len(comparison.r1),
+        "files only in candidate": len(comparison.r2),
+    }
+
+
+def content_stage(settings: ComparisonSettings, pair: ComparedPair) -> StageResult:
+    logger.info("--- Comparing file contents ---")
+    out_path = pair.get_out_path("check_file_contents.txt")
+
+    # File hashes are kept with the memo, unless a cache folder is given
+    if settings.cache_dir is not None:
+        hash_cache_path: Optional[Path] = settings.cache_dir / "file_hashes.json"
+    elif pair.memo_dir is not None:
+        hash_cache_path = pair.memo_dir / FILE_HASHES_FILE
+    else:
+        hash_cache_path = None
+
+    r2_by_relative_path = {path.relative_path: path for path in pair.r2_paths}
+    file_pairs = [
+        (r1_path, r2_by_relative_path[r1_path.relative_path])
+        for r1_path in sorted(pair.r1_paths, key=lambda path: path.relative_path)
+        if r1_path.relative_path in r2_by_relative_path
+    ]
+
+    hash_cache = FileHashCache(hash_cache_path)
+    comparison = compare_file_contents(
+        file_pairs, settings.gzip_payload, settings.jobs, hash_cache
+    )
+    hash_cache.save()
+    if hash_cache_path is not None:
+        logger.info(f"Reused {hash_cache.nbr_hits} cached file hashes")
 
-    if comparisons is None or "score_sv" in comparisons:
-        logger.info("--- Comparing scored SV VCFs ---")
-        r1_scored_sv_vcf = get_single_file_ending_with(
-            config["settings"]["scored_sv"], r1_paths
+    out_fh = open(out_path, "w") if out_path else None
+
+    log_and_write(f"Identical: {len(comparison.identical)}", out_fh)
+    log_and_write(f"Differing: {len(comparison.differing)}", out_fh)
+    log_and_write(f"Differing in size: {len(comparison.size_differing)}", out_fh)
+
+    if len(comparison.differing) > 0:
+        log_and_write("Files with differing content:", out_fh)
+        for path in comparison.differing:
+            log_and_write(f"  {path}", out_fh)
+
+    if len(comparison.size_differing) > 0:
+        log_and_write("Files differing in size (r1 bytes, r2 bytes):", out_fh)
+        for path, r1_size, r2_size in comparison.size_differing:
+            log_and_write(f"  {path} {r1_size} {r2_size}", out_fh)
+
+    # Only list identical files in the output file
+    if out_fh:
+        print("Identical files:", file=out_fh)
+        for path in comparison.identical:
+            print(f"  {path}", file=out_fh)
+        out_fh.close()
+
+    return {
+        "files with differing content": len(comparison.differing)
+        + len(comparison.size_differing)
+    }
+
+
+def vcf_stage(
+    settings: ComparisonSettings,
+    pair: ComparedPair,
+    baseline_vcf_counts: Optional[List[Optional[int]]],
+) -> StageResult:
+    logger.info("--- Comparing VCF numbers ---")
+    r1_vcfs = get_files_ending_with(VCF_PATTERN, pair.r1_paths)
+    r2_vcfs = get_files_ending_with(VCF_PATTERN, pair.r2_paths)
+    if len(r1_vcfs) > 0 or len(r2_vcfs) > 0:
+        out_path = pair.get_out_path("all_vcf_compare.txt")
+        table = open_result_table(pair.result_tables, "vcf_counts", "vcf_counts")
+        nbr_differing = compare_vcfs(
+            r1_vcfs,
+            r2_vcfs,
+            pair.run_id1,
+            pair.run_id2,
+            str(pair.results1_dir),
+            str(pair.results2_dir),
+            out_path,
+            settings.jobs,
+            table,
+            baseline_vcf_counts,
+            pair.memo_dir,
+        )
+        if table:
+            table.close()
+        return {"VCFs with differing counts": nbr_differing}
+    else:
+        logger.warning("No VCFs detected, skipping VCF comparison")
+        return {}
+
+
+def score_stage(
+    settings: ComparisonSettings,
+    pair: ComparedPair,
+    label: str,
+    name: str,
+    all_name: str,
+) -> StageResult:
+    logger.info(f"--- Comparing scored {label} VCFs ---")
+    baseline_table = stage_baseline_tables.get(label)
+    pattern = settings.config["settings"][name]
+    sv_match_settings = settings.sv_match_settings if label == "SV" else None
+    score_threshold = settings.score_threshold
+    regions = settings.regions
+    if regions is not None:
+        logger.info(f"Limited to {len(regions)} region(s)")
+    r1_scored_vcf = get_single_file_ending_with(pattern, pair.r1_paths)
+    r2_scored_vcf = get_single_file_ending_with(pattern, pair.r2_paths)
+    if r1_scored_vcf and r2_scored_vcf:
+        out_path_presence = pair.get_out_path(f"{name}_presence.txt")
+        out_path_score_thres = pair.get_out_path(
+            f"{name}_score_thres_{score_threshold}.txt"
+        )
+        out_path_score_all = pair.get_out_path(all_name)
+        out_path_score_summary = pair.get_out_path(f"{name}_score_summary.txt")
+        presence_table = open_result_table(
+            pair.result_tables,
+            f"scored_{label.lower()}_presence",
+            "variant_presence",
+            variant_type=label,
         )
-        r2_scored_sv_vcf = get_single_file_ending_with(
-            config["settings"]["scored_sv"], r1_paths
+        score_diff_table = open_result_table(
+            pair.result_tables,
+            f"scored_{label.lower()}_score_diffs",
+            "score_diffs",
+            variant_type=label,
         )
-        if r1_scored_sv_vcf and r2_scored_sv_vcf:
-            out_path_presence = outdir / "scored_sv_presence.txt" if outdir else None
-            out_path_score_thres = (
-                outdir / f"scored_sv_score_thres_{score_threshold}.txt"
-                if outdir
-                else None
+        record_sources = (
+            RecordSources(
+                r1_scored_vcf,
+                r2_scored_vcf,
+                settings.record_index_dir,
+                settings.attach_records,
+                pair.get_out_path(f"{name}_score_records.txt"),
             )
-            out_path_score_all = outdir / "scored_sv_score.txt" if outdir else None
-            variant_comparison(
-                r1_scored_sv_vcf,
-                r2_scored_sv_vcf,
-                show_sub_scores,
+            if settings.attach_records > 0
+            else None
+        )
+        # SV files are small, and once parsed, matching them on overlap takes
+        # less time than a memo would save. It is not memoised.
+        memo = (
+            ScoreMemo(
+                pair.memo_dir,
+                f"scored_{label.lower()}",
+                r1_scored_vcf,
+                r2_scored_vcf,
+                [str(region) for region in regions] if regions is not None else None,
+            )
+            if pair.memo_dir is not None and sv_match_settings is None
+            else None
+        )
+        memoized = memo.load() if memo is not None else None
+        if sv_match_settings is not None:
+            counts = sv_overlap_comparison(
+                r1_scored_vcf,
+                r2_scored_vcf,
+                sv_match_settings,
+                baseline_table if isinstance(baseline_table, SvTable) else None,
+                settings.cache,
+                settings.show_sub_scores,
                 score_threshold,
-                max_display,
+                settings.max_display,
                 out_path_presence,
                 out_path_score_thres,
                 out_path_score_all,
+                out_path_score_summary,
+                pair.get_out_path(f"{name}_matches.txt"),
+                presence_table,
+                score_diff_table,
+                record_sources,
+                regions,
             )
-        else:
-            logger.warning(
-                f"At least one scored SV VCF missing. Looking for the pattern: {config['settings']['scored_sv']}"
+        elif memoized is not None:
+            logger.info(f"Reusing the stored comparison in {pair.memo_dir}")
+            with memoized:
+                counts = report_scored_comparison(
+                    ScoredComparison(
+                        memoized.r1_only,
+                        memoized.r2_only,
+                        memoized.nbr_common,
+                        memoized.iter_diff_scored_variants(),
+                        memoized.sub_score_names_r1,
+                        memoized.sub_score_names_r2,
+                        summarize_diff_scored_chunks(
+                            memoized.iter_diff_scored_variants(),
+                            memoized.nbr_unchanged,
+                            (
+                                memoized.sub_score_names_r1
+                                if memoized.sub_score_names_r1
+                                == memoized.sub_score_names_r2
+                                else []
+                            ),
+                            score_threshold,
+                        ),
+                    ),
+                    str(r1_scored_vcf.real_path),
+                    str(r2_scored_vcf.real_path),
+                    settings.show_sub_scores,
+                    score_threshold,
+                    settings.max_display,
+                    out_path_presence,
+                    out_path_score_thres,
+                    out_path_score_all,
+                    out_path_score_summary,
+                    presence_table,
+                    score_diff_table,
+                    record_sources,
+                )
+        elif settings.streaming:
+            counts = streaming_variant_comparison(
+                r1_scored_vcf,
+                r2_scored_vcf,
+                settings.show_sub_scores,
+                score_threshold,
+                settings.max_display,
+                out_path_presence,
+                out_path_score_thres,
+                out_path_score_all,
+                out_path_score_summary,
+                presence_table,
+                score_diff_table,
+                record_sources,
+                regions,
+                memo,
+            )
+        elif settings.shard_contigs:
+            counts = sharded_variant_comparison(
+                r1_scored_vcf,
+                r2_scored_vcf,
+                settings.show_sub_scores,
+                score_threshold,
+                settings.max_display,
+                out_path_presence,
+                out_path_score_thres,
+                out_path_score_all,
+                out_path_score_summary,
+                presence_table,
+                score_diff_table,
+                record_sources,
+                regions,
+                settings.jobs,
+                memo,
             )
-
-    if comparisons is None or "yaml" in comparisons:
-        logger.info("--- Comparing YAML ---")
-        yaml_pattern = config["settings"]["yaml"]
-        r1_scored_yaml = get_single_file_ending_with(yaml_pattern, r1_paths)
-        r2_scored_yaml = get_single_file_ending_with(yaml_pattern, r2_paths)
-        if r1_scored_yaml and r2_scored_yaml:
-            out_path = outdir / "yaml_diff.txt" if outdir else None
-            compare_yaml(r1_scored_yaml, r2_scored_yaml, out_path)
         else:
-            logger.warning(
-                f"At least Scout YAML missing. Looking for the pattern: {config['settings']['yaml']}"
+            counts = variant_comparison(
+                r1_scored_vcf,
+                r2_scored_vcf,
+                settings.show_sub_scores,
+                score_threshold,
+                settings.max_display,
+                out_path_presence,
+                out_path_score_thres,
+                out_path_score_all,
+                out_path_score_summary,
+                presence_table,
+                score_diff_table,
+                record_sources,
+                (
+                    baseline_table
+                    if isinstance(baseline_table, IndexedVariantTable)
+                    else None
+                ),
+                settings.cache,
+                regions,
+                memo,
+            )
+        if presence_table:
+            presence_table.close()
+        if score_diff_table:
+            score_diff_table.close()
+        only_r1, only_r2, nbr_diff, nbr_diff_above_thres = counts
+        return {
+            f"{label} only in baseline": only_r1,
+            f"{label} only in candidate": only_r2,
+            f"{label} differently scored": nbr_diff,
+            f"{label} differently scored above {score_threshold}": nbr_diff_above_thres,
+        }
+    else:
+        logger.warning(
+            f"At least one scored {label} VCF missing. Looking for the pattern: {pattern}"
+        )
+        return {}
+
+
+def genotype_stage(
+    settings: ComparisonSettings, pair: ComparedPair, label: str, name: str
+) -> StageResult:
+    logger.info(f"--- Comparing genotypes in scored {label} VCFs ---")
+    pattern = settings.config["settings"][name]
+    r1_scored_vcf = get_single_file_ending_with(pattern, pair.r1_paths)
+    r2_scored_vcf = get_single_file_ending_with(pattern, pair.r2_paths)
+    if r1_scored_vcf and r2_scored_vcf:
+        table_r1, table_r2 = read_pair(
+            partial(parse_genotypes, regions=settings.regions),
+            r1_scored_vcf,
+            r2_scored_vcf,
+        )
+        concordance_table = open_result_table(
+            pair.result_tables,
+            f"scored_{label.lower()}_genotype_concordance",
+            "genotype_concordance",
+            variant_type=label,
+        )
+        discordance_table = open_result_table(
+            pair.result_tables,
+            f"scored_{label.lower()}_genotype_discordance",
+            "genotype_discordance",
+            variant_type=label,
+        )
+        # SVs matched on overlap are compared on the same calls as their scores.
+        # Both parsers keep the records in file order, so the rows line up.
+        rows = None
+        if label == "SV" and settings.sv_match_settings is not None:
+            baseline_table = stage_baseline_tables.get(label)
+            sv_table_r1, sv_table_r2 = read_sv_table_pair(
+                r1_scored_vcf,
+                r2_scored_vcf,
+                baseline_table if isinstance(baseline_table, SvTable) else None,
+                settings.cache,
+                settings.regions,
+            )
+            rows = match_svs(sv_table_r1, sv_table_r2, settings.sv_match_settings).rows
+        comparison = compare_genotype_tables(table_r1, table_r2, rows)
+        write_genotype_comparison(
+            comparison,
+            table_r1,
+            table_r2,
+            settings.max_display,
+            pair.get_out_path(f"{name}_genotypes.txt"),
+            concordance_table,
+            discordance_table,
+        )
+        if concordance_table:
+            concordance_table.close()
+        if discordance_table:
+            discordance_table.close()
+        return {
+            f"{label} discordant genotypes ({sample.get_name()})": sample.nbr_discordant
+            for sample in comparison.samples
+        }
+    else:
+        logger.warning(
+            f"At least one scored {label} VCF missing. Looking for the pattern: {pattern}"
+        )
+        return {}
+
+
+def yaml_stage(settings: ComparisonSettings, pair: ComparedPair) -> StageResult:
+    logger.info("--- Comparing YAML ---")
+    yaml_pattern = settings.config["settings"]["yaml"]
+    r1_scored_yaml = get_single_file_ending_with(yaml_pattern, pair.r1_paths)
+    r2_scored_yaml = get_single_file_ending_with(yaml_pattern, pair.r2_paths)
+    if r1_scored_yaml and r2_scored_yaml:
+        out_path = pair.get_out_path("yaml_diff.txt")
+        if settings.structural_yaml:
+            nbr_changes = compare_yaml_structural(
+                r1_scored_yaml, r2_scored_yaml, out_path
             )
+        else:
+            nbr_changes = compare_yaml(r1_scored_yaml, r2_scored_yaml, out_path)
+        return {"YAML changes": nbr_changes}
+    else:
+        logger.warning(
+            f"At least Scout YAML missing. Looking for the pattern: {yaml_pattern}"
+        )
+        return {}
 
 
 def check_same_files(
@@ -212,9 +1097,10 @@ def check_same_files(
     r2_dir: Path,
     r1_paths: List[PathObj],
     r2_paths: List[PathObj],
-    ignore_files: List[str],
+    ignored_dirs: List[Path],
     out_path: Optional[Path],
-):
+    table: Optional[ResultTableWriter],
+) -> Comparison[Path]:
 
     r1_label = str(r1_dir)
     r2_label = str(r2_dir)
@@ -223,76 +1109,93 @@ def check_same_files(
     files_in_results2 = set(path.relative_path for path in r2_paths)
 
     comparison = do_comparison(files_in_results1, files_in_results2)
-    ignored: defaultdict[str, int] = defaultdict(int)
 
     out_fh = open(out_path, "w") if out_path else None
 
     if len(comparison.r1) > 0:
         log_and_write(f"Files present in {r1_label} but missing in {r2_label}:", out_fh)
-        for path in comparison.r1:
-            if any_is_parent(path, ignore_files):
-                ignored[str(path.parent)] += 1
-                continue
+        for path in sorted(comparison.r1):
             log_and_write(f"  {path}", out_fh)
 
     if len(comparison.r2) > 0:
         log_and_write(f"Files present in {r2_label} but missing in {r1_label}", out_fh)
-        for path in comparison.r2:
-            if any_is_parent(path, ignore_files):
-                ignored[str(path.parent)] += 1
-                continue
+        for path in sorted(comparison.r2):
             log_and_write(f"  {path}", out_fh)
 
-    if len(ignored) > 0:
+    # Ignored folders are skipped while listing the files
+    if len(ignored_dirs) > 0:
         log_and_write("Ignored", out_fh)
-        for key, val in ignored.items():
-            log_and_write(f"  {key}: {val}", out_fh)
+        for ignored_dir in ignored_dirs:
+            log_and_write(f"  {ignored_dir}: not compared", out_fh)
 
     if out_fh:
         out_fh.close()
 
+    if table:
+        for path in sorted(files_in_results1 | files_in_results2):
+            table.append(
+                {
+                    "path": str(path),
+                    "in_r1": path in files_in_results1,
+                    "in_r2": path in files_in_results2,
+                }
+            )
+
+    return comparison
+
 
 def compare_variant_presence(
     label_r1: str,
     label_r2: str,
-    variants_r1: Dict[str, ScoredVariant],
-    variants_r2: Dict[str, ScoredVariant],
-    comparison_results: Comparison[str],
+    nbr_common: int,
+    r1_only: Collection[ScoredVariant],
+    r2_only: Collection[ScoredVariant],
     max_display: int,
     out_path: Optional[Path],
+    table: Optional[ResultTableWriter],
 ):
 
-    r1_only = comparison_results.r1
-    r2_only = comparison_results.r2
-    common = comparison_results.shared
-
     out_fh = open(out_path, "w") if out_path else None
 
-    log_and_write(f"In common: {len(common)}", out_fh)
+    log_and_write(f"In common: {nbr_common}", out_fh)
     log_and_write(f"Only in {label_r1}: {len(r1_only)}", out_fh)
     log_and_write(f"Only in {label_r2}: {len(r2_only)}", out_fh)
 
     # Only show max max_display in STDOUT
     logger.info(f"First {min(len(r1_only), max_display)} only found in {label_r1}")
-    for var in list(r1_only)[0:max_display]:
-        logger.info(str(variants_r1[var]))
+    for var in islice(r1_only, max_display):
+        logger.info(var)
     logger.info(f"First {min(len(r2_only), max_display)} only found in {label_r2}")
-    for var in list(r2_only)[0:max_display]:
-        logger.info(str(variants_r2[var]))
+    for var in islice(r2_only, max_display):
+        logger.info(var)
 
     # Write all to file
     print(f"Only found in {label_r1}", file=out_fh)
-    for var in list(r1_only):
-        print(str(variants_r1[var]), file=out_fh)
+    for var in r1_only:
+        print(var, file=out_fh)
     print(
         f"First {min(len(r2_only), max_display)} only found in {label_r2}", file=out_fh
     )
-    for var in list(r2_only):
-        print(str(variants_r2[var]), file=out_fh)
+    for var in r2_only:
+        print(var, file=out_fh)
 
     if out_fh:
         out_fh.close()
 
+    if table:
+        for run, only_in_run in [("r1", r1_only), ("r2", r2_only)]:
+            for var in only_in_run:
+                table.append(
+                    {
+                        "run": run,
+                        "chr": var.chr,
+                        "pos": var.pos,
+                        "ref": var.ref,
+                        "alt": var.alt,
+                        "rank_score": var.rank_score,
+                    }
+                )
+
 
 def variant_comparison(
     r1_scored_vcf: PathObj,
@@ -303,33 +1206,663 @@ def variant_comparison(
     out_path_presence: Optional[Path],
     out_path_score_above_thres: Optional[Path],
     out_path_score_all: Optional[Path],
-):
-    variants_r1 = parse_vcf(r1_scored_vcf)
-    variants_r2 = parse_vcf(r2_scored_vcf)
-    comparison_results = do_comparison(
-        set(variants_r1.keys()),
-        set(variants_r2.keys()),
+    out_path_score_summary: Optional[Path],
+    presence_table: Optional[ResultTableWriter],
+    score_diff_table: Optional[ResultTableWriter],
+    record_sources: Optional[RecordSources],
+    baseline_table: Optional[IndexedVariantTable],
+    cache: Optional[ParsedVcfCache],
+    regions: Optional[List[Region]],
+    memo: Optional[ScoreMemo],
+) -> ScoredCounts:
+    if baseline_table is None:
+        (table_r1, r1_messages), (table_r2, r2_messages) = read_pair(
+            partial(load_vcf_cached, cache=cache, regions=regions),
+            r1_scored_vcf,
+            r2_scored_vcf,
+        )
+        # Logged once both are read, to keep the log in the same order
+        for message in r1_messages + r2_messages:
+            logger.info(message)
+        baseline_table = IndexedVariantTable(table_r1)
+    else:
+        table_r2 = parse_vcf_cached(r2_scored_vcf, cache, regions)
+    comparison = compare_variant_tables(baseline_table, table_r2, score_threshold)
+    if memo is not None:
+        store_scored_comparison(memo, comparison)
+    return report_scored_comparison(
+        comparison,
+        str(r1_scored_vcf.real_path),
+        str(r2_scored_vcf.real_path),
+        show_sub_scores,
+        score_threshold,
+        max_display,
+        out_path_presence,
+        out_path_score_above_thres,
+        out_path_score_all,
+        out_path_score_summary,
+        presence_table,
+        score_diff_table,
+        record_sources,
     )
-    compare_variant_presence(
+
+
+def sv_overlap_comparison(
+    r1_scored_vcf: PathObj,
+    r2_scored_vcf: PathObj,
+    settings: SvMatchSettings,
+    baseline_table: Optional[SvTable],
+    cache: Optional[ParsedVcfCache],
+    show_sub_scores: bool,
+    score_threshold: int,
+    max_display: int,
+    out_path_presence: Optional[Path],
+    out_path_score_above_thres: Optional[Path],
+    out_path_score_all: Optional[Path],
+    out_path_score_summary: Optional[Path],
+    out_path_matches: Optional[Path],
+    presence_table: Optional[ResultTableWriter],
+    score_diff_table: Optional[ResultTableWriter],
+    record_sources: Optional[RecordSources],
+    regions: Optional[List[Region]],
+) -> ScoredCounts:
+    """
+    Compare scored SV VCFs with calls matched on overlap. Matched calls are
+    compared on score as shared variants, and the unmatched ones reported as
+    only found in one run.
+    """
+    table_r1, table_r2 = read_sv_table_pair(
+        r1_scored_vcf, r2_scored_vcf, baseline_table, cache, regions
+    )
+    logger.info(f"Matching SVs on {settings}")
+    matches = match_svs(table_r1, table_r2, settings)
+    moved = get_moved_sv_matches(table_r1.variants, table_r2.variants, matches.rows)
+    write_sv_matches(
+        table_r1.variants,
+        table_r2.variants,
+        matches,
+        moved,
+        max_display,
+        out_path_matches,
+    )
+    if record_sources is not None:
+        # Score differences are reported at the position of r1, while the
+        # records of r2 are at their own position
+        for index in moved:
+            variant_r1 = table_r1.variants.get_variant(
+                int(matches.rows.shared_r1[index])
+            )
+            record_sources.moved_r2[variant_r1.get_key()] = (
+                table_r2.variants.get_variant(int(matches.rows.shared_r2[index]))
+            )
+    return report_scored_comparison(
+        build_scored_comparison(
+            table_r1.variants, table_r2.variants, matches.rows, score_threshold
+        ),
         str(r1_scored_vcf.real_path),
         str(r2_scored_vcf.real_path),
-        variants_r1,
-        variants_r2,
-        comparison_results,
+        show_sub_scores,
+        score_threshold,
         max_display,
         out_path_presence,
+        out_path_score_above_thres,
+        out_path_score_all,
+        out_path_score_summary,
+        presence_table,
+        score_diff_table,
+        record_sources,
+    )
+
+
+def read_sv_table_pair(
+    r1_scored_vcf: PathObj,
+    r2_scored_vcf: PathObj,
+    baseline_table: Optional[SvTable],
+    cache: Optional[ParsedVcfCache],
+    regions: Optional[List[Region]],
+) -> Tuple[SvTable, SvTable]:
+    if baseline_table is not None:
+        return baseline_table, parse_sv_table_cached(r2_scored_vcf, cache, regions)
+    (table_r1, r1_messages), (table_r2, r2_messages) = read_pair(
+        partial(load_sv_table_cached, cache=cache, regions=regions),
+        r1_scored_vcf,
+        r2_scored_vcf,
+    )
+    # Logged once both are read, to keep the log in the same order
+    for message in r1_messages + r2_messages:
+        logger.info(message)
+    return table_r1, table_r2
+
+
+def get_moved_sv_matches(
+    table_r1: VariantTable, table_r2: VariantTable, rows: RowComparison
+) -> List[int]:
+    """Indices of the matched SV calls whose chr/pos/ref/alt differ between the runs"""
+    return [
+        index
+        for index, (row_r1, row_r2) in enumerate(
+            zip(rows.shared_r1.tolist(), rows.shared_r2.tolist())
+        )
+        if table_r1.get_variant(row_r1).get_key()
+        != table_r2.get_variant(row_r2).get_key()
+    ]
+
+
+def write_sv_matches(
+    table_r1: VariantTable,
+    table_r2: VariantTable,
+    matches: SvMatches,
+    moved: List[int],
+    max_display: int,
+    out_path: Optional[Path],
+):
+    """Matched SV calls at a different position in the two runs"""
+    rows = matches.rows
+    out_fh = open(out_path, "w") if out_path else None
+    log_and_write(
+        f"SVs matched on overlap: {len(rows.shared_r1)}, of which at a different position: {len(moved)}",
+        out_fh,
+    )
+    header = "\t".join(
+        ["r1_var", "r2_var", "reciprocal_overlap", "start_distance", "end_distance"]
+    )
+    logger.info(f"First {min(len(moved), max_display)} matched at a different position")
+    logger.info(header)
+    if out_fh:
+        print(header, file=out_fh)
+    for count, index in enumerate(moved):
+        line = "\t".join(
+            [
+                str(table_r1.get_variant(int(rows.shared_r1[index]))),
+                str(table_r2.get_variant(int(rows.shared_r2[index]))),
+                f"{matches.reciprocal_overlaps[index]:.3f}",
+                str(matches.start_distances[index]),
+                str(matches.end_distances[index]),
+            ]
+        )
+        if count < max_display:
+            logger.info(line)
+        if out_fh:
+            print(line, file=out_fh)
+
+    if out_fh:
+        out_fh.close()
+
+
+def compare_variant_tables(
+    indexed_r1: IndexedVariantTable, table_r2: VariantTable, score_threshold: int
+) -> ScoredComparison:
+    return build_scored_comparison(
+        indexed_r1.table,
+        table_r2,
+        do_indexed_key_comparison(indexed_r1, table_r2),
+        score_threshold,
     )
-    shared_variants = comparison_results.shared
-    compare_variant_score(
-        shared_variants,
-        variants_r1,
-        variants_r2,
+
+
+def build_scored_comparison(
+    table_r1: VariantTable,
+    table_r2: VariantTable,
+    comparison_results: RowComparison,
+    score_threshold: int,
+) -> ScoredComparison:
+    shared_rows_r1 = comparison_results.shared_r1
+    shared_rows_r2 = comparison_results.shared_r2
+
+    diff_scored_variants = get_diff_scored_variants(
+        table_r1, table_r2, shared_rows_r1, shared_rows_r2
+    )
+
+    sub_score_names_r1: List[str] = []
+    sub_score_names_r2: List[str] = []
+    if len(shared_rows_r1) > 0:
+        sub_score_names_r1 = list(table_r1.get_variant(shared_rows_r1[0]).sub_scores)
+        sub_score_names_r2 = list(table_r2.get_variant(shared_rows_r2[0]).sub_scores)
+
+    return ScoredComparison(
+        TableVariants(table_r1, comparison_results.r1_only),
+        TableVariants(table_r2, comparison_results.r2_only),
+        len(shared_rows_r1),
+        diff_scored_variants,
+        sub_score_names_r1,
+        sub_score_names_r2,
+        summarize_table_deltas(
+            table_r1, table_r2, shared_rows_r1, shared_rows_r2, score_threshold
+        ),
+    )
+
+
+def report_scored_comparison(
+    comparison: ScoredComparison,
+    label_r1: str,
+    label_r2: str,
+    show_sub_scores: bool,
+    score_threshold: int,
+    max_display: int,
+    out_path_presence: Optional[Path],
+    out_path_score_above_thres: Optional[Path],
+    out_path_score_all: Optional[Path],
+    out_path_score_summary: Optional[Path],
+    presence_table: Optional[ResultTableWriter],
+    score_diff_table: Optional[ResultTableWriter],
+    record_sources: Optional[RecordSources],
+) -> ScoredCounts:
+    compare_variant_presence(
+        label_r1,
+        label_r2,
+        comparison.nbr_common,
+        comparison.r1_only,
+        comparison.r2_only,
+        max_display,
+        out_path_presence,
+        presence_table,
+    )
+    nbr_diff, nbr_diff_above_thres = compare_variant_score(
+        comparison.diff_scored_variants,
+        comparison.sub_score_names_r1,
+        comparison.sub_score_names_r2,
+        show_sub_scores,
+        score_threshold,
+        max_display,
+        out_path_score_above_thres,
+        out_path_score_all,
+        score_diff_table,
+        record_sources,
+    )
+    write_score_summary(
+        comparison.score_summary, label_r1, label_r2, out_path_score_summary
+    )
+    return (
+        len(comparison.r1_only),
+        len(comparison.r2_only),
+        nbr_diff,
+        nbr_diff_above_thres,
+    )
+
+
+def summarize_diff_scored_chunks(
+    diff_scored_variants: Iterable[DiffScoredVariant],
+    nbr_unchanged: int,
+    sub_score_names: List[str],
+    score_threshold: int,
+) -> ScoreDeltaSummary:
+    """Summary of differently scored variants read in chunks, as when streaming"""
+    variants = iter(diff_scored_variants)
+    score_summary = ScoreDeltaSummary(score_threshold, [])
+    chunk = list(islice(variants, SUMMARY_CHUNK_SIZE))
+    while True:
+        score_summary.add(
+            summarize_diff_scored_variants(chunk, 0, sub_score_names, score_threshold)
+        )
+        chunk = list(islice(variants, SUMMARY_CHUNK_SIZE))
+        if len(chunk) == 0:
+            break
+    score_summary.nbr_unchanged += nbr_unchanged
+    return score_summary
+
+
+def store_scored_comparison(memo: ScoreMemo, comparison: ScoredComparison):
+    memo.store(
+        comparison.r1_only,
+        comparison.r2_only,
+        comparison.nbr_common,
+        comparison.score_summary.nbr_unchanged,
+        comparison.diff_scored_variants,
+        comparison.sub_score_names_r1,
+        comparison.sub_score_names_r2,
+    )
+
+
+def sharded_variant_comparison(
+    r1_scored_vcf: PathObj,
+    r2_scored_vcf: PathObj,
+    show_sub_scores: bool,
+    score_threshold: int,
+    max_display: int,
+    out_path_presence: Optional[Path],
+    out_path_score_above_thres: Optional[Path],
+    out_path_score_all: Optional[Path],
+    out_path_score_summary: Optional[Path],
+    presence_table: Optional[ResultTableWriter],
+    score_diff_table: Optional[ResultTableWriter],
+    record_sources: Optional[RecordSources],
+    regions: Optional[List[Region]],
+    jobs: int,
+    memo: Optional[ScoreMemo],
+) -> ScoredCounts:
+    """
+    Same comparison as 'variant_comparison', but with each contig read
+    through the tabix index and compared in its own process. The shard
+    results are merged in contig order, and the score differences sorted
+    over all contigs.
+    """
+
+    contigs = load_index(r1_scored_vcf.real_path).names
+    for contig in load_index(r2_scored_vcf.real_path).names:
+        if contig not in contigs:
+            contigs.append(contig)
+
+    shard_regions: List[List[Region]] = []
+    for contig in contigs:
+        if regions is None:
+            shard_regions.append([Region(contig, 1, MAX_POSITION)])
+        else:
+            contig_regions = [region for region in regions if region.chrom == contig]
+            if len(contig_regions) > 0:
+                shard_regions.append(contig_regions)
+
+    logger.info(f"Comparing {len(shard_regions)} contigs using {jobs} process(es)")
+    with ProcessPoolExecutor(max_workers=max(1, jobs)) as executor:
+        shard_results = list(
+            executor.map(
+                compare_contig_shard,
+                [r1_scored_vcf] * len(shard_regions),
+                [r2_scored_vcf] * len(shard_regions),
+                shard_regions,
+                [score_threshold] * len(shard_regions),
+            )
+        )
+
+    r1_only: List[ScoredVariant] = []
+    r2_only: List[ScoredVariant] = []
+    nbr_common = 0
+    diff_scored_variants: List[DiffScoredVariant] = []
+    sub_score_names_r1: List[str] = []
+    sub_score_names_r2: List[str] = []
+    score_summary = ScoreDeltaSummary(score_threshold, [])
+    for shard_result in shard_results:
+        r1_only.extend(shard_result.r1_only)
+        r2_only.extend(shard_result.r2_only)
+        if nbr_common == 0 and shard_result.nbr_common > 0:
+            sub_score_names_r1 = shard_result.sub_score_names_r1
+            sub_score_names_r2 = shard_result.sub_score_names_r2
+        nbr_common += shard_result.nbr_common
+        diff_scored_variants.extend(shard_result.diff_scored_variants)
+        score_summary.add(shard_result.score_summary)
+    # The shards were parsed in other processes
+    add_records(2 * nbr_common + len(r1_only) + len(r2_only))
+
+    comparison = ScoredComparison(
+        r1_only,
+        r2_only,
+        nbr_common,
+        diff_scored_variants,
+        sub_score_names_r1,
+        sub_score_names_r2,
+        score_summary,
+    )
+    if memo is not None:
+        store_scored_comparison(memo, comparison)
+    return report_scored_comparison(
+        comparison,
+        str(r1_scored_vcf.real_path),
+        str(r2_scored_vcf.real_path),
         show_sub_scores,
         score_threshold,
         max_display,
+        out_path_presence,
         out_path_score_above_thres,
         out_path_score_all,
+        out_path_score_summary,
+        presence_table,
+        score_diff_table,
+        record_sources,
+    )
+
+
+def compare_contig_shard(
+    r1_scored_vcf: PathObj,
+    r2_scored_vcf: PathObj,
+    regions: List[Region],
+    score_threshold: int,
+) -> ScoredComparison:
+    table_r1, table_r2 = read_pair(
+        partial(parse_vcf, regions=regions), r1_scored_vcf, r2_scored_vcf
+    )
+    comparison = compare_variant_tables(
+        IndexedVariantTable(table_r1), table_r2, score_threshold
+    )
+    # Built here rather than sending the shard tables back
+    comparison.r1_only = list(comparison.r1_only)
+    comparison.r2_only = list(comparison.r2_only)
+    return comparison
+
+
+def parse_vcf_cached(
+    vcf: PathObj, cache: Optional[ParsedVcfCache], regions: Optional[List[Region]]
+) -> VariantTable:
+    table, messages = load_vcf_cached(vcf, cache, regions)
+    for message in messages:
+        logger.info(message)
+    return table
+
+
+def parse_sv_table_cached(
+    vcf: PathObj, cache: Optional[ParsedVcfCache], regions: Optional[List[Region]]
+) -> SvTable:
+    table, messages = load_sv_table_cached(vcf, cache, regions)
+    for message in messages:
+        logger.info(message)
+    return table
+
+
+def load_vcf_cached(
+    vcf: PathObj, cache: Optional[ParsedVcfCache], regions: Optional[List[Region]]
+) -> Tuple[VariantTable, List[str]]:
+    """Parsed VCF, and the cache messages to log, as it may run on a thread"""
+    # Region queries only read a small part of the VCF and are not cached
+    if cache is None or regions is not None:
+        return parse_vcf(vcf, regions), []
+    return load_cached(vcf, cache, parse_vcf, cache.load, cache.store)
+
+
+def load_sv_table_cached(
+    vcf: PathObj, cache: Optional[ParsedVcfCache], regions: Optional[List[Region]]
+) -> Tuple[SvTable, List[str]]:
+    if cache is None or regions is not None:
+        return parse_sv_table(vcf, regions), []
+    return load_cached(
+        vcf, cache, parse_sv_table, cache.load_sv_table, cache.store_sv_table
+    )
+
+
+def load_cached(
+    vcf: PathObj,
+    cache: ParsedVcfCache,
+    parse: Callable[[PathObj], T],
+    load: Callable[[str], Optional[T]],
+    store: Callable[[PathObj, str, T], List[Path]],
+) -> Tuple[T, List[str]]:
+    start_time = time.perf_counter()
+    # Computed once for the lookup and the store, as it can hash the content
+    fingerprint = cache.get_fingerprint(vcf)
+    table = load(fingerprint)
+    if table is not None:
+        add_records(len(table))
+        return table, [
+            f"Cache hit for {vcf.real_path}, loaded in {time.perf_counter() - start_time:.2f}s"
+        ]
+
+    table = parse(vcf)
+    messages = [
+        f"Cache miss for {vcf.real_path}, parsed in {time.perf_counter() - start_time:.2f}s"
+    ]
+    evicted = store(vcf, fingerprint, table)
+    for entry_dir in evicted:
+        messages.append(f"Evicted {entry_dir} from cache")
+    return table, messages
+
+
+def get_diff_scored_variants(
+    table_r1: VariantTable,
+    table_r2: VariantTable,
+    shared_rows_r1: np.ndarray,
+    shared_rows_r2: np.ndarray,
+) -> List[DiffScoredVariant]:
+    """
+    Compare rank scores of the shared variants column-wise, and only create
+    ScoredVariant objects for the rows that differ
+    """
+    has_score_r1 = table_r1.has_rank_score[shared_rows_r1]
+    has_score_r2 = table_r2.has_rank_score[shared_rows_r2]
+    scores_differ = (has_score_r1 != has_score_r2) | (
+        has_score_r1
+        & (table_r1.rank_scores[shared_rows_r1] != table_r2.rank_scores[shared_rows_r2])
+    )
+    diff_scored_variants = []
+    for row_r1, row_r2 in zip(
+        shared_rows_r1[scores_differ].tolist(), shared_rows_r2[scores_differ].tolist()
+    ):
+        variant_r1 = table_r1.get_variant(row_r1)
+        variant_r2 = table_r2.get_variant(row_r2)
+        # Calls matched on overlap can differ in position, and are reported
+        # at the position of r1
+        diff_scored_variants.append(
+            DiffScoredVariant(
+                variant_r1,
+                ScoredVariant(
+                    variant_r1.chr,
+                    variant_r1.pos,
+                    variant_r1.ref,
+                    variant_r1.alt,
+                    variant_r2.rank_score,
+                    variant_r2.sub_scores,
+                ),
+            )
+        )
+    return diff_scored_variants
+
+
+def streaming_variant_comparison(
+    r1_scored_vcf: PathObj,
+    r2_scored_vcf: PathObj,
+    show_sub_scores: bool,
+    score_threshold: int,
+    max_display: int,
+    out_path_presence: Optional[Path],
+    out_path_score_above_thres: Optional[Path],
+    out_path_score_all: Optional[Path],
+    out_path_score_summary: Optional[Path],
+    presence_table: Optional[ResultTableWriter],
+    score_diff_table: Optional[ResultTableWriter],
+    record_sources: Optional[RecordSources],
+    regions: Optional[List[Region]],
+    memo: Optional[ScoreMemo],
+) -> ScoredCounts:
+    """
+    Same comparison as 'variant_comparison', but walks both coordinate-sorted
+    VCFs in parallel instead of loading them into memory. Variants only found
+    in one run are spooled to disk until the report is written.
+    """
+
+    nbr_common = 0
+    nbr_unchanged_scored = 0
+    # Differently scored variants go to the collector as they are found, and
+    # are summarized in chunks
+    pending_diffs: List[DiffScoredVariant] = []
+    score_summary = ScoreDeltaSummary(score_threshold, [])
+    sub_score_names_r1: List[str] = []
+    sub_score_names_r2: List[str] = []
+
+    def summarize_pending():
+        score_summary.add(
+            summarize_diff_scored_variants(
+                pending_diffs,
+                0,
+                sub_score_names_r1 if sub_score_names_r1 == sub_score_names_r2 else [],
+                score_threshold,
+            )
+        )
+        pending_diffs.clear()
+
+    with SpooledVariants() as r1_only, SpooledVariants() as r2_only, ScoreDiffCollector(
+        score_threshold, max_display, show_sub_scores
+    ) as collector:
+        for r1_variant, r2_variant in iter_variant_pairs(
+            r1_scored_vcf, r2_scored_vcf, regions
+        ):
+            if r2_variant is None:
+                r1_only.append(r1_variant)
+            elif r1_variant is None:
+                r2_only.append(r2_variant)
+            else:
+                if nbr_common == 0:
+                    sub_score_names_r1 = list(r1_variant.sub_scores)
+                    sub_score_names_r2 = list(r2_variant.sub_scores)
+                nbr_common += 1
+                if r1_variant.rank_score != r2_variant.rank_score:
+                    diff_scored_variant = DiffScoredVariant(r1_variant, r2_variant)
+                    collector.add(diff_scored_variant)
+                    pending_diffs.append(diff_scored_variant)
+                    if len(pending_diffs) >= SUMMARY_CHUNK_SIZE:
+                        summarize_pending()
+                elif r1_variant.rank_score is not None:
+                    nbr_unchanged_scored += 1
+        summarize_pending()
+        score_summary.nbr_unchanged += nbr_unchanged_scored
+
+        if memo is not None:
+            memo.store(
+                r1_only,
+                r2_only,
+                nbr_common,
+                score_summary.nbr_unchanged,
+                (variant for _above_thres, variant in collector.iter_sorted_variants()),
+                sub_score_names_r1,
+                sub_score_names_r2,
+            )
+
+        compare_variant_presence(
+            str(r1_scored_vcf.real_path),
+            str(r2_scored_vcf.real_path),
+            nbr_common,
+            r1_only,
+            r2_only,
+            max_display,
+            out_path_presence,
+            presence_table,
+        )
+        counts = (
+            len(r1_only),
+            len(r2_only),
+            collector.nbr_total,
+            collector.nbr_above_thres,
+        )
+
+        write_score_diffs(
+            collector,
+            sub_score_names_r1,
+            sub_score_names_r2,
+            out_path_score_above_thres,
+            out_path_score_all,
+            score_diff_table,
+            record_sources,
+        )
+
+    write_score_summary(
+        score_summary,
+        str(r1_scored_vcf.real_path),
+        str(r2_scored_vcf.real_path),
+        out_path_score_summary,
     )
+    return counts
+
+
+def write_score_summary(
+    summary: ScoreDeltaSummary,
+    label_r1: str,
+    label_r2: str,
+    out_path: Optional[Path],
+):
+    out_fh = open(out_path, "w") if out_path else None
+    log_and_write("--- Score delta summary ---", out_fh)
+    for line in summary.get_headline_lines(label_r1, label_r2):
+        log_and_write(line, out_fh)
+    if out_fh:
+        print("", file=out_fh)
+        for line in summary.get_table_lines():
+            print(line, file=out_fh)
+        out_fh.close()
 
 
 def compare_vcfs(
@@ -340,25 +1873,33 @@ def compare_vcfs(
     r1_base: str,
     r2_base: str,
     out_path: Optional[Path],
-):
+    jobs: int,
+    table: Optional[ResultTableWriter],
+    r1_vcf_counts: Optional[List[Optional[int]]],
+    memo_dir: Optional[Path],
+) -> int:
+    """
+    Compare the number of variants in each VCF, returning the number of VCFs
+    with differing counts. Counts for the r1 VCFs can be given, if already known.
+    """
+
+    if r1_vcf_counts is None:
+        counts = count_variants_memoized(r1_vcfs + r2_vcfs, jobs, memo_dir)
+    else:
+        counts = r1_vcf_counts + count_variants_memoized(r2_vcfs, jobs, memo_dir)
+    for vcf, n_variants in zip(r1_vcfs + r2_vcfs, counts):
+        if n_variants is None:
+            logger.warning(f"Could not read {vcf.real_path}, counting it as 0")
 
     r1_counts: Dict[str, int] = {}
-    for vcf in r1_vcfs:
-        if vcf.check_valid_file():
-            n_variants = count_variants(vcf)
-        else:
-            n_variants = 0
-        r1_counts[str(vcf).replace(r1_base, "")] = n_variants
+    for vcf, n_variants in zip(r1_vcfs, counts[: len(r1_vcfs)]):
+        r1_counts[str(vcf).replace(r1_base, "")] = n_variants or 0
 
     r2_counts: Dict[str, int] = {}
-    for vcf in r2_vcfs:
-        if vcf.check_valid_file():
-            n_variants = count_variants(vcf)
-        else:
-            n_variants = 0
-        r2_counts[str(vcf).replace(r2_base, "")] = n_variants
+    for vcf, n_variants in zip(r2_vcfs, counts[len(r1_vcfs) :]):
+        r2_counts[str(vcf).replace(r2_base, "")] = n_variants or 0
 
-    paths = r1_counts.keys() | r2_counts.keys()
+    paths = sorted(r1_counts.keys() | r2_counts.keys())
 
     max_path_length = max(len(path) for path in paths)
 
@@ -371,93 +1912,289 @@ def compare_vcfs(
             f"{path:<{max_path_length}} {r1_val:>{len(run_id1)}} {r2_val:>{len(run_id2)}}",
             out_fh,
         )
+        if table:
+            table.append(
+                {
+                    "path": path,
+                    "r1_count": r1_counts.get(path),
+                    "r2_count": r2_counts.get(path),
+                }
+            )
 
     if out_fh:
         out_fh.close()
 
+    return sum(1 for path in paths if r1_counts.get(path) != r2_counts.get(path))
+
 
 def compare_variant_score(
-    shared_variants: Set[str],
-    variants_r1: Dict[str, ScoredVariant],
-    variants_r2: Dict[str, ScoredVariant],
+    diff_scored_variants: Iterable[DiffScoredVariant],
+    sub_score_names_r1: List[str],
+    sub_score_names_r2: List[str],
     show_sub_scores: bool,
     score_threshold: int,
     max_count: int,
     out_path_above_thres: Optional[Path],
     out_path_all: Optional[Path],
-):
-
-    diff_scored_variants: List[DiffScoredVariant] = []
-
-    for var_key in shared_variants:
-        r1_variant = variants_r1[var_key]
-        r2_variant = variants_r2[var_key]
-        if r1_variant.rank_score != r2_variant.rank_score:
-            diff_scored_variant = DiffScoredVariant(r1_variant, r2_variant)
-            diff_scored_variants.append(diff_scored_variant)
-
-    diff_scored_variants.sort(
-        key=lambda var: var.r1.get_rank_score(),
-        reverse=True,
-    )
+    table: Optional[ResultTableWriter],
+    record_sources: Optional[RecordSources],
+) -> Tuple[int, int]:
+    """Write the score differences, returning their number in total and above the threshold"""
+    with ScoreDiffCollector(score_threshold, max_count, show_sub_scores) as collector:
+        for variant in diff_scored_variants:
+            collector.add(variant)
+        write_score_diffs(
+            collector,
+            sub_score_names_r1,
+            sub_score_names_r2,
+            out_path_above_thres,
+            out_path_all,
+            table,
+            record_sources,
+        )
+        return collector.nbr_total, collector.nbr_above_thres
 
-    above_thres_variants = [
-        var for var in diff_scored_variants if var.any_above_thres(score_threshold)
-    ]
 
+def write_score_diffs(
+    collector: ScoreDiffCollector,
+    sub_score_names_r1: List[str],
+    sub_score_names_r2: List[str],
+    out_path_above_thres: Optional[Path],
+    out_path_all: Optional[Path],
+    table: Optional[ResultTableWriter],
+    record_sources: Optional[RecordSources],
+):
     out_above_thres = open(out_path_above_thres, "w") if out_path_above_thres else None
     out_all = open(out_path_all, "w") if out_path_all else None
 
     logger.info(
-        f"Number differently scored total: {len(diff_scored_variants)}",
+        f"Number differently scored total: {collector.nbr_total}",
     )
     logger.info(
-        f"Number differently scored above {score_threshold}: {len(above_thres_variants)}",
+        f"Number differently scored above {collector.score_threshold}: {collector.nbr_above_thres}",
     )
-    if len(above_thres_variants) > max_count:
-        log_and_write(f"Only printing the {max_count} first", out_above_thres)
+    if collector.nbr_above_thres > collector.max_count:
+        log_and_write(f"Only printing the {collector.max_count} first", out_above_thres)
 
     # Print header, optionally with sub scores
-    first_shared_key = list(shared_variants)[0]
     header_fields = ["chr", "pos", "var", "r1", "r2"]
     header_fields_w_subscores = header_fields.copy()
-    for sub_score in variants_r1[first_shared_key].sub_scores:
+    for sub_score in sub_score_names_r1:
         header_fields_w_subscores.append(f"r1_{sub_score}")
-    for sub_score in variants_r2[first_shared_key].sub_scores:
+    for sub_score in sub_score_names_r2:
         header_fields_w_subscores.append(f"r2_{sub_score}")
-    if show_sub_scores:
+    if collector.show_sub_scores:
         logger.info("\t".join(header_fields_w_subscores))
     else:
         logger.info("\t".join(header_fields))
 
     # Only print a subset to STDOUT
-    for variant in above_thres_variants[0:max_count]:
-        comparison_str = variant.r1.get_comparison_str(variant.r2, show_sub_scores)
+    for comparison_str in collector.get_top_lines():
         logger.info(comparison_str)
 
-    # Always print sub scores in output files
-    sub_scores_in_file = True
     # Print all to the out dir
     print("\t".join(header_fields_w_subscores), file=out_above_thres)
-    for variant in above_thres_variants:
-        comparison_str = variant.r1.get_comparison_str(variant.r2, sub_scores_in_file)
-        print(comparison_str, file=out_above_thres)
+    for above_thres, variant in collector.iter_sorted_variants():
+        if above_thres:
+            comparison_str = variant.r1.get_comparison_str(variant.r2, True)
+            print(comparison_str, file=out_above_thres)
 
     print("\t".join(header_fields_w_subscores), file=out_all)
-    for variant in diff_scored_variants:
-        comparison_str = variant.r1.get_comparison_str(variant.r2, sub_scores_in_file)
-        print(comparison_str, file=out_all)
+    for above_thres, variant in collector.iter_sorted_variants():
+        print(variant.r1.get_comparison_str(variant.r2, True), file=out_all)
+        if table:
+            table.append(
+                {
+                    "chr": variant.r1.chr,
+                    "pos": variant.r1.pos,
+                    "ref": variant.r1.ref,
+                    "alt": variant.r1.alt,
+                    "r1_rank_score": variant.r1.rank_score,
+                    "r2_rank_score": variant.r2.rank_score,
+                    "above_threshold": above_thres,
+                    "r1_sub_scores": variant.r1.sub_scores,
+                    "r2_sub_scores": variant.r2.sub_scores,
+                }
+            )
 
     if out_above_thres:
         out_above_thres.close()
     if out_all:
         out_all.close()
 
+    if record_sources is not None:
+        write_score_records(collector, record_sources)
+
+
+def write_score_records(collector: ScoreDiffCollector, record_sources: RecordSources):
+    """
+    Full VCF records in both runs of the top differently scored variants
+    above the threshold, read through an index of each VCF
+    """
+    top_variants = list(
+        islice(
+            (
+                variant
+                for above_thres, variant in collector.iter_sorted_variants()
+                if above_thres
+            ),
+            record_sources.max_records,
+        )
+    )
+    if len(top_variants) == 0:
+        return
+
+    index_r1, index_r2 = read_pair(
+        partial(get_record_index, index_dir=record_sources.index_dir),
+        record_sources.r1_vcf,
+        record_sources.r2_vcf,
+    )
+    for index, vcf in [
+        (index_r1, record_sources.r1_vcf),
+        (index_r2, record_sources.r2_vcf),
+    ]:
+        if index is None:
+            logger.warning(
+                f"Records of {vcf.real_path} cannot be read at an offset, as it is gzip but not BGZF compressed"
+            )
+
+    logger.info(
+        f"Writing the records of the {len(top_variants)} top differently scored variants"
+    )
+    out_fh = open(record_sources.out_path, "w") if record_sources.out_path else None
+    # Each VCF is opened once for all the records read from it
+    with contextlib.ExitStack() as stack:
+        reader_r1, reader_r2 = [
+            stack.enter_context(index.open()) if index is not None else None
+            for index in (index_r1, index_r2)
+        ]
+        for variant in top_variants:
+            print(variant.r1.get_comparison_str(variant.r2, False), file=out_fh)
+            variant_r2 = record_sources.moved_r2.get(variant.r1.get_key(), variant.r1)
+            for run, reader, lookup in [
+                ("r1", reader_r1, variant.r1),
+                ("r2", reader_r2, variant_r2),
+            ]:
+                record = reader.fetch_record(lookup) if reader is not None else None
+                print(
+                    f"{run}\t{record if record is not None else 'Not found'}",
+                    file=out_fh,
+                )
+    if out_fh:
+        out_fh.close()
+
+
+def write_genotype_comparison(
+    comparison: GenotypeComparison,
+    table_r1: GenotypeTable,
+    table_r2: GenotypeTable,
+    max_display: int,
+    out_path: Optional[Path],
+    concordance_table: Optional[ResultTableWriter],
+    discordance_table: Optional[ResultTableWriter],
+):
+    """
+    Concordance matrix of each sample, followed by its discordant sites
+    ordered on descending r1 rank score
+    """
+    out_fh = open(out_path, "w") if out_path else None
+
+    log_and_write(f"Variants in common: {comparison.nbr_shared}", out_fh)
+    if len(comparison.samples_r1_only) > 0:
+        log_and_write(
+            f"Samples only in r1: {' '.join(comparison.samples_r1_only)}", out_fh
+        )
+    if len(comparison.samples_r2_only) > 0:
+        log_and_write(
+            f"Samples only in r2: {' '.join(comparison.samples_r2_only)}", out_fh
+        )
+
+    variants_r1 = table_r1.variants
+    for sample in comparison.samples:
+        name = sample.get_name()
+        nbr_compared = sample.nbr_concordant + sample.nbr_discordant
+        concordance = (
+            f"{100 * sample.nbr_concordant / nbr_compared:.2f}% concordant"
+            if nbr_compared > 0
+            else "n/a"
+        )
+        log_and_write(
+            f"Sample {name}: concordant {sample.nbr_concordant}, discordant {sample.nbr_discordant} ({concordance})",
+            out_fh,
+        )
+        log_and_write("\t".join(["r1\\r2"] + GENOTYPE_LABELS), out_fh)
+        for r1_label, counts in zip(GENOTYPE_LABELS, sample.matrix.tolist()):
+            log_and_write(
+                "\t".join([r1_label] + [str(count) for count in counts]), out_fh
+            )
+            if concordance_table:
+                for r2_label, count in zip(GENOTYPE_LABELS, counts):
+                    concordance_table.append(
+                        {
+                            "sample": name,
+                            "r1_genotype": r1_label,
+                            "r2_genotype": r2_label,
+                            "count": count,
+                        }
+                    )
+
+        # Unscored variants are listed last
+        rank_scores = np.where(
+            variants_r1.has_rank_score[sample.discordant_rows_r1],
+            variants_r1.rank_scores[sample.discordant_rows_r1],
+            np.iinfo(np.int32).min,
+        )
+        order = np.argsort(-rank_scores.astype(np.int64), kind="stable")
+        rows_r1 = sample.discordant_rows_r1[order].tolist()
+        rows_r2 = sample.discordant_rows_r2[order].tolist()
+        codes_r1 = table_r1.genotypes[rows_r1, sample.col_r1].tolist()
+        codes_r2 = table_r2.genotypes[rows_r2, sample.col_r2].tolist()
+
+        header = "\t".join(["chr", "pos", "var", "r1_score", "r1_gt", "r2_gt"])
+        logger.info(f"First {min(len(rows_r1), max_display)} discordant in {name}")
+        logger.info(header)
+        if out_fh:
+            print(f"Discordant in {name}", file=out_fh)
+            print(header, file=out_fh)
+        for index, (row_r1, code_r1, code_r2) in enumerate(
+            zip(rows_r1, codes_r1, codes_r2)
+        ):
+            variant = variants_r1.get_variant(row_r1)
+            line = "\t".join(
+                [
+                    variant.chr,
+                    str(variant.pos),
+                    f"{variant.ref}/{variant.alt}",
+                    variant.get_rank_score_str(),
+                    GENOTYPE_LABELS[code_r1],
+                    GENOTYPE_LABELS[code_r2],
+                ]
+            )
+            if index < max_display:
+                logger.info(line)
+            if out_fh:
+                print(line, file=out_fh)
+            if discordance_table:
+                discordance_table.append(
+                    {
+                        "sample": name,
+                        "chr": variant.chr,
+                        "pos": variant.pos,
+                        "ref": variant.ref,
+                        "alt": variant.alt,
+                        "r1_rank_score": variant.rank_score,
+                        "r1_genotype": GENOTYPE_LABELS[code_r1],
+                        "r2_genotype": GENOTYPE_LABELS[code_r2],
+                    }
+                )
+
+    if out_fh:
+        out_fh.close()
+
 
-def compare_yaml(yaml_r1: PathObj, yaml_r2: PathObj, out_path: Optional[Path]):
-    with yaml_r1.get_filehandle() as r1_fh, yaml_r2.get_filehandle() as r2_fh:
-        r1_lines = r1_fh.readlines()
-        r2_lines = r2_fh.readlines()
+def compare_yaml(yaml_r1: PathObj, yaml_r2: PathObj, out_path: Optional[Path]) -> int:
+    """Line diff of the YAMLs, returning the number of changed lines"""
+    r1_lines, r2_lines = read_pair(read_lines, yaml_r1, yaml_r2)
 
     out_fh = open(out_path, "w") if out_path else None
     diff = list(difflib.unified_diff(r1_lines, r2_lines))
@@ -468,22 +2205,67 @@ def compare_yaml(yaml_r1: PathObj, yaml_r2: PathObj, out_path: Optional[Path]):
         log_and_write("No difference found", out_fh)
     if out_fh:
         out_fh.close()
+    return sum(
+        1
+        for line in diff
+        if line.startswith(("+", "-")) and not line.startswith(("+++", "---"))
+    )
+
 
+def read_lines(path: PathObj) -> List[str]:
+    with path.get_filehandle() as in_fh:
+        return in_fh.readlines()
 
-def parse_arguments():
+
+def compare_yaml_structural(
+    yaml_r1: PathObj, yaml_r2: PathObj, out_path: Optional[Path]
+) -> int:
+    changes = compare_yaml_structure(yaml_r1, yaml_r2)
+
+    out_fh = open(out_path, "w") if out_path else None
+    if len(changes) > 0:
+        kinds = [change.get_kind() for change in changes]
+        log_and_write(
+            f"Changed: {kinds.count('changed')}, added: {kinds.count('added')}, removed: {kinds.count('removed')} (run IDs replaced by {yaml_r1.id_placeholder})",
+            out_fh,
+        )
+        log_and_write(f"--- {yaml_r1.real_path}", out_fh)
+        log_and_write(f"+++ {yaml_r2.real_path}", out_fh)
+        for change in changes:
+            for line in change.get_diff_lines():
+                log_and_write(line, out_fh)
+    else:
+        log_and_write("No difference found", out_fh)
+    if out_fh:
+        out_fh.close()
+    return len(changes)
+
+
+def parse_arguments(argv: Optional[List[str]] = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(description=description)
     parser.add_argument(
         "--run_id1",
         "-i1",
         help="The group ID is used in some file names and can differ between runs. If not provided, it is set to the base folder name.",
     )
-    parser.add_argument("--run_id2", "-i2", help="See --run_id1 help")
+    parser.add_argument(
+        "--run_id2",
+        "-i2",
+        nargs="+",
+        help="See --run_id1 help. One per --results2 folder.",
+    )
     parser.add_argument("--results1", "-r1", required=True)
-    parser.add_argument("--results2", "-r2", required=True)
+    parser.add_argument(
+        "--results2",
+        "-r2",
+        nargs="+",
+        required=True,
+        help="One or more folders compared to --results1. With several, each gets its own folder in --outdir, next to a combined matrix.",
+    )
     parser.add_argument("--config", help="Additional configurations", required=True)
     parser.add_argument(
         "--comparisons",
-        help="Comma separated. Defaults to: all i.e. file,vcf,score,score_sv,yaml",
+        help="Comma separated. Defaults to: all i.e. file,vcf,score,score_sv,yaml. The slower 'content' comparison, hashing all files present in both runs, and 'gt' comparison, of the genotypes of each sample in the scored VCFs, need to be requested explicitly.",
         default="all",
     )
     parser.add_argument("--show_sub_scores", action="store_true")
@@ -500,21 +2282,197 @@ def parse_arguments():
         help="Max number of top variants to print to STDOUT",
     )
     parser.add_argument("--outdir", help="Optional output folder to store result files")
-    args = parser.parse_args()
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Compare the scored VCFs by walking both in parallel, keeping memory use flat. Requires coordinate-sorted VCFs.",
+    )
+    parser.add_argument(
+        "--shard_contigs",
+        action="store_true",
+        help="Compare the scored VCFs one contig at a time in --jobs parallel processes. Requires tabix indexed VCFs.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of comparisons to run in parallel processes. Outputs are the same regardless of this setting.",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        help="Cache parsed scored VCFs in this folder, to speed up repeated comparisons against the same results. Not used for the scored VCFs read piece by piece by --streaming, --shard_contigs or --regions, except for SVs matched on overlap.",
+    )
+    parser.add_argument(
+        "--cache_size_gb",
+        type=float,
+        default=20,
+        help="Max size of the cache, least recently used entries are removed beyond this",
+    )
+    parser.add_argument(
+        "--cache_hash",
+        action="store_true",
+        help="Also fingerprint cached VCFs by content hash, not only by path, size and modification time",
+    )
+    parser.add_argument(
+        "--regions",
+        help="Limit the score and score_sv comparisons to these regions. Either a BED file or comma separated chr:start-end. Requires tabix indexed VCFs.",
+    )
+    parser.add_argument(
+        "--gzip_payload",
+        action="store_true",
+        help="In the content comparison, compare gzipped files on their decompressed content, ignoring timestamps in the gzip headers",
+    )
+    parser.add_argument(
+        "--follow_symlinks",
+        action="store_true",
+        help="Also look for files in symlinked folders, such as the Nextflow 'work' folder",
+    )
+    parser.add_argument(
+        "--structural_yaml",
+        action="store_true",
+        help="Compare the Scout YAMLs key by key with run IDs normalised, instead of as a line diff. Requires PyYAML.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Also profile each stage with cProfile, writing the statistics to a 'profiles' folder in --outdir. Resource use per stage is always written to metrics.json in --outdir.",
+    )
+    parser.add_argument(
+        "--no_memo",
+        action="store_true",
+        help="Do not store or reuse stage results in a 'stage_memo' folder in --outdir. By default, reruns on unchanged VCFs reuse the parsed comparisons, so that changing for instance --score_threshold only redoes the reports.",
+    )
+    parser.add_argument(
+        "--sv_matching",
+        choices=["overlap", "exact"],
+        default="exact",
+        help="Match SVs across the runs on exact chr/pos/ref/alt as the SNVs, or on overlap of calls of the same type, allowing breakpoints to move between runs. Matched SVs at different positions are listed in scored_sv_matches.txt. SVs matched on overlap are read whole, also with --streaming or --shard_contigs.",
+    )
+    parser.add_argument(
+        "--sv_min_overlap",
+        type=float,
+        default=0.5,
+        help="Min reciprocal overlap of two SV calls to match them",
+    )
+    parser.add_argument(
+        "--sv_max_distance",
+        type=int,
+        default=100,
+        help="Also match two SV calls if both their breakends are within this distance, such as for insertions",
+    )
+    parser.add_argument(
+        "--attach_records",
+        type=int,
+        default=0,
+        help="Write the full VCF records in both runs of this many top differently scored variants above --score_threshold to scored_snv_score_records.txt and scored_sv_score_records.txt in --outdir. The records are read through an index of each scored VCF, built on first use and kept with the stage memo, or in --cache_dir if given.",
+    )
+    parser.add_argument(
+        "--output_format",
+        choices=OUTPUT_FORMATS,
+        default="text",
+        help="Also write the file, VCF count, variant presence and score results as tables in this format to --outdir. Parquet and Arrow IPC require pyarrow.",
+    )
+    args = parser.parse_args(argv)
     return args
 
 
-if __name__ == "__main__":
-    args = parse_arguments()
+def run_with_arguments(
+    args: argparse.Namespace,
+    baselines: Optional[Dict[BaselineKey, Baseline]] = None,
+):
+    comparisons = (
+        None if args.comparisons == "all" else set(args.comparisons.split(","))
+    )
+    outdir = Path(args.outdir) if args.outdir is not None else None
+    cache_dir = Path(args.cache_dir) if args.cache_dir is not None else None
+    memo = not args.no_memo
+
+    if comparisons is not None:
+        valid_comparisons = set(
+            ["default", "file", "content", "vcf", "score", "score_sv", "gt", "yaml"]
+        )
+        if len(comparisons & valid_comparisons) == 0:
+            raise ValueError(
+                f"Valid comparisons are: {valid_comparisons}, found: {comparisons}"
+            )
+
+    if args.streaming and args.shard_contigs:
+        raise ValueError("Only one of --streaming and --shard_contigs can be used")
+
+    if args.output_format != "text" and outdir is None:
+        raise ValueError(f"--output_format {args.output_format} requires --outdir")
+
+    if args.structural_yaml and yaml is None:
+        raise ValueError("--structural_yaml requires PyYAML to be installed")
+
+    if args.profile and outdir is None:
+        raise ValueError("--profile requires --outdir")
+
+    if args.attach_records > 0 and outdir is None:
+        raise ValueError("--attach_records requires --outdir")
+
+    config = ConfigParser()
+    config.read(args.config)
+
+    # Record indices are kept in the cache folder or the top-level memo, so
+    # that the baseline is indexed once for all candidates
+    if cache_dir is not None:
+        record_index_dir: Optional[Path] = cache_dir / RECORD_INDEX_DIR
+    elif memo and outdir is not None:
+        record_index_dir = outdir / MEMO_DIR / RECORD_INDEX_DIR
+    else:
+        record_index_dir = None
+
+    settings = ComparisonSettings(
+        config=config,
+        comparisons=comparisons,
+        ignore_dirs=config.get("settings", "ignore").split(","),
+        follow_symlinks=args.follow_symlinks,
+        show_sub_scores=args.show_sub_scores,
+        score_threshold=args.score_threshold,
+        max_display=args.max_display,
+        streaming=args.streaming,
+        shard_contigs=args.shard_contigs,
+        jobs=args.jobs,
+        cache=(
+            ParsedVcfCache(
+                cache_dir, int(args.cache_size_gb * 1024**3), args.cache_hash
+            )
+            if cache_dir is not None
+            else None
+        ),
+        cache_dir=cache_dir,
+        regions=parse_regions(args.regions) if args.regions is not None else None,
+        gzip_payload=args.gzip_payload,
+        output_format=args.output_format,
+        structural_yaml=args.structural_yaml,
+        memo=memo,
+        score_comparisons=[
+            score_comparison
+            for score_comparison in SCORE_COMPARISONS
+            if comparisons is None or score_comparison[1] in comparisons
+        ],
+        sv_match_settings=(
+            SvMatchSettings(args.sv_min_overlap, args.sv_max_distance)
+            if args.sv_matching == "overlap"
+            else None
+        ),
+        attach_records=args.attach_records,
+        record_index_dir=record_index_dir,
+    )
+
     main(
+        settings,
         args.run_id1,
         args.run_id2,
         Path(args.results1),
-        Path(args.results2),
-        args.config,
-        None if args.comparisons == "all" else set(args.comparisons.split(",")),
-        args.show_sub_scores,
-        args.score_threshold,
-        args.max_display,
-        Path(args.outdir) if args.outdir is not None else None,
+        [Path(results2) for results2 in args.results2],
+        outdir,
+        args.profile,
+        baselines,
     )
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    run_with_arguments(args)
@@ -0,0 +1,115 @@
+"""
+Streaming comparison of two coordinate-sorted scored VCFs.
+
+Both files are walked at the same time, one position at a time, so memory use
+stays flat regardless of the size of the VCFs. The records are matched on
+the same chr/pos/ref/alt key as 'parse_vcf' uses.
+"""
+
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from classes import PathObj, ScoredVariant
+from tabix import Region
+from util import iter_read_ahead, iter_scored_variants, read_contig_order, read_pair
+
+# Sort key of a position: (contig rank, position)
+PositionKey = Tuple[int, int]
+VariantPair = Tuple[Optional[ScoredVariant], Optional[ScoredVariant]]
+
+
+class ContigOrder:
+    """
+    Ranks contigs by the ##contig header lines of the compared VCFs.
+
+    Contigs missing from the headers are ranked in the order they are first
+    encountered, which works as long as both files are sorted the same way.
+    """
+
+    def __init__(self, header_contigs: List[str]):
+        self._ranks: Dict[str, int] = {}
+        for contig in header_contigs:
+            self.get_rank(contig)
+
+    def get_rank(self, contig: str) -> int:
+        rank = self._ranks.get(contig)
+        if rank is None:
+            rank = len(self._ranks)
+            self._ranks[contig] = rank
+        return rank
+
+
+def iter_position_groups(
+    variants: Iterator[ScoredVariant], contig_order: ContigOrder, label: str
+) -> Iterator[Tuple[PositionKey, Dict[str, ScoredVariant]]]:
+    """
+    Group consecutive records at the same position. Within a group, a later
+    duplicate of a key replaces the earlier one, same as in 'parse_vcf'.
+    """
+
+    current_key: Optional[PositionKey] = None
+    group: Dict[str, ScoredVariant] = {}
+    for variant in variants:
+        key = (contig_order.get_rank(variant.chr), variant.pos)
+        if key != current_key:
+            if current_key is not None:
+                if key < current_key:
+                    raise ValueError(
+                        f"{label} is not coordinate sorted, found {variant.chr}:{variant.pos} after position {current_key[1]}. Run without --streaming to compare unsorted VCFs."
+                    )
+                yield current_key, group
+            current_key = key
+            group = {}
+        group[variant.get_key()] = variant
+    if current_key is not None:
+        yield current_key, group
+
+
+def merge_join(
+    r1_groups: Iterator[Tuple[PositionKey, Dict[str, ScoredVariant]]],
+    r2_groups: Iterator[Tuple[PositionKey, Dict[str, ScoredVariant]]],
+) -> Iterator[VariantPair]:
+    """
+    Walk two sorted streams of position groups and yield (r1, r2) pairs.
+    Variants only present in one of the streams have None on the other side.
+    """
+
+    r1_next = next(r1_groups, None)
+    r2_next = next(r2_groups, None)
+    while r1_next is not None or r2_next is not None:
+        if r2_next is None or (r1_next is not None and r1_next[0] < r2_next[0]):
+            for r1_variant in r1_next[1].values():
+                yield r1_variant, None
+            r1_next = next(r1_groups, None)
+        elif r1_next is None or r2_next[0] < r1_next[0]:
+            for r2_variant in r2_next[1].values():
+                yield None, r2_variant
+            r2_next = next(r2_groups, None)
+        else:
+            r1_group = r1_next[1]
+            r2_group = r2_next[1]
+            for key, r1_variant in r1_group.items():
+                yield r1_variant, r2_group.get(key)
+            for key, r2_variant in r2_group.items():
+                if key not in r1_group:
+                    yield None, r2_variant
+            r1_next = next(r1_groups, None)
+            r2_next = next(r2_groups, None)
+
+
+def iter_variant_pairs(
+    r1_vcf: PathObj, r2_vcf: PathObj, regions: Optional[List[Region]] = None
+) -> Iterator[VariantPair]:
+    r1_contigs, r2_contigs = read_pair(read_contig_order, r1_vcf, r2_vcf)
+    contig_order = ContigOrder(r1_contigs + r2_contigs)
+    # Each VCF is read on its own thread, ahead of the merge
+    r1_groups = iter_position_groups(
+        iter_read_ahead(iter_scored_variants(r1_vcf, regions)),
+        contig_order,
+        str(r1_vcf.real_path),
+    )
+    r2_groups = iter_position_groups(
+        iter_read_ahead(iter_scored_variants(r2_vcf, regions)),
+        contig_order,
+        str(r2_vcf.real_path),
+    )
+    return merge_join(r1_groups, r2_groups)
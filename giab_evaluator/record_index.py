@@ -0,0 +1,276 @@
+"""
+Index of the records of a VCF on their position, to read back the full
+records of a few variants without scanning the whole file.
+
+For BGZF files, the index holds the virtual offset of each record, that is
+the file offset of its block in the upper 48 bits and its offset within the
+inflated block in the lower 16. For uncompressed files, it holds the byte
+offset. Other gzip files cannot be read from an offset, and are not indexed.
+
+The index is sorted on (contig, position). A variant is looked up with a
+binary search, and the records at its position are read until one has the
+same REF and ALT. Records are read through a RecordReader, which keeps the
+VCF open over all lookups.
+
+Indices are stored as .npz files, one per VCF path, holding the fingerprint
+(real path, size and mtime) of the VCF they were built from. An index of a
+changed file is rebuilt and replaces the stored one.
+"""
+
+from array import array
+import hashlib
+import os
+from pathlib import Path
+import tempfile
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from bgzf import inflate_block, is_bgzf, iter_blocks, read_block
+from classes import PathObj, ScoredVariant
+from stage_memo import get_fingerprint
+
+RECORD_INDEX_DIR = "record_index"
+# Bump when the stored content changes, to invalidate old indices
+RECORD_INDEX_VERSION = 1
+
+
+class RecordIndex:
+    """Offsets of the records of a VCF, sorted on contig and position"""
+
+    def __init__(
+        self,
+        vcf_path: Path,
+        is_bgzf: bool,
+        contigs: List[str],
+        keys: np.ndarray,
+        offsets: np.ndarray,
+    ):
+        self.vcf_path = vcf_path
+        self.is_bgzf = is_bgzf
+        self.contigs = contigs
+        self.contig_index = {contig: code for code, contig in enumerate(contigs)}
+        self.keys = keys
+        self.offsets = offsets
+
+    def get_offsets(self, variant: ScoredVariant) -> List[int]:
+        """Offsets of the records at the position of a variant"""
+        contig_code = self.contig_index.get(variant.chr)
+        if contig_code is None:
+            return []
+        key = (contig_code << 32) | variant.pos
+        first = int(np.searchsorted(self.keys, key, "left"))
+        last = int(np.searchsorted(self.keys, key, "right"))
+        return self.offsets[first:last].tolist()
+
+    def open(self) -> "RecordReader":
+        return RecordReader(self)
+
+
+class RecordReader:
+    """
+    Reads records of an indexed VCF from the file kept open. The last
+    inflated BGZF block is kept, as nearby records often share it.
+    """
+
+    def __init__(self, index: RecordIndex):
+        self.index = index
+        self.in_fh: BinaryIO = open(str(index.vcf_path), "rb")
+        self.block_offset: Optional[int] = None
+        self.block_data = b""
+        # Offset of the block after the kept one, None at the end of the file
+        self.next_block_offset: Optional[int] = None
+
+    def read_block_data(self, block_offset: int) -> bytes:
+        if block_offset != self.block_offset:
+            self.in_fh.seek(block_offset)
+            block = read_block(self.in_fh)
+            self.block_offset = block_offset
+            self.block_data = inflate_block(block[1]) if block is not None else b""
+            self.next_block_offset = self.in_fh.tell() if block is not None else None
+        return self.block_data
+
+    def read_line(self, offset: int) -> bytes:
+        if not self.index.is_bgzf:
+            self.in_fh.seek(offset)
+            return self.in_fh.readline().rstrip(b"\r\n")
+
+        # Lines can continue in the following blocks
+        parts: List[bytes] = []
+        data = self.read_block_data(offset >> 16)[offset & 0xFFFF :]
+        while True:
+            end = data.find(b"\n")
+            if end != -1:
+                parts.append(data[:end])
+                break
+            parts.append(data)
+            if self.next_block_offset is None:
+                break
+            data = self.read_block_data(self.next_block_offset)
+        return b"".join(parts).rstrip(b"\r\n")
+
+    def fetch_record(self, variant: ScoredVariant) -> Optional[str]:
+        """Full record line of a variant, or None if not in the VCF"""
+        for offset in self.index.get_offsets(variant):
+            line = self.read_line(offset)
+            fields = line.split(b"\t", 5)
+            if (
+                len(fields) > 4
+                and fields[3].decode() == variant.ref
+                and fields[4].decode() == variant.alt
+            ):
+                return line.decode()
+        return None
+
+    def close(self):
+        self.in_fh.close()
+
+    def __enter__(self) -> "RecordReader":
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+
+def iter_bgzf_lines(vcf_path: Path) -> Iterator[Tuple[bytes, int]]:
+    """
+    Lines of a BGZF file with their virtual offsets. Lines can span blocks,
+    and take the offset of their start.
+    """
+    carry = b""
+    carry_offset: Optional[int] = None
+    for block_offset, data in iter_blocks(vcf_path):
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if end == -1:
+                if start < len(data):
+                    if carry_offset is None:
+                        carry_offset = (block_offset << 16) | start
+                    carry += data[start:]
+                break
+            if carry_offset is not None:
+                yield carry + data[start:end], carry_offset
+                carry = b""
+                carry_offset = None
+            else:
+                yield data[start:end], (block_offset << 16) | start
+            start = end + 1
+    if carry_offset is not None:
+        yield carry, carry_offset
+
+
+def iter_text_lines(vcf_path: Path) -> Iterator[Tuple[bytes, int]]:
+    offset = 0
+    with open(str(vcf_path), "rb") as in_fh:
+        for line in in_fh:
+            yield line, offset
+            offset += len(line)
+
+
+def build_record_index(vcf: PathObj) -> Optional[RecordIndex]:
+    """Index the records of a VCF with one pass over it"""
+    vcf_path = vcf.real_path
+    vcf_is_bgzf = vcf.is_gzipped and is_bgzf(vcf_path)
+    if vcf.is_gzipped and not vcf_is_bgzf:
+        return None
+
+    contig_index: Dict[str, int] = {}
+    keys = array("q")
+    offsets = array("Q")
+    for line, offset in (
+        iter_bgzf_lines(vcf_path) if vcf_is_bgzf else iter_text_lines(vcf_path)
+    ):
+        if line.startswith(b"#") or len(line.strip()) == 0:
+            continue
+        contig, pos = line.split(b"\t", 2)[:2]
+        contig_code = contig_index.setdefault(contig.decode(), len(contig_index))
+        keys.append((contig_code << 32) | int(pos))
+        offsets.append(offset)
+
+    key_array = np.frombuffer(keys, dtype=np.int64)
+    order = np.argsort(key_array, kind="stable")
+    return RecordIndex(
+        vcf_path,
+        vcf_is_bgzf,
+        list(contig_index),
+        key_array[order],
+        np.frombuffer(offsets, dtype=np.uint64)[order],
+    )
+
+
+def get_index_path(index_dir: Path, vcf: PathObj) -> Path:
+    real_path = os.path.realpath(str(vcf.real_path))
+    return index_dir / f"{hashlib.sha256(real_path.encode()).hexdigest()}.npz"
+
+
+def load_record_index(vcf: PathObj, index_path: Path) -> Optional[RecordIndex]:
+    if not index_path.exists():
+        return None
+    with np.load(str(index_path)) as stored:
+        if int(stored["version"]) != RECORD_INDEX_VERSION or str(
+            stored["fingerprint"]
+        ) != get_fingerprint(vcf):
+            return None
+        return RecordIndex(
+            vcf.real_path,
+            bool(stored["is_bgzf"]),
+            stored["contigs"].tolist(),
+            stored["keys"],
+            stored["offsets"],
+        )
+
+
+def store_record_index(vcf: PathObj, index: RecordIndex, index_path: Path):
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    # Written to a temporary file first, as stages can index the same
+    # baseline VCF at the same time
+    fd, tmp_path = tempfile.mkstemp(dir=str(index_path.parent), suffix=".npz")
+    with os.fdopen(fd, "wb") as out_fh:
+        np.savez(
+            out_fh,
+            version=np.array(RECORD_INDEX_VERSION),
+            fingerprint=np.array(get_fingerprint(vcf)),
+            is_bgzf=np.array(index.is_bgzf),
+            contigs=np.array(index.contigs, dtype=str),
+            keys=index.keys,
+            offsets=index.offsets,
+        )
+    os.replace(tmp_path, str(index_path))
+
+
+def get_record_index(vcf: PathObj, index_dir: Optional[Path]) -> Optional[RecordIndex]:
+    """Reuse the stored index of the VCF if it is current, else build it"""
+    index_path = get_index_path(index_dir, vcf) if index_dir is not None else None
+    if index_path is not None:
+        index = load_record_index(vcf, index_path)
+        if index is not None:
+            return index
+    index = build_record_index(vcf)
+    if index is not None and index_path is not None:
+        store_record_index(vcf, index, index_path)
+    return index
+
+
+class RecordSources:
+    """
+    Scored VCFs of both runs, from which the full records of the top
+    'max_records' differently scored variants are attached to the reports
+    """
+
+    def __init__(
+        self,
+        r1_vcf: PathObj,
+        r2_vcf: PathObj,
+        index_dir: Optional[Path],
+        max_records: int,
+        out_path: Optional[Path],
+    ):
+        self.r1_vcf = r1_vcf
+        self.r2_vcf = r2_vcf
+        self.index_dir = index_dir
+        self.max_records = max_records
+        self.out_path = out_path
+        # r2 calls matched to an r1 call at another position, such as SVs
+        # matched on overlap, keyed on the r1 call
+        self.moved_r2: Dict[str, ScoredVariant] = {}
@@ -0,0 +1,220 @@
+"""
+Machine-readable copies of the comparison results, next to the text reports.
+
+Each result table has a fixed, versioned schema, so that results of many
+comparisons can be concatenated and queried directly. Tables are written as
+JSON lines, or with pyarrow as Parquet or Arrow IPC files.
+"""
+
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Bump on any change to the columns or their types
+SCHEMA_VERSION = 1
+
+OUTPUT_FORMATS = ["text", "jsonl", "parquet", "arrow"]
+FILE_SUFFIXES = {"jsonl": ".jsonl", "parquet": ".parquet", "arrow": ".arrow"}
+# Rows buffered before being written as an Arrow record batch
+BATCH_SIZE = 65536
+
+# Columns present in all tables
+COMMON_COLUMNS = [
+    ("schema_version", "int64"),
+    ("run_id1", "string"),
+    ("run_id2", "string"),
+]
+
+TABLE_COLUMNS: Dict[str, List[Tuple[str, str]]] = {
+    "file_presence": [
+        ("path", "string"),
+        ("in_r1", "bool"),
+        ("in_r2", "bool"),
+    ],
+    "vcf_counts": [
+        ("path", "string"),
+        ("r1_count", "int64"),
+        ("r2_count", "int64"),
+    ],
+    "variant_presence": [
+        ("variant_type", "string"),
+        ("run", "string"),
+        ("chr", "string"),
+        ("pos", "int64"),
+        ("ref", "string"),
+        ("alt", "string"),
+        ("rank_score", "int64"),
+    ],
+    "score_diffs": [
+        ("variant_type", "string"),
+        ("chr", "string"),
+        ("pos", "int64"),
+        ("ref", "string"),
+        ("alt", "string"),
+        ("r1_rank_score", "int64"),
+        ("r2_rank_score", "int64"),
+        ("above_threshold", "bool"),
+        ("r1_sub_scores", "sub_scores"),
+        ("r2_sub_scores", "sub_scores"),
+    ],
+    "genotype_concordance": [
+        ("variant_type", "string"),
+        ("sample", "string"),
+        ("r1_genotype", "string"),
+        ("r2_genotype", "string"),
+        ("count", "int64"),
+    ],
+    "genotype_discordance": [
+        ("variant_type", "string"),
+        ("sample", "string"),
+        ("chr", "string"),
+        ("pos", "int64"),
+        ("ref", "string"),
+        ("alt", "string"),
+        ("r1_rank_score", "int64"),
+        ("r1_genotype", "string"),
+        ("r2_genotype", "string"),
+    ],
+}
+
+
+def get_arrow_type(column_type: str):
+    if column_type == "string":
+        return pyarrow.string()
+    if column_type == "int64":
+        return pyarrow.int64()
+    if column_type == "bool":
+        return pyarrow.bool_()
+    if column_type == "sub_scores":
+        return pyarrow.map_(pyarrow.string(), pyarrow.int64())
+    raise ValueError(f"Unknown column type: {column_type}")
+
+
+class ResultTableWriter:
+    """
+    Writes the rows of one result table. Values shared by all rows, such as
+    the run IDs, are given once as 'fixed_values'.
+    """
+
+    def __init__(
+        self,
+        out_path: Path,
+        table: str,
+        output_format: str,
+        fixed_values: Dict[str, Any],
+    ):
+        self.out_path = out_path
+        self.output_format = output_format
+        self.columns = COMMON_COLUMNS + TABLE_COLUMNS[table]
+        self.fixed_values = fixed_values
+        self._rows: List[Dict[str, Any]] = []
+        self._fh = None
+        self._arrow_writer = None
+        self._schema = None
+
+        if output_format == "jsonl":
+            self._fh = open(out_path, "w")
+        else:
+            self._schema = pyarrow.schema(
+                [
+                    (name, get_arrow_type(column_type))
+                    for name, column_type in self.columns
+                ],
+                metadata={"schema_version": str(SCHEMA_VERSION), "table": table},
+            )
+            if output_format == "parquet":
+                self._arrow_writer = pyarrow.parquet.ParquetWriter(
+                    str(out_path), self._schema
+                )
+            else:
+                self._arrow_writer = pyarrow.ipc.new_file(str(out_path), self._schema)
+
+    def append(self, row: Dict[str, Any]):
+        full_row = dict(self.fixed_values)
+        full_row.update(row)
+        if self._fh is not None:
+            print(
+                json.dumps({name: full_row.get(name) for name, _ in self.columns}),
+                file=self._fh,
+            )
+        else:
+            self._rows.append(full_row)
+            if len(self._rows) >= BATCH_SIZE:
+                self._write_batch()
+
+    def _write_batch(self):
+        columns = []
+        for name, column_type in self.columns:
+            values = [row.get(name) for row in self._rows]
+            if column_type == "sub_scores":
+                values = [
+                    list(value.items()) if value is not None else None
+                    for value in values
+                ]
+            columns.append(values)
+        batch = pyarrow.RecordBatch.from_arrays(
+            [
+                pyarrow.array(values, type=field.type)
+                for values, field in zip(columns, self._schema)
+            ],
+            schema=self._schema,
+        )
+        self._arrow_writer.write_batch(batch)
+        self._rows = []
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        if self._arrow_writer is not None:
+            if len(self._rows) > 0:
+                self._write_batch()
+            self._arrow_writer.close()
+            self._arrow_writer = None
+
+
+class ResultTables:
+    """Settings needed to open result tables, passed on to the comparison stages"""
+
+    def __init__(self, outdir: Path, output_format: str, run_id1: str, run_id2: str):
+        if output_format not in FILE_SUFFIXES:
+            raise ValueError(
+                f"Valid table formats are: {list(FILE_SUFFIXES)}, found: {output_format}"
+            )
+        if output_format != "jsonl" and pyarrow is None:
+            raise ValueError(
+                f"--output_format {output_format} requires pyarrow to be installed"
+            )
+        self.outdir = outdir
+        self.output_format = output_format
+        self.run_id1 = run_id1
+        self.run_id2 = run_id2
+
+    def open(self, name: str, table: str, **fixed_values: Any) -> ResultTableWriter:
+        out_path = self.outdir / f"{name}{FILE_SUFFIXES[self.output_format]}"
+        return ResultTableWriter(
+            out_path,
+            table,
+            self.output_format,
+            {
+                "schema_version": SCHEMA_VERSION,
+                "run_id1": self.run_id1,
+                "run_id2": self.run_id2,
+                **fixed_values,
+            },
+        )
+
+
+def open_result_table(
+    result_tables: Optional[ResultTables], name: str, table: str, **fixed_values: Any
+) -> Optional[ResultTableWriter]:
+    if result_tables is None:
+        return None
+    return result_tables.open(name, table, **fixed_values)
@@ -0,0 +1,262 @@
+"""
+Summary statistics over rank score changes between two runs.
+
+Computed column-wise with NumPy over the variants scored in both runs, it
+answers how scores shifted (delta distribution), how many variants moved
+across the score threshold, and which RankResult categories caused it.
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from classes import DiffScoredVariant, VariantTable
+
+
+class SubScoreAttribution:
+    """Changes in a single RankResult category among the rescored variants"""
+
+    def __init__(self):
+        self.nbr_changed = 0
+        self.nbr_increased = 0
+        self.nbr_decreased = 0
+        self.sum_delta = 0
+        self.sum_abs_delta = 0
+        self.nbr_changed_in_crossing = 0
+
+    def add(self, other: "SubScoreAttribution"):
+        self.nbr_changed += other.nbr_changed
+        self.nbr_increased += other.nbr_increased
+        self.nbr_decreased += other.nbr_decreased
+        self.sum_delta += other.sum_delta
+        self.sum_abs_delta += other.sum_abs_delta
+        self.nbr_changed_in_crossing += other.nbr_changed_in_crossing
+
+
+class ScoreDeltaSummary:
+    """
+    Rank score delta (r2 - r1) statistics. All fields are counts or sums, so
+    that summaries of separate shards can be added together.
+    """
+
+    def __init__(self, score_threshold: int, sub_score_names: List[str]):
+        self.score_threshold = score_threshold
+        self.sub_score_names = sub_score_names
+        self.nbr_unchanged = 0
+        self.delta_counts: Dict[int, int] = {}
+        self.nbr_crossing_up = 0
+        self.nbr_crossing_down = 0
+        self.attributions = {name: SubScoreAttribution() for name in sub_score_names}
+
+    @property
+    def nbr_changed(self) -> int:
+        return sum(self.delta_counts.values())
+
+    def add(self, other: "ScoreDeltaSummary"):
+        if other.sub_score_names != self.sub_score_names:
+            if len(self.sub_score_names) == 0:
+                self.sub_score_names = other.sub_score_names
+                self.attributions = {
+                    name: SubScoreAttribution() for name in other.sub_score_names
+                }
+            elif len(other.sub_score_names) > 0:
+                raise ValueError(
+                    f"Cannot merge summaries over different sub scores: {self.sub_score_names} and {other.sub_score_names}"
+                )
+        self.nbr_unchanged += other.nbr_unchanged
+        for delta, count in other.delta_counts.items():
+            self.delta_counts[delta] = self.delta_counts.get(delta, 0) + count
+        self.nbr_crossing_up += other.nbr_crossing_up
+        self.nbr_crossing_down += other.nbr_crossing_down
+        for name, attribution in other.attributions.items():
+            self.attributions[name].add(attribution)
+
+    def get_median_delta(self) -> Optional[float]:
+        if self.nbr_changed == 0:
+            return None
+        deltas = np.array(sorted(self.delta_counts))
+        counts = np.array([self.delta_counts[delta] for delta in deltas])
+        cumulative = np.cumsum(counts)
+        lower = deltas[np.searchsorted(cumulative, (self.nbr_changed + 1) // 2)]
+        upper = deltas[np.searchsorted(cumulative, self.nbr_changed // 2 + 1)]
+        return (lower + upper) / 2
+
+    def get_headline_lines(self, label_r1: str, label_r2: str) -> List[str]:
+        nbr_changed = self.nbr_changed
+        nbr_increased = sum(
+            count for delta, count in self.delta_counts.items() if delta > 0
+        )
+        lines = [
+            f"Variants scored in both runs: {self.nbr_unchanged + nbr_changed}",
+            f"Changed score: {nbr_changed} (increased: {nbr_increased}, decreased: {nbr_changed - nbr_increased})",
+        ]
+        if nbr_changed > 0:
+            sum_delta = sum(delta * count for delta, count in self.delta_counts.items())
+            lines.append(
+                f"Delta ({label_r2} - {label_r1}) among changed: mean {sum_delta / nbr_changed:.2f}, median {self.get_median_delta()}, min {min(self.delta_counts)}, max {max(self.delta_counts)}"
+            )
+        lines.append(
+            f"Crossing threshold {self.score_threshold}: up {self.nbr_crossing_up}, down {self.nbr_crossing_down}"
+        )
+        return lines
+
+    def get_table_lines(self) -> List[str]:
+        lines = ["Delta distribution", "delta\tcount"]
+        for delta in sorted(self.delta_counts):
+            lines.append(f"{delta}\t{self.delta_counts[delta]}")
+
+        if len(self.sub_score_names) == 0:
+            return lines
+        total_abs_delta = sum(
+            attribution.sum_abs_delta for attribution in self.attributions.values()
+        )
+        lines.extend(
+            [
+                "",
+                "Sub score attribution among changed variants",
+                "sub_score\tchanged\tincreased\tdecreased\tsum_delta\tsum_abs_delta\tshare_abs_delta\tchanged_in_crossing",
+            ]
+        )
+        for name in self.sub_score_names:
+            attribution = self.attributions[name]
+            share = (
+                attribution.sum_abs_delta / total_abs_delta
+                if total_abs_delta > 0
+                else 0
+            )
+            lines.append(
+                f"{name}\t{attribution.nbr_changed}\t{attribution.nbr_increased}\t{attribution.nbr_decreased}\t{attribution.sum_delta}\t{attribution.sum_abs_delta}\t{share:.3f}\t{attribution.nbr_changed_in_crossing}"
+            )
+        return lines
+
+
+def summarize_score_deltas(
+    r1_scores: np.ndarray,
+    r2_scores: np.ndarray,
+    r1_sub_scores: Optional[np.ndarray],
+    r2_sub_scores: Optional[np.ndarray],
+    sub_score_names: List[str],
+    score_threshold: int,
+) -> ScoreDeltaSummary:
+    """
+    Summarize the variants scored in both runs, given as aligned arrays of
+    rank scores and (optionally) sub score matrices with one row per variant.
+    """
+
+    summary = ScoreDeltaSummary(
+        score_threshold, sub_score_names if r1_sub_scores is not None else []
+    )
+    deltas = r2_scores.astype(np.int64) - r1_scores
+    changed = deltas != 0
+    summary.nbr_unchanged = int(np.count_nonzero(~changed))
+
+    changed_deltas, delta_counts = np.unique(deltas[changed], return_counts=True)
+    summary.delta_counts = dict(zip(changed_deltas.tolist(), delta_counts.tolist()))
+
+    r1_above = r1_scores >= score_threshold
+    r2_above = r2_scores >= score_threshold
+    crossing_up = ~r1_above & r2_above
+    crossing_down = r1_above & ~r2_above
+    summary.nbr_crossing_up = int(np.count_nonzero(crossing_up))
+    summary.nbr_crossing_down = int(np.count_nonzero(crossing_down))
+
+    if r1_sub_scores is not None and r2_sub_scores is not None:
+        sub_deltas = r2_sub_scores[changed].astype(np.int64) - r1_sub_scores[changed]
+        crossing = (crossing_up | crossing_down)[changed]
+        for col, name in enumerate(sub_score_names):
+            col_deltas = sub_deltas[:, col]
+            attribution = summary.attributions[name]
+            attribution.nbr_changed = int(np.count_nonzero(col_deltas))
+            attribution.nbr_increased = int(np.count_nonzero(col_deltas > 0))
+            attribution.nbr_decreased = int(np.count_nonzero(col_deltas < 0))
+            attribution.sum_delta = int(col_deltas.sum())
+            attribution.sum_abs_delta = int(np.abs(col_deltas).sum())
+            attribution.nbr_changed_in_crossing = int(
+                np.count_nonzero(col_deltas[crossing])
+            )
+
+    return summary
+
+
+def summarize_table_deltas(
+    table_r1: VariantTable,
+    table_r2: VariantTable,
+    shared_rows_r1: np.ndarray,
+    shared_rows_r2: np.ndarray,
+    score_threshold: int,
+) -> ScoreDeltaSummary:
+    scored = (
+        table_r1.has_rank_score[shared_rows_r1]
+        & table_r2.has_rank_score[shared_rows_r2]
+    )
+    rows_r1 = shared_rows_r1[scored]
+    rows_r2 = shared_rows_r2[scored]
+
+    sub_scores_r1: Optional[np.ndarray] = None
+    sub_scores_r2: Optional[np.ndarray] = None
+    # Rows lacking sub scores are zero-filled and so never attributed a change
+    if (
+        len(table_r1.sub_score_names) > 0
+        and table_r1.sub_score_names == table_r2.sub_score_names
+        and table_r1.sub_scores.shape[1] == table_r2.sub_scores.shape[1] > 0
+    ):
+        sub_scores_r1 = table_r1.sub_scores[rows_r1]
+        sub_scores_r2 = table_r2.sub_scores[rows_r2]
+
+    return summarize_score_deltas(
+        table_r1.rank_scores[rows_r1],
+        table_r2.rank_scores[rows_r2],
+        sub_scores_r1,
+        sub_scores_r2,
+        table_r1.sub_score_names,
+        score_threshold,
+    )
+
+
+def summarize_diff_scored_variants(
+    diff_scored_variants: List[DiffScoredVariant],
+    nbr_unchanged: int,
+    sub_score_names: List[str],
+    score_threshold: int,
+) -> ScoreDeltaSummary:
+    """
+    Summary built from the differing variants only, for comparisons that do
+    not keep the shared variants in memory
+    """
+    scored = [
+        diff
+        for diff in diff_scored_variants
+        if diff.r1.rank_score is not None and diff.r2.rank_score is not None
+    ]
+    r1_scores = np.array([diff.r1.rank_score for diff in scored], dtype=np.int64)
+    r2_scores = np.array([diff.r2.rank_score for diff in scored], dtype=np.int64)
+
+    sub_scores_r1: Optional[np.ndarray] = None
+    sub_scores_r2: Optional[np.ndarray] = None
+    if len(sub_score_names) > 0:
+        shape = (len(scored), len(sub_score_names))
+        sub_scores_r1 = np.array(
+            [
+                [diff.r1.sub_scores.get(name, 0) for name in sub_score_names]
+                for diff in scored
+            ],
+            dtype=np.int64,
+        ).reshape(shape)
+        sub_scores_r2 = np.array(
+            [
+                [diff.r2.sub_scores.get(name, 0) for name in sub_score_names]
+                for diff in scored
+            ],
+            dtype=np.int64,
+        ).reshape(shape)
+
+    summary = summarize_score_deltas(
+        r1_scores,
+        r2_scores,
+        sub_scores_r1,
+        sub_scores_r2,
+        sub_score_names,
+        score_threshold,
+    )
+    summary.nbr_unchanged += nbr_unchanged
+    return summary
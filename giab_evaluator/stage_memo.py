@@ -0,0 +1,212 @@
+"""
+Stage results memoised in the output folder, so that reruns on unchanged
+results only redo the reporting.
+
+Entries are stored in outdir/stage_memo and keyed on fingerprints (real
+path, size and mtime) of the files they were computed from. Settings that
+only affect the reports, such as the score threshold and the number of
+variants displayed, are not part of the keys, so changing them reuses the
+stored results.
+
+- Scored VCF comparisons are stored per variant type, as the variants only
+  found in one run and the differently scored variants
+- VCF record counts are stored per file
+- File content hashes are stored as by --cache_dir, if that is not given
+- Record indices of the scored VCFs are stored as by --cache_dir, if that is
+  not given (see record_index.py)
+"""
+
+import json
+import os
+from pathlib import Path
+import shutil
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from classes import (
+    DiffScoredVariant,
+    ScoredVariant,
+    SpooledVariants,
+    format_spooled_variant,
+    parse_spooled_variant,
+)
+from util import PathObj, count_variants_in_parallel
+
+MEMO_DIR = "stage_memo"
+# Bump when the stored content changes, to invalidate old entries
+MEMO_VERSION = 2
+META_FILE = "meta.json"
+R1_ONLY_FILE = "r1_only.txt"
+R2_ONLY_FILE = "r2_only.txt"
+SCORE_DIFFS_FILE = "score_diffs.jsonl"
+VCF_COUNTS_FILE = "vcf_counts.json"
+FILE_HASHES_FILE = "file_hashes.json"
+
+
+def get_fingerprint(path: PathObj) -> str:
+    real_path = os.path.realpath(str(path.real_path))
+    stat = os.stat(real_path)
+    return f"{real_path}\t{stat.st_size}\t{stat.st_mtime_ns}"
+
+
+class MemoizedScoredComparison:
+    """
+    Scored VCF comparison read back from the memo. Variants only found in
+    one run are spooled to disk, and differently scored variants are read
+    back as they are iterated, as when streaming.
+    """
+
+    def __init__(self, entry_dir: Path, meta: Dict[str, Any]):
+        self.nbr_common: int = meta["nbr_common"]
+        self.nbr_unchanged: int = meta["nbr_unchanged"]
+        self.sub_score_names_r1: List[str] = meta["sub_score_names_r1"]
+        self.sub_score_names_r2: List[str] = meta["sub_score_names_r2"]
+        self.r1_only = SpooledVariants()
+        self.r2_only = SpooledVariants()
+        for spooled, name in [
+            (self.r1_only, R1_ONLY_FILE),
+            (self.r2_only, R2_ONLY_FILE),
+        ]:
+            with open(entry_dir / name) as in_fh:
+                for line in in_fh:
+                    spooled.append(parse_spooled_variant(line.rstrip("\n")))
+
+        self.score_diffs_path = entry_dir / SCORE_DIFFS_FILE
+
+    def iter_diff_scored_variants(self) -> Iterator[DiffScoredVariant]:
+        """Differently scored variants, read from the memo as they are iterated"""
+        with open(self.score_diffs_path) as in_fh:
+            for line in in_fh:
+                chr, pos, ref, alt, r1_score, r2_score, r1_subs, r2_subs = json.loads(
+                    line
+                )
+                yield DiffScoredVariant(
+                    ScoredVariant(chr, pos, ref, alt, r1_score, r1_subs),
+                    ScoredVariant(chr, pos, ref, alt, r2_score, r2_subs),
+                )
+
+    def close(self):
+        self.r1_only.close()
+        self.r2_only.close()
+
+    def __enter__(self) -> "MemoizedScoredComparison":
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+
+class ScoreMemo:
+    """Memo entry of the comparison of one pair of scored VCFs"""
+
+    def __init__(
+        self,
+        memo_dir: Path,
+        name: str,
+        r1_vcf: PathObj,
+        r2_vcf: PathObj,
+        regions_key: Optional[List[str]],
+    ):
+        self.entry_dir = memo_dir / name
+        self.key = {
+            "version": MEMO_VERSION,
+            "r1": get_fingerprint(r1_vcf),
+            "r2": get_fingerprint(r2_vcf),
+            "regions": regions_key,
+        }
+
+    def load(self) -> Optional[MemoizedScoredComparison]:
+        meta_path = self.entry_dir / META_FILE
+        if not meta_path.exists():
+            return None
+        with open(meta_path) as in_fh:
+            meta = json.load(in_fh)
+        if meta.get("key") != self.key:
+            return None
+        return MemoizedScoredComparison(self.entry_dir, meta)
+
+    def store(
+        self,
+        r1_only: Iterable[ScoredVariant],
+        r2_only: Iterable[ScoredVariant],
+        nbr_common: int,
+        nbr_unchanged: int,
+        diff_scored_variants: Iterable[DiffScoredVariant],
+        sub_score_names_r1: List[str],
+        sub_score_names_r2: List[str],
+    ):
+        self.entry_dir.parent.mkdir(parents=True, exist_ok=True)
+        # Written to a temporary directory first, so that an interrupted run
+        # never leaves a partial entry behind
+        tmp_dir = Path(tempfile.mkdtemp(dir=str(self.entry_dir.parent), prefix=".tmp_"))
+        for variants, name in [(r1_only, R1_ONLY_FILE), (r2_only, R2_ONLY_FILE)]:
+            with open(tmp_dir / name, "w") as out_fh:
+                for variant in variants:
+                    print(format_spooled_variant(variant), file=out_fh)
+        with open(tmp_dir / SCORE_DIFFS_FILE, "w") as out_fh:
+            for variant in diff_scored_variants:
+                record = [
+                    variant.r1.chr,
+                    variant.r1.pos,
+                    variant.r1.ref,
+                    variant.r1.alt,
+                    variant.r1.rank_score,
+                    variant.r2.rank_score,
+                    variant.r1.sub_scores,
+                    variant.r2.sub_scores,
+                ]
+                print(json.dumps(record), file=out_fh)
+        with open(tmp_dir / META_FILE, "w") as out_fh:
+            json.dump(
+                {
+                    "key": self.key,
+                    "nbr_common": nbr_common,
+                    "nbr_unchanged": nbr_unchanged,
+                    "sub_score_names_r1": sub_score_names_r1,
+                    "sub_score_names_r2": sub_score_names_r2,
+                },
+                out_fh,
+            )
+        shutil.rmtree(str(self.entry_dir), ignore_errors=True)
+        os.rename(str(tmp_dir), str(self.entry_dir))
+
+
+def count_variants_memoized(
+    vcfs: List[PathObj], jobs: int, memo_dir: Optional[Path]
+) -> List[Optional[int]]:
+    """Record counts of the VCFs, only counting those not in the memo"""
+    if memo_dir is None:
+        return count_variants_in_parallel(vcfs, jobs)
+
+    memo_path = memo_dir / VCF_COUNTS_FILE
+    memo_counts: Dict[str, int] = {}
+    if memo_path.exists():
+        with open(memo_path) as in_fh:
+            stored = json.load(in_fh)
+        if stored.get("version") == MEMO_VERSION:
+            memo_counts = stored["counts"]
+
+    fingerprints = [get_fingerprint(vcf) for vcf in vcfs]
+    to_count = [
+        index
+        for index, fingerprint in enumerate(fingerprints)
+        if fingerprint not in memo_counts
+    ]
+    new_counts = count_variants_in_parallel([vcfs[index] for index in to_count], jobs)
+    for index, count in zip(to_count, new_counts):
+        # Unreadable files are retried on the next run
+        if count is not None:
+            memo_counts[fingerprints[index]] = count
+
+    if len(to_count) > 0:
+        memo_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(memo_dir))
+        with os.fdopen(fd, "w") as out_fh:
+            json.dump({"version": MEMO_VERSION, "counts": memo_counts}, out_fh)
+        os.replace(tmp_path, str(memo_path))
+
+    counts = dict(zip(to_count, new_counts))
+    return [
+        counts[index] if index in counts else memo_counts[fingerprint]
+        for index, fingerprint in enumerate(fingerprints)
+    ]
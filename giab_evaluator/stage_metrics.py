@@ -0,0 +1,166 @@
+"""
+Resource use of the evaluator stages.
+
+Wall time, CPU time, peak RSS, bytes read and VCF records processed are
+measured around each stage in the process running it. Optionally, each stage
+is also run under cProfile and its statistics dumped to file.
+
+Bytes read and peak RSS per stage rely on /proc and are only available on
+Linux. Elsewhere, bytes read are not reported and the peak RSS is that of the
+whole process.
+"""
+
+import cProfile
+from pathlib import Path
+import pstats
+import resource
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Number of functions listed in the text version of a profile
+PROFILE_TOP_FUNCTIONS = 40
+
+_records_lock = threading.Lock()
+_nbr_records = 0
+
+
+def add_records(nbr_records: int):
+    """Count VCF records processed in this process, VCFs may be read on threads"""
+    global _nbr_records
+    with _records_lock:
+        _nbr_records += nbr_records
+
+
+def get_records() -> int:
+    return _nbr_records
+
+
+def get_bytes_read() -> Optional[int]:
+    """Bytes passed through read calls by this process, including from page cache"""
+    try:
+        with open("/proc/self/io") as in_fh:
+            for line in in_fh:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak RSS of this process, so that it can be measured per stage"""
+    try:
+        with open("/proc/self/clear_refs", "w") as out_fh:
+            out_fh.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as in_fh:
+            for line in in_fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak_rss / 1024**2
+    return peak_rss / 1024
+
+
+def get_cpu_time() -> float:
+    """CPU time of this process and its finished child processes, such as shards"""
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+class StageMetrics:
+    """Resources used by one stage"""
+
+    def __init__(
+        self,
+        name: str,
+        wall_s: float,
+        cpu_s: float,
+        peak_rss_mb: float,
+        peak_rss_scope: str,
+        bytes_read: Optional[int],
+        records: int,
+        profile_path: Optional[Path],
+    ):
+        self.name = name
+        self.wall_s = wall_s
+        self.cpu_s = cpu_s
+        self.peak_rss_mb = peak_rss_mb
+        self.peak_rss_scope = peak_rss_scope
+        self.bytes_read = bytes_read
+        self.records = records
+        self.profile_path = profile_path
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "stage": self.name,
+            "wall_s": round(self.wall_s, 4),
+            "cpu_s": round(self.cpu_s, 4),
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+            "peak_rss_scope": self.peak_rss_scope,
+            "bytes_read": self.bytes_read,
+            "records": self.records,
+            "profile": str(self.profile_path) if self.profile_path else None,
+        }
+
+
+def write_profile(profiler: cProfile.Profile, profile_path: Path):
+    """Dump the raw statistics, loadable with pstats, next to a text summary"""
+    profiler.dump_stats(str(profile_path))
+    with open(profile_path.with_suffix(".txt"), "w") as out_fh:
+        stats = pstats.Stats(profiler, stream=out_fh)
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+
+
+def run_measured(
+    name: str,
+    func: Callable[..., T],
+    args: tuple,
+    profile_path: Optional[Path] = None,
+) -> Tuple[StageMetrics, T]:
+    """Call 'func', measuring its resource use and optionally profiling it"""
+
+    peak_rss_scope = "stage" if reset_peak_rss() else "process"
+    bytes_start = get_bytes_read()
+    records_start = get_records()
+    cpu_start = get_cpu_time()
+    wall_start = time.perf_counter()
+
+    profiler = cProfile.Profile() if profile_path is not None else None
+    if profiler is not None:
+        result = profiler.runcall(func, *args)
+    else:
+        result = func(*args)
+
+    bytes_end = get_bytes_read()
+    metrics = StageMetrics(
+        name,
+        time.perf_counter() - wall_start,
+        get_cpu_time() - cpu_start,
+        get_peak_rss_mb(),
+        peak_rss_scope,
+        (
+            bytes_end - bytes_start
+            if bytes_start is not None and bytes_end is not None
+            else None
+        ),
+        get_records() - records_start,
+        profile_path,
+    )
+    if profiler is not None and profile_path is not None:
+        write_profile(profiler, profile_path)
+    return metrics, result
@@ -0,0 +1,258 @@
+"""
+Matching of structural variant calls across runs on overlap, rather than on
+identical chr/pos/ref/alt keys.
+
+Breakpoints of SV calls commonly move by a few bases between runs. Two calls
+of the same type on the same contig are matched if their intervals overlap
+reciprocally by at least a given fraction, or if both of their breakends are
+within a given distance. Insertions and breakends have no length, and are
+only matched on distance.
+
+The calls of r2 are sorted on (contig, type, start). For each r1 call, the
+r2 calls that could match start within a window given by its length and the
+settings, which is found by binary search. The candidate pairs are scored and
+assigned one to one, the best ones first, in O(n log n) overall as long as
+the windows hold few calls.
+"""
+
+from array import array
+import re
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from classes import PathObj, VariantTable, VariantTableBuilder
+from tabix import Region
+from util import RowComparison, iter_scored_lines, parse_scored_record
+
+SV_TYPE_PATTERN = re.compile(b"(?:^|;)SVTYPE=([^;]+)")
+END_PATTERN = re.compile(b"(?:^|;)END=(\\d+)")
+SV_LENGTH_PATTERN = re.compile(b"(?:^|;)SVLEN=-?(\\d+)")
+SYMBOLIC_ALT_PATTERN = re.compile("^<([^:>]+)")
+
+
+class SvMatchSettings:
+    """How close two SV calls need to be to be considered the same call"""
+
+    def __init__(self, min_overlap: float, max_distance: int):
+        if not 0 < min_overlap <= 1:
+            raise ValueError(
+                f"The minimum reciprocal overlap must be above 0 and at most 1, found: {min_overlap}"
+            )
+        if max_distance < 0:
+            raise ValueError(
+                f"The maximum breakend distance cannot be negative, found: {max_distance}"
+            )
+        self.min_overlap = min_overlap
+        self.max_distance = max_distance
+
+    def __str__(self) -> str:
+        return f"reciprocal overlap >= {self.min_overlap} or breakends within {self.max_distance} bp"
+
+
+class SvTable:
+    """Variants of a scored SV VCF, with the type and end of each call"""
+
+    def __init__(
+        self,
+        variants: VariantTable,
+        sv_types: List[str],
+        type_codes: np.ndarray,
+        ends: np.ndarray,
+    ):
+        self.variants = variants
+        self.sv_types = sv_types
+        self.type_codes = type_codes
+        self.ends = ends
+
+    def __len__(self) -> int:
+        return len(self.variants)
+
+
+def get_sv_type(info: bytes, alt: str) -> str:
+    """SVTYPE, or the symbolic ALT allele, without subtypes such as DUP:TANDEM"""
+    match = SV_TYPE_PATTERN.search(info)
+    if match is not None:
+        return match.group(1).decode().split(":")[0].upper()
+    alt_match = SYMBOLIC_ALT_PATTERN.match(alt)
+    if alt_match is not None:
+        return alt_match.group(1).upper()
+    if "[" in alt or "]" in alt:
+        return "BND"
+    return "OTHER"
+
+
+def get_sv_end(info: bytes, pos: int, ref: str, sv_type: str) -> int:
+    match = END_PATTERN.search(info)
+    if match is not None:
+        return int(match.group(1))
+    length_match = SV_LENGTH_PATTERN.search(info)
+    if length_match is not None and sv_type != "INS":
+        return pos + int(length_match.group(1))
+    return pos + len(ref) - 1
+
+
+def parse_sv_table(vcf: PathObj, regions: Optional[List[Region]] = None) -> SvTable:
+    builder = VariantTableBuilder()
+    type_index: Dict[str, int] = {}
+    type_codes = array("H")
+    ends = array("q")
+    rank_sub_score_names = None
+    for line, rank_sub_score_names in iter_scored_lines(vcf, regions):
+        record = parse_scored_record(line, rank_sub_score_names)
+        builder.append(*record)
+        _chr, pos, ref, alt = record[:4]
+        fields = line.split(b"\t", 8)
+        info = fields[7] if len(fields) > 7 else b""
+        sv_type = get_sv_type(info, alt)
+        type_codes.append(type_index.setdefault(sv_type, len(type_index)))
+        ends.append(get_sv_end(info, pos, ref, sv_type))
+    return SvTable(
+        builder.build(rank_sub_score_names or []),
+        list(type_index),
+        np.frombuffer(type_codes, dtype=np.uint16),
+        np.frombuffer(ends, dtype=np.int64),
+    )
+
+
+class SvMatches:
+    """
+    Rows of the matched and unmatched calls, and for each matched pair its
+    reciprocal overlap and the distances between the starts and the ends
+    """
+
+    def __init__(
+        self,
+        rows: RowComparison,
+        reciprocal_overlaps: np.ndarray,
+        start_distances: np.ndarray,
+        end_distances: np.ndarray,
+    ):
+        self.rows = rows
+        self.reciprocal_overlaps = reciprocal_overlaps
+        self.start_distances = start_distances
+        self.end_distances = end_distances
+
+
+def get_group_codes(
+    table: SvTable, contig_index: Dict[str, int], type_index: Dict[str, int]
+) -> np.ndarray:
+    """Code of the contig and type of each call, shared between the runs"""
+    contig_lookup = np.array(
+        [
+            contig_index.setdefault(contig, len(contig_index))
+            for contig in table.variants.contigs
+        ],
+        dtype=np.int64,
+    )
+    type_lookup = np.array(
+        [type_index.setdefault(sv_type, len(type_index)) for sv_type in table.sv_types],
+        dtype=np.int64,
+    )
+    return (contig_lookup[table.variants.contig_codes] << 16) | type_lookup[
+        table.type_codes
+    ]
+
+
+def match_svs(
+    table_r1: SvTable, table_r2: SvTable, settings: SvMatchSettings
+) -> SvMatches:
+    contig_index: Dict[str, int] = {}
+    type_index: Dict[str, int] = {}
+    groups_r1 = get_group_codes(table_r1, contig_index, type_index)
+    groups_r2 = get_group_codes(table_r2, contig_index, type_index)
+    starts_r1 = table_r1.variants.positions.astype(np.int64)
+    starts_r2 = table_r2.variants.positions.astype(np.int64)
+    ends_r1 = np.maximum(table_r1.ends, starts_r1)
+    ends_r2 = np.maximum(table_r2.ends, starts_r2)
+
+    # r2 calls sorted on group and start, positions fit in 31 bits
+    sort_keys_r2 = (groups_r2 << 32) | starts_r2
+    order_r2 = np.argsort(sort_keys_r2, kind="stable")
+    sorted_keys_r2 = sort_keys_r2[order_r2]
+
+    # A call reaching the minimum reciprocal overlap with a call of length L
+    # starts at most (1 - f) * L after it, and at most (1 - f) / f * L before.
+    # Both are rounded up, as candidates are checked exactly below.
+    lengths_r1 = ends_r1 - starts_r1
+    overlap = settings.min_overlap
+    before = np.maximum(
+        settings.max_distance, np.ceil((1 - overlap) / overlap * lengths_r1)
+    ).astype(np.int64)
+    after = np.maximum(
+        settings.max_distance, np.ceil((1 - overlap) * lengths_r1)
+    ).astype(np.int64)
+    lows = np.searchsorted(
+        sorted_keys_r2, (groups_r1 << 32) | np.maximum(starts_r1 - before, 0), "left"
+    )
+    highs = np.searchsorted(
+        sorted_keys_r2, (groups_r1 << 32) | (starts_r1 + after), "right"
+    )
+
+    # All candidate pairs in the windows, as two flat arrays of rows
+    counts = highs - lows
+    cand_r1 = np.repeat(np.arange(len(starts_r1)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cand_r2 = order_r2[np.repeat(lows, counts) + offsets]
+
+    cand_starts_r1 = starts_r1[cand_r1]
+    cand_ends_r1 = ends_r1[cand_r1]
+    cand_starts_r2 = starts_r2[cand_r2]
+    cand_ends_r2 = ends_r2[cand_r2]
+    overlaps = np.clip(
+        np.minimum(cand_ends_r1, cand_ends_r2)
+        - np.maximum(cand_starts_r1, cand_starts_r2),
+        0,
+        None,
+    )
+    cand_lengths_r1 = cand_ends_r1 - cand_starts_r1
+    cand_lengths_r2 = cand_ends_r2 - cand_starts_r2
+    has_length = (cand_lengths_r1 > 0) & (cand_lengths_r2 > 0)
+    reciprocal = np.zeros(len(cand_r1), dtype=np.float64)
+    reciprocal[has_length] = overlaps[has_length] / np.maximum(
+        cand_lengths_r1[has_length], cand_lengths_r2[has_length]
+    )
+    start_distances = np.abs(cand_starts_r1 - cand_starts_r2)
+    end_distances = np.abs(cand_ends_r1 - cand_ends_r2)
+    breakend_distances = np.maximum(start_distances, end_distances)
+    is_match = (reciprocal >= overlap) | (breakend_distances <= settings.max_distance)
+
+    # Best pairs first: largest overlap, then closest breakends, then file order
+    candidates = np.flatnonzero(is_match)
+    candidates = candidates[
+        np.lexsort(
+            (
+                cand_r2[candidates],
+                cand_r1[candidates],
+                breakend_distances[candidates],
+                -reciprocal[candidates],
+            )
+        )
+    ]
+    used_r1 = np.zeros(len(starts_r1), dtype=np.bool_)
+    used_r2 = np.zeros(len(starts_r2), dtype=np.bool_)
+    matched: List[int] = []
+    for candidate, row_r1, row_r2 in zip(
+        candidates.tolist(),
+        cand_r1[candidates].tolist(),
+        cand_r2[candidates].tolist(),
+    ):
+        if not used_r1[row_r1] and not used_r2[row_r2]:
+            used_r1[row_r1] = True
+            used_r2[row_r2] = True
+            matched.append(candidate)
+
+    # Matched pairs in r1 file order
+    pairs = np.array(matched, dtype=np.int64)
+    pairs = pairs[np.argsort(cand_r1[pairs], kind="stable")]
+    return SvMatches(
+        RowComparison(
+            np.flatnonzero(~used_r1),
+            np.flatnonzero(~used_r2),
+            cand_r1[pairs],
+            cand_r2[pairs],
+        ),
+        reciprocal[pairs],
+        start_distances[pairs],
+        end_distances[pairs],
+    )
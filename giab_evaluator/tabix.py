@@ -0,0 +1,271 @@
+"""
+Region queries on BGZF compressed VCFs using their tabix (.tbi) or CSI index.
+
+Only the blocks pointed to by the index are decompressed, so comparing a gene
+panel or a handful of loci does not require reading the full VCFs.
+"""
+
+import gzip
+import io
+from pathlib import Path
+import re
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from bgzf import open_bgzf
+
+TBI_MAGIC = b"TBI\x01"
+CSI_MAGIC = b"CSI\x01"
+# Bin layout used by .tbi indices
+TBI_MIN_SHIFT = 14
+TBI_DEPTH = 5
+
+# Largest position representable in tabix indices
+MAX_POSITION = 2**31 - 1
+
+END_PATTERN = re.compile("(?:^|;)END=(\\d+)")
+REGION_PATTERN = re.compile("^([^:]+)(?::([\\d,]+)-([\\d,]+))?$")
+
+
+class Region:
+    """Genomic interval, 1-based and inclusive in both ends"""
+
+    def __init__(self, chrom: str, start: int, end: int):
+        self.chrom = chrom
+        self.start = start
+        self.end = end
+
+    def __str__(self) -> str:
+        return f"{self.chrom}:{self.start}-{self.end}"
+
+
+def parse_regions(regions_arg: str) -> List[Region]:
+    """
+    Parse a BED file path or comma separated regions (chr, chr:start-end).
+    Overlapping regions are merged.
+    """
+    regions: List[Region] = []
+    if Path(regions_arg).is_file():
+        with open(regions_arg) as in_fh:
+            for line in in_fh:
+                if line.startswith(("#", "track", "browser")) or not line.strip():
+                    continue
+                fields = line.rstrip("\n").split("\t")
+                # BED is 0-based and half-open
+                regions.append(Region(fields[0], int(fields[1]) + 1, int(fields[2])))
+    else:
+        for region_str in regions_arg.split(","):
+            match = REGION_PATTERN.match(region_str.strip())
+            if match is None:
+                raise ValueError(
+                    f"Regions must be a BED file or chr:start-end, found: {region_str}"
+                )
+            chrom, start, end = match.groups()
+            if start is None:
+                regions.append(Region(chrom, 1, MAX_POSITION))
+            else:
+                regions.append(
+                    Region(
+                        chrom, int(start.replace(",", "")), int(end.replace(",", ""))
+                    )
+                )
+    return merge_regions(regions)
+
+
+def merge_regions(regions: List[Region]) -> List[Region]:
+    merged: List[Region] = []
+    for region in sorted(regions, key=lambda region: (region.chrom, region.start)):
+        last = merged[-1] if len(merged) > 0 else None
+        if (
+            last is not None
+            and last.chrom == region.chrom
+            and region.start <= last.end + 1
+        ):
+            last.end = max(last.end, region.end)
+        else:
+            merged.append(Region(region.chrom, region.start, region.end))
+    return merged
+
+
+def reg2bins(beg: int, end: int, min_shift: int, depth: int) -> List[int]:
+    """
+    Bins overlapping the 0-based half-open interval [beg, end). As in htslib,
+    the end is capped at the largest position the bin layout covers, so
+    bins past it, such as the tabix pseudo-bin, are never returned.
+    """
+    bins: List[int] = []
+    shift = min_shift + depth * 3
+    end = min(end, 1 << shift)
+    if beg >= end:
+        return bins
+    end -= 1
+    level_start = 0
+    for level in range(depth + 1):
+        bins.extend(
+            range(level_start + (beg >> shift), level_start + (end >> shift) + 1)
+        )
+        level_start += 1 << (level * 3)
+        shift -= 3
+    return bins
+
+
+class TabixIndex:
+    """Parsed .tbi or .csi index, mapping contigs to their bins and chunks"""
+
+    def __init__(
+        self,
+        names: List[str],
+        min_shift: int,
+        depth: int,
+        bins: List[Dict[int, List[Tuple[int, int]]]],
+        linear_index: List[List[int]],
+    ):
+        self.names = names
+        self.min_shift = min_shift
+        self.depth = depth
+        self.bins = bins
+        self.linear_index = linear_index
+        self.contig_ids = {name: ref_id for ref_id, name in enumerate(names)}
+
+    def get_start_offset(self, region: Region) -> Optional[int]:
+        """
+        Virtual offset of the first block that may hold records overlapping
+        the region, or None if nothing overlaps it.
+        """
+        ref_id = self.contig_ids.get(region.chrom)
+        if ref_id is None:
+            return None
+
+        beg = region.start - 1
+        min_offset = 0
+        linear = self.linear_index[ref_id]
+        if len(linear) > 0:
+            min_offset = linear[min(beg >> self.min_shift, len(linear) - 1)]
+
+        start_offset: Optional[int] = None
+        ref_bins = self.bins[ref_id]
+        for bin in reg2bins(beg, region.end, self.min_shift, self.depth):
+            for chunk_beg, chunk_end in ref_bins.get(bin, []):
+                if chunk_end <= min_offset:
+                    continue
+                chunk_start = max(chunk_beg, min_offset)
+                if start_offset is None or chunk_start < start_offset:
+                    start_offset = chunk_start
+        return start_offset
+
+
+def find_index(vcf_path: Path) -> Optional[Path]:
+    for suffix in [".tbi", ".csi"]:
+        index_path = vcf_path.with_name(vcf_path.name + suffix)
+        if index_path.exists():
+            return index_path
+    return None
+
+
+def parse_names(data: bytes, offset: int) -> Tuple[List[str], int]:
+    """Parse the tabix header fields shared by .tbi and the .csi aux data"""
+    (l_nm,) = struct.unpack_from("<i", data, offset + 24)
+    names_start = offset + 28
+    names = data[names_start : names_start + l_nm].split(b"\x00")[:-1]
+    return [name.decode() for name in names], names_start + l_nm
+
+
+def load_index(vcf_path: Path) -> TabixIndex:
+    index_path = find_index(vcf_path)
+    if index_path is None:
+        raise ValueError(
+            f"Region queries need a tabix index (.tbi or .csi) next to: {vcf_path}"
+        )
+    with gzip.open(str(index_path), "rb") as in_fh:
+        data = in_fh.read()
+
+    bins: List[Dict[int, List[Tuple[int, int]]]] = []
+    linear_index: List[List[int]] = []
+    magic = data[:4]
+    if magic == TBI_MAGIC:
+        (n_ref,) = struct.unpack_from("<i", data, 4)
+        names, offset = parse_names(data, 8)
+        min_shift, depth = TBI_MIN_SHIFT, TBI_DEPTH
+    elif magic == CSI_MAGIC:
+        min_shift, depth, l_aux = struct.unpack_from("<3i", data, 4)
+        if l_aux < 28:
+            raise ValueError(f"CSI index lacks tabix meta data: {index_path}")
+        names, _ = parse_names(data, 16)
+        offset = 16 + l_aux
+        (n_ref,) = struct.unpack_from("<i", data, offset)
+        offset += 4
+    else:
+        raise ValueError(f"Unknown index format in: {index_path}")
+
+    for _ in range(n_ref):
+        ref_bins: Dict[int, List[Tuple[int, int]]] = {}
+        (n_bin,) = struct.unpack_from("<i", data, offset)
+        offset += 4
+        for _ in range(n_bin):
+            if magic == TBI_MAGIC:
+                bin, n_chunk = struct.unpack_from("<Ii", data, offset)
+                offset += 8
+            else:
+                # The per-bin linear offset of CSI is not used
+                bin, _loffset, n_chunk = struct.unpack_from("<IQi", data, offset)
+                offset += 16
+            chunks = struct.unpack_from(f"<{2 * n_chunk}Q", data, offset)
+            offset += 16 * n_chunk
+            ref_bins[bin] = list(zip(chunks[0::2], chunks[1::2]))
+        bins.append(ref_bins)
+
+        if magic == TBI_MAGIC:
+            (n_intv,) = struct.unpack_from("<i", data, offset)
+            offset += 4
+            linear_index.append(list(struct.unpack_from(f"<{n_intv}Q", data, offset)))
+            offset += 8 * n_intv
+        else:
+            linear_index.append([])
+
+    return TabixIndex(names, min_shift, depth, bins, linear_index)
+
+
+def get_record_end(pos: int, ref: str, info: str) -> int:
+    end = pos + len(ref) - 1
+    end_match = END_PATTERN.search(info)
+    if end_match is not None:
+        end = max(end, int(end_match.group(1)))
+    return end
+
+
+def iter_region_lines(vcf_path: Path, regions: List[Region]) -> Iterator[str]:
+    """
+    Yield the record lines of a bgzipped VCF overlapping any of the regions,
+    in file order. Records overlapping several regions are only yielded once.
+    """
+    index = load_index(vcf_path)
+    # Follow the contig order of the file, so that the output stays sorted
+    file_regions = sorted(
+        (region for region in regions if region.chrom in index.contig_ids),
+        key=lambda region: (index.contig_ids[region.chrom], region.start),
+    )
+
+    prev_chrom: Optional[str] = None
+    prev_end = 0
+    for region in file_regions:
+        if region.chrom != prev_chrom:
+            prev_end = 0
+        start_offset = index.get_start_offset(region)
+        if start_offset is not None:
+            with io.TextIOWrapper(
+                open_bgzf(vcf_path, threads=1, virtual_offset=start_offset)
+            ) as in_fh:
+                for line in in_fh:
+                    if line.startswith("#"):
+                        continue
+                    fields = line.split("\t", 8)
+                    pos = int(fields[1])
+                    if fields[0] != region.chrom or pos > region.end:
+                        break
+                    if pos <= prev_end:
+                        continue
+                    if get_record_end(pos, fields[3], fields[7]) < region.start:
+                        continue
+                    yield line
+        prev_chrom = region.chrom
+        prev_end = region.end
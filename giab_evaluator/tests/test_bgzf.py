@@ -0,0 +1,123 @@
+import gzip
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from bgzf import (
+    MAX_BLOCK_DATA,
+    BgzfError,
+    BgzfReader,
+    is_bgzf,
+    iter_blocks,
+    open_bgzf,
+    open_bgzf_writer,
+)
+from classes import PathObj, ScoredVariant
+from record_index import build_record_index, iter_bgzf_lines
+
+
+def write_bgzf(path: Path, data: bytes):
+    with open_bgzf_writer(path) as out_fh:
+        out_fh.write(data)
+
+
+def get_data(nbr_lines: int) -> bytes:
+    # Varying line lengths, so that lines end at any point of a block
+    return b"".join(
+        f"line {index}\t{'ACGT' * (index % 50)}\n".encode()
+        for index in range(nbr_lines)
+    )
+
+
+def get_vcf_lines(nbr_records: int) -> List[str]:
+    return [
+        f"chr{1 + index % 2}\t{1000 + index}\t.\tA\t{'ACGT' * (index % 97)}C\t50\tPASS\tRankScore=fam:{index % 30}"
+        for index in range(nbr_records)
+    ]
+
+
+@pytest.mark.parametrize("threads, read_ahead", [(1, 1), (4, 2), (4, 64)])
+def test_round_trip(tmp_path: Path, threads: int, read_ahead: int):
+    path = tmp_path / "data.gz"
+    data = get_data(20000)
+    assert len(data) > 4 * MAX_BLOCK_DATA
+    write_bgzf(path, data)
+
+    assert is_bgzf(path)
+    with BgzfReader(path, threads, read_ahead) as reader:
+        assert reader.readall() == data
+    with gzip.open(str(path), "rb") as in_fh:
+        assert in_fh.read() == data
+
+
+def test_empty_file_round_trip(tmp_path: Path):
+    path = tmp_path / "empty.gz"
+    write_bgzf(path, b"")
+    with open_bgzf(path) as in_fh:
+        assert in_fh.read() == b""
+    with gzip.open(str(path), "rb") as in_fh:
+        assert in_fh.read() == b""
+
+
+def test_read_from_virtual_offset(tmp_path: Path):
+    path = tmp_path / "data.gz"
+    data = get_data(20000)
+    write_bgzf(path, data)
+
+    data_start = 0
+    for block_offset, block_data in iter_blocks(path, read_ahead=2):
+        # The end of file block is empty
+        for within in [0, 1, len(block_data) - 1] if len(block_data) > 1 else []:
+            with open_bgzf(path, virtual_offset=(block_offset << 16) | within) as in_fh:
+                assert in_fh.read() == data[data_start + within :]
+        data_start += len(block_data)
+    assert data_start == len(data)
+
+
+def test_corrupt_block_fails_crc_check(tmp_path: Path):
+    path = tmp_path / "data.gz"
+    write_bgzf(path, get_data(20000))
+    content = bytearray(path.read_bytes())
+    # The CRC of the first block precedes its uncompressed size, which ends
+    # the block
+    first_block_size = int.from_bytes(content[16:18], "little") + 1
+    content[first_block_size - 8] ^= 0xFF
+    path.write_bytes(bytes(content))
+
+    for threads in [1, 4]:
+        with BgzfReader(path, threads) as reader:
+            with pytest.raises(BgzfError, match="CRC"):
+                reader.readall()
+
+
+def test_lines_spanning_blocks_keep_their_offsets(tmp_path: Path):
+    path = tmp_path / "lines.gz"
+    data = get_data(20000) + b"last line without newline"
+    write_bgzf(path, data)
+
+    lines = list(iter_bgzf_lines(path))
+    assert [line for line, _offset in lines] == data.split(b"\n")
+    assert any(
+        (offset & 0xFFFF) + len(line) >= MAX_BLOCK_DATA for line, offset in lines
+    )
+    for line, offset in lines:
+        with open_bgzf(path, threads=1, virtual_offset=offset) as in_fh:
+            assert in_fh.readline().rstrip(b"\n") == line
+
+
+def test_record_reader_fetches_records_spanning_blocks(tmp_path: Path):
+    path = tmp_path / "scored.vcf.gz"
+    records = get_vcf_lines(3000)
+    write_bgzf(path, ("##fileformat=VCFv4.2\n" + "\n".join(records) + "\n").encode())
+
+    index = build_record_index(PathObj(path, "run", "RUNID", tmp_path))
+    assert index is not None and index.is_bgzf
+    with index.open() as reader:
+        for record in records:
+            chr, pos, _id, ref, alt = record.split("\t")[:5]
+            variant = ScoredVariant(chr, int(pos), ref, alt, None, {})
+            assert reader.fetch_record(variant) == record
+        assert (
+            reader.fetch_record(ScoredVariant("chr1", 1000, "A", "G", None, {})) is None
+        )
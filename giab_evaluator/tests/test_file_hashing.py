@@ -0,0 +1,47 @@
+from pathlib import Path
+
+from classes import PathObj
+from file_hashing import FileHashCache
+
+
+def get_key(path: Path) -> str:
+    return FileHashCache.get_key(PathObj(path, "run", "RUNID", path.parent), False)
+
+
+def test_save_keeps_hashes_of_concurrent_runs(tmp_path: Path):
+    cache_path = tmp_path / "file_hashes.json"
+    file_a = tmp_path / "a.txt"
+    file_b = tmp_path / "b.txt"
+    file_a.write_text("a")
+    file_b.write_text("b")
+
+    # Both runs read the cache before either saves
+    cache_1 = FileHashCache(cache_path)
+    cache_2 = FileHashCache(cache_path)
+    cache_1.add(get_key(file_a), "hash_a")
+    cache_2.add(get_key(file_b), "hash_b")
+    cache_1.save()
+    cache_2.save()
+
+    hashes = FileHashCache(cache_path).hashes
+    assert hashes == {get_key(file_a): "hash_a", get_key(file_b): "hash_b"}
+
+
+def test_save_drops_changed_and_deleted_files(tmp_path: Path):
+    cache_path = tmp_path / "file_hashes.json"
+    changed = tmp_path / "changed.txt"
+    deleted = tmp_path / "deleted.txt"
+    kept = tmp_path / "kept.txt"
+    for path in [changed, deleted, kept]:
+        path.write_text("content")
+
+    cache = FileHashCache(cache_path)
+    for path in [changed, deleted, kept]:
+        cache.add(get_key(path), f"hash_{path.stem}")
+    cache.save()
+
+    changed.write_text("longer content")
+    deleted.unlink()
+    FileHashCache(cache_path).save()
+
+    assert FileHashCache(cache_path).hashes == {get_key(kept): "hash_kept"}
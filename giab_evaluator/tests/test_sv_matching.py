@@ -0,0 +1,90 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from classes import VariantTableBuilder
+from sv_matching import SvMatchSettings, SvTable, match_svs
+
+SETTINGS = SvMatchSettings(min_overlap=0.5, max_distance=100)
+
+
+def make_sv_table(calls: List[Tuple[str, int, int, str]]) -> SvTable:
+    """SV table of (chr, start, end, type) calls"""
+    builder = VariantTableBuilder()
+    type_index = {}
+    type_codes = []
+    for chr, start, end, sv_type in calls:
+        builder.append(chr, start, "N", f"<{sv_type}>", 0, None)
+        type_codes.append(type_index.setdefault(sv_type, len(type_index)))
+    return SvTable(
+        builder.build([]),
+        list(type_index),
+        np.array(type_codes, dtype=np.uint16),
+        np.array([end for _chr, _start, end, _type in calls], dtype=np.int64),
+    )
+
+
+def get_pairs(table_r1: SvTable, table_r2: SvTable) -> List[Tuple[int, int]]:
+    rows = match_svs(table_r1, table_r2, SETTINGS).rows
+    return list(zip(rows.shared_r1.tolist(), rows.shared_r2.tolist()))
+
+
+def test_shifted_del_is_matched():
+    table_r1 = make_sv_table([("chr1", 1000, 2000, "DEL")])
+    table_r2 = make_sv_table([("chr1", 1150, 2150, "DEL")])
+    matches = match_svs(table_r1, table_r2, SETTINGS)
+    assert matches.rows.shared_r1.tolist() == [0]
+    assert matches.rows.shared_r2.tolist() == [0]
+    assert matches.reciprocal_overlaps.tolist() == [0.85]
+    assert matches.start_distances.tolist() == [150]
+    assert matches.end_distances.tolist() == [150]
+
+
+def test_del_below_min_overlap_is_not_matched():
+    table_r1 = make_sv_table([("chr1", 1000, 2000, "DEL")])
+    table_r2 = make_sv_table([("chr1", 1600, 2600, "DEL")])
+    rows = match_svs(table_r1, table_r2, SETTINGS).rows
+    assert get_pairs(table_r1, table_r2) == []
+    assert rows.r1_only.tolist() == [0]
+    assert rows.r2_only.tolist() == [0]
+
+
+def test_small_del_within_max_distance_is_matched():
+    # Overlap 0.25, but both breakends are within 100 bp
+    table_r1 = make_sv_table([("chr1", 1000, 1080, "DEL")])
+    table_r2 = make_sv_table([("chr1", 1060, 1140, "DEL")])
+    assert get_pairs(table_r1, table_r2) == [(0, 0)]
+
+
+def test_ins_is_matched_on_distance():
+    table_r1 = make_sv_table([("chr1", 5000, 5000, "INS"), ("chr1", 9000, 9000, "INS")])
+    table_r2 = make_sv_table([("chr1", 5100, 5100, "INS"), ("chr1", 9101, 9101, "INS")])
+    rows = match_svs(table_r1, table_r2, SETTINGS).rows
+    assert get_pairs(table_r1, table_r2) == [(0, 0)]
+    assert rows.r1_only.tolist() == [1]
+    assert rows.r2_only.tolist() == [1]
+
+
+def test_different_type_or_contig_is_not_matched():
+    table_r1 = make_sv_table([("chr1", 1000, 2000, "DEL"), ("chr1", 5000, 6000, "DUP")])
+    table_r2 = make_sv_table([("chr1", 1000, 2000, "DUP"), ("chr2", 5000, 6000, "DUP")])
+    rows = match_svs(table_r1, table_r2, SETTINGS).rows
+    assert get_pairs(table_r1, table_r2) == []
+    assert rows.r1_only.tolist() == [0, 1]
+    assert rows.r2_only.tolist() == [0, 1]
+
+
+def test_competing_candidates_are_assigned_one_to_one():
+    # The first r1 call overlaps both r2 calls, but is assigned its exact
+    # match, leaving the other r2 call to the second r1 call
+    table_r1 = make_sv_table([("chr1", 1000, 2000, "DEL"), ("chr1", 1200, 2200, "DEL")])
+    table_r2 = make_sv_table([("chr1", 1190, 2190, "DEL"), ("chr1", 1000, 2000, "DEL")])
+    assert get_pairs(table_r1, table_r2) == [(0, 1), (1, 0)]
+
+
+def test_extra_candidate_is_left_unmatched():
+    table_r1 = make_sv_table([("chr1", 1000, 2000, "DEL")])
+    table_r2 = make_sv_table([("chr1", 1050, 2050, "DEL"), ("chr1", 1010, 2010, "DEL")])
+    rows = match_svs(table_r1, table_r2, SETTINGS).rows
+    assert get_pairs(table_r1, table_r2) == [(0, 1)]
+    assert rows.r2_only.tolist() == [0]
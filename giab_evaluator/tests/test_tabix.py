@@ -0,0 +1,50 @@
+from tabix import MAX_POSITION, TBI_DEPTH, TBI_MIN_SHIFT, reg2bins
+
+# Expected bins are those returned by htslib's reg2bins for the same intervals
+
+# Pseudo-bin of .tbi indices, holding per-contig offsets and counts
+TBI_PSEUDO_BIN = 37450
+
+
+def test_single_position():
+    assert reg2bins(0, 1, TBI_MIN_SHIFT, TBI_DEPTH) == [0, 1, 9, 73, 585, 4681]
+
+
+def test_interval_spanning_bins():
+    assert reg2bins(100000, 200000, TBI_MIN_SHIFT, TBI_DEPTH) == [
+        0,
+        1,
+        9,
+        73,
+        585,
+        586,
+        4687,
+        4688,
+        4689,
+        4690,
+        4691,
+        4692,
+        4693,
+    ]
+
+
+def test_end_is_capped_at_the_covered_length():
+    bins = reg2bins(0, MAX_POSITION, TBI_MIN_SHIFT, TBI_DEPTH)
+    assert bins == list(range(37449))
+    assert TBI_PSEUDO_BIN not in bins
+
+
+def test_interval_past_the_covered_length_has_no_bins():
+    assert reg2bins(1 << 29, MAX_POSITION, TBI_MIN_SHIFT, TBI_DEPTH) == []
+
+
+def test_deeper_csi_layout_is_not_capped_at_the_tbi_length():
+    assert reg2bins(1 << 29, (1 << 29) + 1, 14, 6) == [
+        0,
+        2,
+        17,
+        137,
+        1097,
+        8777,
+        70217,
+    ]
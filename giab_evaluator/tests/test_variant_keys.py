@@ -0,0 +1,130 @@
+from typing import List, Tuple
+
+import numpy as np
+import pytest
+
+from classes import IndexedVariantTable, VariantKeyEncoder, VariantTableBuilder
+
+POS_SHIFT = VariantKeyEncoder.ALLELE_BITS
+CONTIG_SHIFT = VariantKeyEncoder.POS_BITS + VariantKeyEncoder.ALLELE_BITS
+
+
+def encode_one(
+    encoder: VariantKeyEncoder, contig_code: int, pos: int, code: int
+) -> int:
+    return int(
+        encoder.encode(
+            np.array([contig_code], dtype=np.uint16),
+            np.array([pos], dtype=np.int64),
+            np.array([code], dtype=np.uint32),
+        )[0]
+    )
+
+
+def get_keys(
+    indexed: IndexedVariantTable, variants: List[Tuple[str, int, str, str]]
+) -> List[int]:
+    """Keys of variants, encoded as a table compared to the indexed one"""
+    builder = VariantTableBuilder()
+    for chr, pos, ref, alt in variants:
+        builder.append(chr, pos, ref, alt, 0, None)
+    keys, rows = builder.build([]).get_sorted_keys(indexed.get_encoder())
+    return keys[np.argsort(rows)].tolist()
+
+
+def test_largest_contig_code_and_position_keep_their_bits():
+    encoder = VariantKeyEncoder()
+    max_contig = (1 << VariantKeyEncoder.CONTIG_BITS) - 1
+    max_pos = (1 << VariantKeyEncoder.POS_BITS) - 1
+    code = encoder.get_allele_code("A", "T")
+    key = encode_one(encoder, max_contig, max_pos, code)
+    assert key >> CONTIG_SHIFT == max_contig
+    assert (key >> POS_SHIFT) & max_pos == max_pos
+    assert key & ((1 << POS_SHIFT) - 1) == code
+
+
+def test_contig_past_the_largest_code_is_rejected():
+    encoder = VariantKeyEncoder()
+    for index in range(1 << VariantKeyEncoder.CONTIG_BITS):
+        assert encoder.get_contig_code(f"contig{index}") == index
+    with pytest.raises(ValueError):
+        encoder.get_contig_code("one_too_many")
+
+
+def test_position_past_the_largest_is_rejected():
+    encoder = VariantKeyEncoder()
+    with pytest.raises(ValueError):
+        encode_one(encoder, 0, 1 << VariantKeyEncoder.POS_BITS, 0)
+
+
+def test_short_acgt_alleles_are_packed_inline():
+    encoder = VariantKeyEncoder()
+    codes = [
+        encoder.get_allele_code(ref, alt)
+        for ref, alt in [
+            ("A", "C"),
+            ("C", "A"),
+            ("AC", "A"),
+            ("A", "AC"),
+            ("ACGT", "TGC"),
+        ]
+    ]
+    assert len(set(codes)) == len(codes)
+    assert all(code & VariantKeyEncoder.SIDE_TABLE_FLAG == 0 for code in codes)
+    assert encoder.get_allele_code("ACGT", "TGC") == codes[-1]
+
+
+@pytest.mark.parametrize(
+    "ref, alt",
+    [("ACGT", "ACGT"), ("A", "AAAAAAAA"), ("N", "<DEL>"), ("A", "N"), ("a", "c")],
+)
+def test_long_or_non_acgt_alleles_go_to_the_side_table(ref: str, alt: str):
+    encoder = VariantKeyEncoder()
+    encoder.get_allele_code("N", "<DUP>")
+    code = encoder.get_allele_code(ref, alt)
+    assert code == VariantKeyEncoder.SIDE_TABLE_FLAG | 1
+    assert encoder.get_allele_code(ref, alt) == code
+
+
+def test_full_side_table_is_rejected():
+    class SmallSideTableEncoder(VariantKeyEncoder):
+        SIDE_TABLE_FLAG = 1 << 2
+
+    encoder = SmallSideTableEncoder()
+    for index in range(4):
+        encoder.get_allele_code("N", f"<INS{index}>")
+    with pytest.raises(ValueError):
+        encoder.get_allele_code("N", "<INS4>")
+
+
+def test_runs_encoded_with_the_baseline_encoder_get_equal_keys():
+    baseline_variants = [
+        ("chr1", 100, "A", "T"),
+        ("chr1", 200, "N", "<DEL>"),
+        ("chr2", 300, "ACGTACGT", "A"),
+    ]
+    builder = VariantTableBuilder()
+    for chr, pos, ref, alt in baseline_variants:
+        builder.append(chr, pos, ref, alt, 0, None)
+    baseline = IndexedVariantTable(builder.build([]))
+    baseline_keys = baseline.keys[np.argsort(baseline.rows)].tolist()
+
+    # Candidates list the variants in other orders, next to alleles and
+    # contigs the baseline does not have
+    keys_r2 = get_keys(
+        baseline,
+        [("chr3", 50, "N", "<DUP>"), ("chr2", 300, "ACGTACGT", "A")]
+        + baseline_variants[:2],
+    )
+    keys_r3 = get_keys(
+        baseline,
+        [("chr1", 200, "N", "<INV>")] + baseline_variants[::-1],
+    )
+    assert keys_r2[1:] == [baseline_keys[2], baseline_keys[0], baseline_keys[1]]
+    assert keys_r3[1:] == baseline_keys[::-1]
+    # New entries do not reuse the codes of the baseline
+    assert keys_r3[0] not in baseline_keys
+    assert keys_r2[0] not in baseline_keys
+
+    # Encoding candidates leaves the baseline encoder unchanged
+    assert get_keys(baseline, baseline_variants) == baseline_keys
@@ -1,12 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import os
 from pathlib import Path
+import queue
 import re
-from typing import Dict, Generic, List, Set, TypeVar, Union
-
-from classes import PathObj, ScoredVariant
+import threading
+import zlib
+from typing import (
+    Callable,
+    Collection,
+    Dict,
+    Generic,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+import numpy as np
+
+from classes import (
+    IndexedVariantTable,
+    PathObj,
+    ScoredVariant,
+    VariantKeyEncoder,
+    VariantTable,
+    VariantTableBuilder,
+)
+from stage_metrics import add_records
+from tabix import Region, iter_region_lines
 
 T = TypeVar("T")
 
+# chr, pos, ref, alt, rank score, rank sub scores
+ScoredRecord = Tuple[str, int, str, str, Optional[int], Optional[List[int]]]
+
+CONTIG_ID_PATTERN = re.compile("ID=([^,>]+)")
+RANK_SCORE_KEY = b"RankScore="
+RANK_SUB_SCORES_KEY = b"RankResult="
+SUB_SCORE_NAME_PATTERN = re.compile('ID=RankResult,.*Description="(.*)">')
+
+# Items handed over at once by a read-ahead thread, and batches kept ready
+READ_AHEAD_BATCH_SIZE = 1000
+READ_AHEAD_BATCHES = 16
+
 
 def setup_stdout_logger() -> logging.Logger:
     logger = logging.getLogger(__name__)
@@ -28,6 +68,41 @@ def add_file_logger(logger: logging.Logger, log_path: str):
     logger.addHandler(file_handler)
 
 
+class LogRecordCollector(logging.Handler):
+    """Keeps log records in memory, so that they can be replayed in another process"""
+
+    def __init__(self):
+        super().__init__()
+        self.records: List[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord):
+        # Format the message up front to make the record picklable
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+
+def run_with_captured_logs(
+    logger: logging.Logger, func: Callable[..., T], args: tuple
+) -> Tuple[List[logging.LogRecord], Optional[T], Optional[Exception]]:
+    """
+    Call 'func' while collecting the log records of 'logger' instead of
+    emitting them. Errors are returned rather than raised, so that the
+    records logged before the failure are not lost.
+    """
+    collector = LogRecordCollector()
+    original_handlers = logger.handlers
+    logger.handlers = [collector]
+    try:
+        result = func(*args)
+    except Exception as error:
+        return collector.records, None, error
+    finally:
+        logger.handlers = original_handlers
+    return collector.records, result, None
+
+
 def get_files_ending_with(pattern: str, paths: List[PathObj]) -> List[PathObj]:
     re_pattern = re.compile(pattern)
     matching = [path for path in paths if re.search(re_pattern, str(path)) is not None]
@@ -46,17 +121,6 @@ def get_single_file_ending_with(
     return matching[0]
 
 
-def any_is_parent(path: Path, names: List[str]) -> bool:
-    """
-    Among all parent dirs, does any match 'names'?
-    Useful to filter files in ignored folders
-    """
-    for parent in path.parents:
-        if parent.name in names:
-            return True
-    return False
-
-
 class Comparison(Generic[T]):
 
     # After Python 3.7 a @dataclass can be used instead
@@ -66,6 +130,59 @@ class Comparison(Generic[T]):
         self.shared = shared
 
 
+class RowComparison:
+    """Rows of two VariantTables that are only found in one of them, or in both"""
+
+    def __init__(
+        self,
+        r1_only: np.ndarray,
+        r2_only: np.ndarray,
+        shared_r1: np.ndarray,
+        shared_r2: np.ndarray,
+    ):
+        self.r1_only = r1_only
+        self.r2_only = r2_only
+        self.shared_r1 = shared_r1
+        self.shared_r2 = shared_r2
+
+
+def do_key_comparison(
+    table_r1: VariantTable, table_r2: VariantTable, encoder: VariantKeyEncoder
+) -> RowComparison:
+    """Compare variant presence as sorted integer key arrays instead of string sets"""
+    keys_r1, rows_r1 = table_r1.get_sorted_keys(encoder)
+    keys_r2, rows_r2 = table_r2.get_sorted_keys(encoder)
+    return compare_sorted_keys(keys_r1, rows_r1, keys_r2, rows_r2)
+
+
+def do_indexed_key_comparison(
+    indexed_r1: IndexedVariantTable, table_r2: VariantTable
+) -> RowComparison:
+    """Same as 'do_key_comparison', reusing the keys already computed for r1"""
+    keys_r2, rows_r2 = table_r2.get_sorted_keys(indexed_r1.get_encoder())
+    return compare_sorted_keys(indexed_r1.keys, indexed_r1.rows, keys_r2, rows_r2)
+
+
+def compare_sorted_keys(
+    keys_r1: np.ndarray,
+    rows_r1: np.ndarray,
+    keys_r2: np.ndarray,
+    rows_r2: np.ndarray,
+) -> RowComparison:
+    _shared_keys, shared_idx_r1, shared_idx_r2 = np.intersect1d(
+        keys_r1, keys_r2, assume_unique=True, return_indices=True
+    )
+    r1_only_mask = ~np.isin(keys_r1, keys_r2, assume_unique=True)
+    r2_only_mask = ~np.isin(keys_r2, keys_r1, assume_unique=True)
+
+    return RowComparison(
+        rows_r1[r1_only_mask],
+        rows_r2[r2_only_mask],
+        rows_r1[shared_idx_r1],
+        rows_r2[shared_idx_r2],
+    )
+
+
 def do_comparison(set_1: Set[T], set_2: Set[T]) -> Comparison[T]:
     """Can compare both str and Path objects, thus the generics"""
     common = set_1 & set_2
@@ -75,76 +192,304 @@ def do_comparison(set_1: Set[T], set_2: Set[T]) -> Comparison[T]:
     return Comparison(s1_only, s2_only, common)
 
 
-def parse_vcf(vcf: PathObj) -> Dict[str, ScoredVariant]:
+def parse_sub_score_names(header_line: str) -> List[str]:
+    match = SUB_SCORE_NAME_PATTERN.search(header_line)
+    if match is None:
+        raise ValueError(
+            f"Rankscore categories expected but not found in: ${header_line}"
+        )
+    match_string = match.group(1)
+    return match_string.split("|")
+
+
+def get_info_value(info: bytes, key: bytes) -> Optional[bytes]:
+    """Value of an INFO key, up to the next ';' or the end of INFO"""
+    # Keys are matched at the start of an INFO entry only
+    if info.startswith(key):
+        start = len(key)
+    else:
+        start = info.find(b";" + key)
+        if start == -1:
+            return None
+        start += 1 + len(key)
+    end = info.find(b";", start)
+    return info[start:end] if end != -1 else info[start:]
+
+
+def parse_rank_score(info: bytes) -> Optional[int]:
+    """Rank score of the form 'RankScore=family:score', the value after the last ':'"""
+    value = get_info_value(info, RANK_SCORE_KEY)
+    if value is None:
+        return None
+    return int(value[value.rfind(b":") + 1 :])
+
+
+def parse_rank_sub_scores(info: bytes) -> Optional[List[int]]:
+    """Sub scores of the form 'RankResult=1|-2|3'"""
+    value = get_info_value(info, RANK_SUB_SCORES_KEY)
+    if value is None:
+        return None
+    return [int(sub_score) for sub_score in value.split(b"|")]
+
 
-    rank_score_pattern = re.compile("RankScore=.+:(-?\\w+);")
-    rank_sub_scores_pattern = re.compile("RankResult=(-?\\d+(\\|-?\\d+)+)")
-    sub_score_name_pattern = re.compile('ID=RankResult,.*Description="(.*)">')
+def parse_scored_record(
+    line: bytes, rank_sub_score_names: Optional[List[str]]
+) -> ScoredRecord:
+    """
+    Parse the position, call and scores of a VCF line without building a
+    ScoredVariant. Only the first eight columns are split, and the rank
+    scores are found by searching the INFO bytes, so that long annotations
+    such as CSQ are neither decoded nor scanned by a regular expression.
+    """
+    # The sample columns are left unsplit, and the end of INFO is found with memchr
+    fields = line.split(b"\t", 7)
+    info_end = fields[7].find(b"\t")
+    info = fields[7][:info_end] if info_end != -1 else fields[7]
+    rank_score = parse_rank_score(info)
+    rank_sub_scores = parse_rank_sub_scores(info)
+    if rank_sub_scores is not None:
+        if rank_sub_score_names is None:
+            raise ValueError("Found rank sub scores, but not header")
+        assert len(rank_sub_score_names) == len(
+            rank_sub_scores
+        ), f"Length of sub score names and values should match, found {rank_sub_score_names} and {rank_sub_scores} in line: {line.decode()}"
+    return (
+        fields[0].decode(),
+        int(fields[1]),
+        fields[3].decode(),
+        fields[4].decode(),
+        rank_score,
+        rank_sub_scores,
+    )
+
+
+def parse_scored_variant(
+    line: bytes, rank_sub_score_names: Optional[List[str]]
+) -> ScoredVariant:
+    chr, pos, ref, alt, rank_score, rank_sub_scores = parse_scored_record(
+        line, rank_sub_score_names
+    )
+    sub_scores_dict: Dict[str, int] = {}
+    if rank_sub_scores is not None and rank_sub_score_names is not None:
+        sub_scores_dict = dict(zip(rank_sub_score_names, rank_sub_scores))
+    return ScoredVariant(chr, pos, ref, alt, rank_score, sub_scores_dict)
+
+
+def iter_scored_lines(
+    vcf: PathObj, regions: Optional[List[Region]] = None
+) -> Iterator[Tuple[bytes, Optional[List[str]]]]:
+    """
+    Yield the undecoded record lines of a scored VCF together with the rank
+    sub score names found in its header. If regions are given, only records
+    overlapping them are read, using the tabix index of the VCF.
+    """
+
+    rank_sub_score_names = None
+    nbr_records = 0
+
+    try:
+        with vcf.get_binary_filehandle() as in_fh:
+            for line in in_fh:
+                line = line.rstrip()
+                if line.startswith(b"#"):
+                    if rank_sub_score_names is None and line.startswith(
+                        b"##INFO=<ID=RankResult,"
+                    ):
+                        rank_sub_score_names = parse_sub_score_names(line.decode())
+                    continue
+                if regions is not None:
+                    break
+                nbr_records += 1
+                yield line, rank_sub_score_names
+
+        if regions is not None:
+            for text_line in iter_region_lines(vcf.real_path, regions):
+                nbr_records += 1
+                yield text_line.rstrip().encode(), rank_sub_score_names
+    finally:
+        add_records(nbr_records)
+
+
+def iter_scored_variants(
+    vcf: PathObj, regions: Optional[List[Region]] = None
+) -> Iterator[ScoredVariant]:
+    """Yield the variants of a scored VCF one at a time, in file order"""
+    for line, rank_sub_score_names in iter_scored_lines(vcf, regions):
+        yield parse_scored_variant(line, rank_sub_score_names)
+
+
+def parse_vcf(vcf: PathObj, regions: Optional[List[Region]] = None) -> VariantTable:
+    """
+    Parse a scored VCF into a columnar VariantTable. Only the rows that are
+    reported are later turned into ScoredVariant objects.
+    """
 
+    builder = VariantTableBuilder()
     rank_sub_score_names = None
+    for line, rank_sub_score_names in iter_scored_lines(vcf, regions):
+        builder.append(*parse_scored_record(line, rank_sub_score_names))
+    return builder.build(rank_sub_score_names or [])
 
-    variants: Dict[str, ScoredVariant] = {}
-    with vcf.get_filehandle() as in_fh:
-        for line in in_fh:
-            line = line.rstrip()
-            if line.startswith("#"):
-
-                if rank_sub_score_names is None and line.startswith(
-                    "##INFO=<ID=RankResult,"
-                ):
-                    match = sub_score_name_pattern.search(line)
-                    if match is None:
-                        raise ValueError(
-                            f"Rankscore categories expected but not found in: ${line}"
-                        )
-                    match_string = match.group(1)
-                    rank_sub_score_names = match_string.split("|")
-
-                continue
-            fields = line.split("\t")
-            chr = fields[0]
-            pos = int(fields[1])
-            ref = fields[3]
-            alt = fields[4]
-            info = fields[7]
-            rank_score_match = rank_score_pattern.search(info)
-
-            rank_score = None
-            if rank_score_match is not None:
-                rank_score = int(rank_score_match.group(1))
-
-            rank_sub_scores_match = rank_sub_scores_pattern.search(info)
-            rank_sub_scores = None
-            if rank_sub_scores_match is not None:
-                rank_sub_scores = [
-                    int(val) for val in rank_sub_scores_match.group(1).split("|")
-                ]
-
-            key = f"{chr}_{pos}_{ref}_{alt}"
-            sub_scores_dict: Dict[str, int] = {}
-            if rank_sub_scores is not None:
-                if rank_sub_score_names is None:
-                    raise ValueError("Found rank sub scores, but not header")
-                assert len(rank_sub_score_names) == len(
-                    rank_sub_scores
-                ), f"Length of sub score names and values should match, found {rank_sub_score_names} and {rank_sub_scores_match} in line: {line}"
-                sub_scores_dict = dict(zip(rank_sub_score_names, rank_sub_scores))
-            variant = ScoredVariant(chr, pos, ref, alt, rank_score, sub_scores_dict)
-            variants[key] = variant
-    return variants
-
-
-def count_variants(vcf: PathObj) -> int:
-
-    nbr_entries = 0
+
+def read_contig_order(vcf: PathObj) -> List[str]:
+    """Contig IDs in the order of the ##contig header lines"""
+    contigs: List[str] = []
     with vcf.get_filehandle() as in_fh:
         for line in in_fh:
-            line = line.rstrip()
-            if line.startswith("#"):
-                continue
-            nbr_entries += 1
+            if not line.startswith("#"):
+                break
+            if line.startswith("##contig=<"):
+                match = CONTIG_ID_PATTERN.search(line)
+                if match is not None:
+                    contigs.append(match.group(1))
+    return contigs
+
+
+def count_variants(vcf: PathObj, chunk_size: int = 1 << 20) -> Optional[int]:
+    """
+    Count the records of a VCF in a single pass over the decompressed bytes.
+    Newlines are counted per chunk, and header lines are subtracted by
+    counting newlines followed by '#'.
+
+    Returns None if the file cannot be read, replacing a separate validity check.
+    """
+
+    nbr_lines = 0
+    nbr_header_lines = 0
+    last_byte = b"\n"
+    try:
+        with vcf.get_binary_filehandle() as in_fh:
+            while True:
+                chunk = in_fh.read(chunk_size)
+                if not chunk:
+                    break
+                nbr_lines += chunk.count(b"\n")
+                nbr_header_lines += chunk.count(b"\n#")
+                if last_byte == b"\n" and chunk[:1] == b"#":
+                    nbr_header_lines += 1
+                last_byte = chunk[-1:]
+    except (OSError, EOFError, zlib.error):
+        return None
+
+    # Last line without a trailing newline
+    if last_byte != b"\n":
+        nbr_lines += 1
+    add_records(nbr_lines - nbr_header_lines)
+    return nbr_lines - nbr_header_lines
+
+
+def count_variants_in_parallel(vcfs: List[PathObj], jobs: int) -> List[Optional[int]]:
+    """
+    Count records of many VCFs on a thread pool. zlib releases the GIL while
+    inflating, so threads are sufficient to use multiple cores.
+    """
+    if jobs <= 1:
+        return [count_variants(vcf) for vcf in vcfs]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(count_variants, vcfs))
+
+
+def read_pair(read: Callable[[PathObj], T], r1: PathObj, r2: PathObj) -> Tuple[T, T]:
+    """
+    Read the r1 and r2 files at the same time, r1 on a separate thread. File
+    reads and zlib release the GIL, so the I/O latency and inflation of the
+    two files overlap.
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        r1_future = executor.submit(read, r1)
+        r2_result = read(r2)
+        return r1_future.result(), r2_result
+
+
+def iter_read_ahead(
+    items: Iterator[T],
+    batch_size: int = READ_AHEAD_BATCH_SIZE,
+    max_batches: int = READ_AHEAD_BATCHES,
+) -> Iterator[T]:
+    """
+    Pull 'items' on a background thread, with at most 'max_batches' batches
+    waiting to be consumed. Used when two inputs are consumed in turn, such
+    as in a merge join, so that the reading of both overlaps. Errors while
+    reading are raised in the consumer.
+    """
+
+    # Batches of items, an error or None once all items are read
+    batches: "queue.Queue[Union[List[T], BaseException, None]]" = queue.Queue(
+        max_batches
+    )
+    stopped = threading.Event()
+
+    def put(entry: Union[List[T], BaseException, None]) -> bool:
+        # Waits for room in the queue, unless the consumer has stopped
+        while not stopped.is_set():
+            try:
+                batches.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            batch: List[T] = []
+            for item in items:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    if not put(batch):
+                        return
+                    batch = []
+            if put(batch):
+                put(None)
+        except BaseException as error:
+            put(error)
+        finally:
+            # Closes the file of a generator abandoned by the consumer
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            entry = batches.get()
+            if entry is None:
+                return
+            if isinstance(entry, BaseException):
+                raise entry
+            yield from entry
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def walk_files(
+    dir: Path, ignore_dirs: Collection[str], follow_symlinks: bool
+) -> Tuple[List[Path], List[Path]]:
+    """
+    Find all files below 'dir' using os.scandir. Directories named as in
+    'ignore_dirs' are pruned without being entered. Symlinked directories,
+    such as the Nextflow 'work' folder, are only entered if 'follow_symlinks'.
+
+    Returns the files and the pruned directories.
+    """
 
-    return nbr_entries
+    files: List[Path] = []
+    pruned_dirs: List[Path] = []
+    dirs_to_visit = [str(dir)]
+    while len(dirs_to_visit) > 0:
+        with os.scandir(dirs_to_visit.pop()) as entries:
+            for entry in entries:
+                # The entry type comes from the directory listing itself, so
+                # no stat call is needed except for symlinks
+                if entry.is_dir(follow_symlinks=follow_symlinks):
+                    if entry.name in ignore_dirs:
+                        pruned_dirs.append(Path(entry.path))
+                    else:
+                        dirs_to_visit.append(entry.path)
+                elif entry.is_file():
+                    files.append(Path(entry.path))
+    return files, pruned_dirs
 
 
 def get_files_in_dir(
@@ -152,10 +497,13 @@ def get_files_in_dir(
     run_id: str,
     run_id_placeholder: str,
     base_dir: Path,
-) -> List[PathObj]:
+    ignore_dirs: Collection[str] = (),
+    follow_symlinks: bool = False,
+) -> Tuple[List[PathObj], List[Path]]:
+    """Files below 'dir', and the ignored directories relative to 'base_dir'"""
+    files, pruned_dirs = walk_files(dir, set(ignore_dirs), follow_symlinks)
     processed_files_in_dir = [
-        PathObj(path, run_id, run_id_placeholder, base_dir)
-        for path in dir.rglob("*")
-        if path.is_file()
+        PathObj(path, run_id, run_id_placeholder, base_dir) for path in files
     ]
-    return processed_files_in_dir
+    relative_pruned_dirs = [path.relative_to(base_dir) for path in pruned_dirs]
+    return processed_files_in_dir, relative_pruned_dirs
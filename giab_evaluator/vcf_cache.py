@@ -0,0 +1,188 @@
+"""
+On-disk cache of parsed scored VCFs.
+
+Each entry is a directory holding the columns of a VariantTable as .npy
+files, which are memory-mapped back in, and a JSON file with the interned
+contigs, alleles and sub score names. Entries are keyed on the fingerprint
+of the VCF (real path, size, mtime and optionally a content hash), so a
+changed file is never served from the cache.
+
+SV VCFs matched on overlap are stored with the type and end of each call, in
+entries of their own.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from classes import PathObj, VariantTable
+from sv_matching import SvTable
+
+# Bump when the on-disk layout changes, to invalidate old entries
+CACHE_FORMAT_VERSION = 1
+META_FILE = "meta.json"
+ARRAY_COLUMNS = [
+    "contig_codes",
+    "positions",
+    "ref_codes",
+    "alt_codes",
+    "rank_scores",
+    "has_rank_score",
+    "sub_scores",
+    "has_sub_scores",
+]
+SV_ARRAY_COLUMNS = ["type_codes", "ends"]
+SV_ENTRY_SUFFIX = "_sv"
+
+
+class ParsedVcfCache:
+    """
+    Cache of VariantTables with a total size cap. The least recently used
+    entries are evicted when the cap is exceeded.
+    """
+
+    def __init__(self, cache_dir: Path, max_size_bytes: int, hash_content: bool):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.hash_content = hash_content
+
+    def get_fingerprint(self, vcf: PathObj) -> str:
+        real_path = os.path.realpath(str(vcf.real_path))
+        stat = os.stat(real_path)
+        fingerprint = hashlib.sha256()
+        fingerprint.update(
+            f"{CACHE_FORMAT_VERSION}\t{real_path}\t{stat.st_size}\t{stat.st_mtime_ns}".encode()
+        )
+        if self.hash_content:
+            with open(real_path, "rb") as in_fh:
+                for chunk in iter(lambda: in_fh.read(1 << 20), b""):
+                    fingerprint.update(chunk)
+        return fingerprint.hexdigest()
+
+    def load(self, fingerprint: str) -> Optional[VariantTable]:
+        """Table of the VCF with the given fingerprint, if stored"""
+        entry = self.read_entry(self.cache_dir / fingerprint, [])
+        return entry[0] if entry is not None else None
+
+    def load_sv_table(self, fingerprint: str) -> Optional[SvTable]:
+        entry_dir = self.cache_dir / f"{fingerprint}{SV_ENTRY_SUFFIX}"
+        entry = self.read_entry(entry_dir, SV_ARRAY_COLUMNS)
+        if entry is None:
+            return None
+        variants, meta, columns = entry
+        return SvTable(
+            variants, meta["sv_types"], columns["type_codes"], columns["ends"]
+        )
+
+    def read_entry(
+        self, entry_dir: Path, extra_columns: List[str]
+    ) -> Optional[Tuple[VariantTable, Dict[str, Any], Dict[str, np.ndarray]]]:
+        meta_path = entry_dir / META_FILE
+        if not meta_path.exists():
+            return None
+
+        with open(meta_path) as in_fh:
+            meta = json.load(in_fh)
+        columns = {
+            column: np.load(str(entry_dir / f"{column}.npy"), mmap_mode="r")
+            for column in ARRAY_COLUMNS + extra_columns
+        }
+        # Mark as recently used
+        os.utime(str(meta_path))
+        table = VariantTable(
+            meta["contigs"],
+            meta["alleles"],
+            columns["contig_codes"],
+            columns["positions"],
+            columns["ref_codes"],
+            columns["alt_codes"],
+            columns["rank_scores"],
+            columns["has_rank_score"],
+            meta["sub_score_names"],
+            columns["sub_scores"],
+            columns["has_sub_scores"],
+        )
+        return table, meta, columns
+
+    def store(self, vcf: PathObj, fingerprint: str, table: VariantTable) -> List[Path]:
+        """
+        Store a table under the fingerprint its lookup used, and return the
+        entries evicted to stay below the size cap
+        """
+        return self.write_entry(vcf, self.cache_dir / fingerprint, table, {}, {})
+
+    def store_sv_table(
+        self, vcf: PathObj, fingerprint: str, table: SvTable
+    ) -> List[Path]:
+        return self.write_entry(
+            vcf,
+            self.cache_dir / f"{fingerprint}{SV_ENTRY_SUFFIX}",
+            table.variants,
+            {"sv_types": table.sv_types},
+            {"type_codes": table.type_codes, "ends": table.ends},
+        )
+
+    def write_entry(
+        self,
+        vcf: PathObj,
+        entry_dir: Path,
+        table: VariantTable,
+        extra_meta: Dict[str, Any],
+        extra_columns: Dict[str, np.ndarray],
+    ) -> List[Path]:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary directory first, so that concurrent runs never
+        # see partially written entries
+        tmp_dir = Path(tempfile.mkdtemp(dir=str(self.cache_dir), prefix=".tmp_"))
+        for column in ARRAY_COLUMNS:
+            np.save(str(tmp_dir / f"{column}.npy"), getattr(table, column))
+        for column, values in extra_columns.items():
+            np.save(str(tmp_dir / f"{column}.npy"), values)
+        meta = {
+            "source": str(vcf.real_path),
+            "contigs": table.contigs,
+            "alleles": table.alleles,
+            "sub_score_names": table.sub_score_names,
+            **extra_meta,
+        }
+        with open(tmp_dir / META_FILE, "w") as out_fh:
+            json.dump(meta, out_fh)
+        try:
+            os.rename(str(tmp_dir), str(entry_dir))
+        except OSError:
+            # Stored by another process in the meantime
+            shutil.rmtree(str(tmp_dir), ignore_errors=True)
+
+        return self.evict(keep=entry_dir)
+
+    def get_entries(self) -> List[Tuple[float, int, Path]]:
+        """Last used time, size and path of each complete entry"""
+        entries = []
+        for entry_dir in self.cache_dir.iterdir():
+            meta_path = entry_dir / META_FILE
+            if entry_dir.name.startswith(".") or not meta_path.exists():
+                continue
+            size = sum(path.stat().st_size for path in entry_dir.iterdir())
+            entries.append((meta_path.stat().st_mtime, size, entry_dir))
+        return entries
+
+    def evict(self, keep: Optional[Path] = None) -> List[Path]:
+        entries = sorted(self.get_entries())
+        total_size = sum(size for _, size, _ in entries)
+        evicted: List[Path] = []
+        for _last_used, size, entry_dir in entries:
+            if total_size <= self.max_size_bytes:
+                break
+            if entry_dir == keep:
+                continue
+            shutil.rmtree(str(entry_dir), ignore_errors=True)
+            total_size -= size
+            evicted.append(entry_dir)
+        return evicted
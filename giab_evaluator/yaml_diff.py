@@ -0,0 +1,159 @@
+"""
+Structural comparison of Scout YAML files.
+
+Both documents are parsed and run IDs are replaced by the placeholder, the
+same way as for file names in PathObj. The documents are then walked in
+parallel, reporting changes per key. Only the changed values and subtrees
+are printed, as small unified diff hunks.
+"""
+
+from typing import Any, List, Optional
+
+from classes import PathObj
+from util import read_pair
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# Keys used to match list items across the runs, such as the samples
+ID_KEYS = ["sample_id", "id", "name"]
+
+MISSING = object()
+
+
+class YamlChange:
+    """A value that was added, removed or changed at a path in the document"""
+
+    def __init__(self, path: str, r1_value: Any, r2_value: Any):
+        self.path = path
+        self.r1_value = r1_value
+        self.r2_value = r2_value
+
+    def get_kind(self) -> str:
+        if self.r1_value is MISSING:
+            return "added"
+        if self.r2_value is MISSING:
+            return "removed"
+        return "changed"
+
+    def get_diff_lines(self) -> List[str]:
+        lines = [f"@@ {self.path or '(root)'} ({self.get_kind()})"]
+        if self.r1_value is not MISSING:
+            lines.extend(f"-{line}" for line in format_value(self.r1_value))
+        if self.r2_value is not MISSING:
+            lines.extend(f"+{line}" for line in format_value(self.r2_value))
+        return lines
+
+
+def format_value(value: Any) -> List[str]:
+    if isinstance(value, (dict, list)):
+        return yaml.safe_dump(
+            value, default_flow_style=False, sort_keys=False, width=float("inf")
+        ).splitlines()
+    # The whole scalar on one line, with line breaks in strings escaped, and
+    # without the document end marker that follows plain scalars
+    lines = yaml.safe_dump(
+        value,
+        default_flow_style=True,
+        default_style='"' if isinstance(value, str) and "\n" in value else None,
+        width=float("inf"),
+    ).splitlines()
+    if len(lines) > 1 and lines[-1] == "...":
+        lines = lines[:-1]
+    return lines
+
+
+def load_yaml(path: PathObj) -> Any:
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with path.get_filehandle() as in_fh:
+        return yaml.load(in_fh, Loader=loader)
+
+
+def normalize_run_id(value: Any, run_id: str, placeholder: str) -> Any:
+    if isinstance(value, str):
+        return value.replace(run_id, placeholder)
+    if isinstance(value, dict):
+        return {
+            normalize_run_id(key, run_id, placeholder): normalize_run_id(
+                item, run_id, placeholder
+            )
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [normalize_run_id(item, run_id, placeholder) for item in value]
+    return value
+
+
+def get_list_id_key(r1_list: list, r2_list: list) -> Optional[str]:
+    """Key present and unique in all list items of both runs, if any"""
+    items = r1_list + r2_list
+    if len(items) == 0 or not all(isinstance(item, dict) for item in items):
+        return None
+    for id_key in ID_KEYS:
+        if all(isinstance(item.get(id_key), (str, int)) for item in items):
+            r1_ids = [item[id_key] for item in r1_list]
+            r2_ids = [item[id_key] for item in r2_list]
+            if len(set(r1_ids)) == len(r1_ids) and len(set(r2_ids)) == len(r2_ids):
+                return id_key
+    return None
+
+
+def join_path(path: str, key: Any) -> str:
+    return f"{path}.{key}" if path else str(key)
+
+
+def diff_values(r1_value: Any, r2_value: Any, path: str, changes: List[YamlChange]):
+    if isinstance(r1_value, dict) and isinstance(r2_value, dict):
+        for key, r1_item in r1_value.items():
+            diff_values(
+                r1_item, r2_value.get(key, MISSING), join_path(path, key), changes
+            )
+        for key, r2_item in r2_value.items():
+            if key not in r1_value:
+                changes.append(YamlChange(join_path(path, key), MISSING, r2_item))
+    elif isinstance(r1_value, list) and isinstance(r2_value, list):
+        id_key = get_list_id_key(r1_value, r2_value)
+        if id_key is not None:
+            r2_by_id = {item[id_key]: item for item in r2_value}
+            r1_ids = set()
+            for r1_item in r1_value:
+                r1_ids.add(r1_item[id_key])
+                diff_values(
+                    r1_item,
+                    r2_by_id.get(r1_item[id_key], MISSING),
+                    f"{path}[{id_key}={r1_item[id_key]}]",
+                    changes,
+                )
+            for r2_item in r2_value:
+                if r2_item[id_key] not in r1_ids:
+                    changes.append(
+                        YamlChange(
+                            f"{path}[{id_key}={r2_item[id_key]}]", MISSING, r2_item
+                        )
+                    )
+        else:
+            for index in range(max(len(r1_value), len(r2_value))):
+                diff_values(
+                    r1_value[index] if index < len(r1_value) else MISSING,
+                    r2_value[index] if index < len(r2_value) else MISSING,
+                    f"{path}[{index}]",
+                    changes,
+                )
+    elif (
+        r1_value is MISSING
+        or r2_value is MISSING
+        or type(r1_value) != type(r2_value)
+        or r1_value != r2_value
+    ):
+        changes.append(YamlChange(path, r1_value, r2_value))
+
+
+def compare_yaml_structure(yaml_r1: PathObj, yaml_r2: PathObj) -> List[YamlChange]:
+    r1_loaded, r2_loaded = read_pair(load_yaml, yaml_r1, yaml_r2)
+    r1_doc = normalize_run_id(r1_loaded, yaml_r1.run_id, yaml_r1.id_placeholder)
+    r2_doc = normalize_run_id(r2_loaded, yaml_r2.run_id, yaml_r2.id_placeholder)
+    changes: List[YamlChange] = []
+    diff_values(r1_doc, r2_doc, "", changes)
+    return changes